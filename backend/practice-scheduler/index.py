@@ -3,17 +3,115 @@ import os
 import psycopg2
 import urllib.request
 import random
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, List
 
+import llm_client
+
 SCHEMA = 't_p86463701_eloquent_school_site'
 
+# Пул заранее сгенерированных сообщений (см. proactive_message_pool)
+MESSAGE_TYPES = ['story', 'question', 'quiz']
+POOL_MIN_AVAILABLE = 5        # Если доступных шаблонов меньше - пополняем
+POOL_BATCH_SIZE = 8           # Сколько шаблонов генерировать за один вызов Gemini
+POOL_MAX_USES = 20            # После стольких отправок шаблон считается израсходованным
+POOL_MAX_REFILLS_PER_RUN = 15 # Ограничение вызовов Gemini за один запуск пополнения
+
+# Словарь транскрипций (см. word_phonetics) - бот берет IPA оттуда вместо вызова Gemini
+PHONETICS_BATCH_SIZE = 50         # Сколько слов в одном вызове Gemini
+PHONETICS_MAX_PER_RUN = 300       # Ограничение слов за один запуск
+
+# Схемы ответов Gemini (structured output, см. llm_client.generate_json)
+POOL_TEMPLATES_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {'messages': {'type': 'ARRAY', 'items': {'type': 'STRING'}}},
+    'required': ['messages']
+}
+
+PHONETICS_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'transcriptions': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {'word': {'type': 'STRING'}, 'ipa': {'type': 'STRING'}},
+                'required': ['word', 'ipa']
+            }
+        }
+    },
+    'required': ['transcriptions']
+}
+
+CONTEXT_BANK_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'items': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {
+                    'word': {'type': 'STRING'},
+                    'sentences': {'type': 'ARRAY', 'items': {'type': 'STRING'}}
+                },
+                'required': ['word', 'sentences']
+            }
+        }
+    },
+    'required': ['items']
+}
+
+ASSOCIATION_BANK_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'items': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {
+                    'word': {'type': 'STRING'},
+                    'hint_sets': {'type': 'ARRAY', 'items': {'type': 'ARRAY', 'items': {'type': 'STRING'}}}
+                },
+                'required': ['word', 'hint_sets']
+            }
+        }
+    },
+    'required': ['items']
+}
+
+# Банк упражнений для режимов "Контекст" и "Ассоциации" (см. exercise_bank)
+EXERCISE_TYPES = ['context', 'association']
+BANK_VARIANTS = 5                 # Вариантов на (слово, уровень, тип) за одно пополнение
+BANK_WORDS_PER_CALL = 10          # Слов в одном вызове Gemini
+BANK_MAX_USES = 30                # Как EXERCISE_BANK_MAX_USES в telegram-bot
+BANK_MIN_FRESH = 2                # Как EXERCISE_BANK_MIN_FRESH в telegram-bot
+BANK_MAX_WORDS_PER_RUN = 100      # Ограничение слов за один запуск
+
+# Телеметрия вызовов LLM (llm_calls): секции по дням
+LLM_CALLS_DAYS_AHEAD = 3          # На сколько дней вперед создавать секции
+LLM_CALLS_RETENTION_DAYS = 30     # Секции старше удаляются целиком
+
 def get_db_connection():
     """Создает подключение к БД"""
     conn = psycopg2.connect(os.environ['DATABASE_URL'])
     conn.autocommit = True
     return conn
 
+def load_llm_routes() -> List[Dict[str, Any]]:
+    """Маршруты задач LLM из админки (модель, лимит токенов, таймаут) - llm_client перечитывает их раз в 5 минут"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT task, model, max_output_tokens, timeout_seconds FROM {SCHEMA}.llm_task_routes "
+        f"WHERE is_active = TRUE"
+    )
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return [{'task': r[0], 'model': r[1], 'max_output_tokens': r[2], 'timeout_seconds': r[3]} for r in rows]
+
+llm_client.set_route_loader(load_llm_routes)
+
 def get_local_time_for_timezone(timezone_str: str) -> int:
     """Вычисляет локальный час для указанного timezone"""
     timezone_offsets = {
@@ -177,9 +275,8 @@ Requirements:
     
     return base_prompt
 
-def call_gemini(prompt: str) -> str:
+def call_gemini(prompt: str, max_output_tokens: int = 200) -> str:
     """Вызывает Gemini API через прокси"""
-    api_key = os.environ['GEMINI_API_KEY']
     proxy_url = os.environ.get('PROXY_URL', '')
     
     payload = {
@@ -188,27 +285,522 @@ def call_gemini(prompt: str) -> str:
         }],
         'generationConfig': {
             'temperature': 0.9,
-            'maxOutputTokens': 200
+            'maxOutputTokens': max_output_tokens
         }
     }
     
-    url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}'
+    # Раньше install_opener подменял глобальный opener (и прокси) для всех urlopen в инстансе
+    return llm_client.generate_text('gemini-1.5-flash', payload, proxy_url, timeout=30, task='proactive_message')
+
+def call_gemini_json(prompt: str, schema: Dict[str, Any], max_output_tokens: int, task: str, temperature: float = 0.9) -> Any:
+    """Вызывает Gemini в режиме structured output и возвращает JSON, проверенный по схеме"""
+    proxy_url = os.environ.get('PROXY_URL', '')
     
-    if proxy_url:
-        proxy_handler = urllib.request.ProxyHandler({'https': f'http://{proxy_url}'})
-        opener = urllib.request.build_opener(proxy_handler)
-        urllib.request.install_opener(opener)
+    payload = {
+        'contents': [{
+            'parts': [{'text': prompt}]
+        }],
+        'generationConfig': {
+            'temperature': temperature,
+            'maxOutputTokens': max_output_tokens
+        }
+    }
     
-    req = urllib.request.Request(
-        url,
-        data=json.dumps(payload).encode('utf-8'),
-        headers={'Content-Type': 'application/json'},
-        method='POST'
+    return llm_client.generate_json('gemini-1.5-flash', payload, schema, proxy_url, timeout=60, task=task)
+
+def get_topic_key(topic: Dict[str, str]) -> str:
+    """Нормализует тему студента в ключ пула"""
+    if not topic:
+        return 'general'
+    key = (topic.get('topic') or '').strip()
+    return key[:255] if key else 'general'
+
+def fill_pool_template(template: str, student_name: str, session_words: List[Dict[str, Any]]) -> str:
+    """Подставляет имя студента и слово в шаблон (локально, без Gemini)"""
+    message = template.replace('{name}', student_name)
+    
+    if '{word}' in message:
+        word = random.choice(session_words)['english'] if session_words else ''
+        message = message.replace('{word}', word)
+    
+    return message
+
+def take_pool_template(student_id: int, language_level: str, topic_key: str, message_type: str, has_words: bool) -> str:
+    """
+    Берет наименее использованный шаблон, который этому студенту еще не отправляли,
+    помечает его использованным и записывает в журнал отправок студента (один запрос)
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    topic_escaped = topic_key.replace("'", "''")
+    word_filter = '' if has_words else 'AND p.has_word_slot = FALSE '
+    
+    cur.execute(
+        f"WITH taken AS ("
+        f"UPDATE {SCHEMA}.proactive_message_pool SET "
+        f"times_used = times_used + 1, last_used_at = CURRENT_TIMESTAMP "
+        f"WHERE id = ("
+        f"SELECT p.id FROM {SCHEMA}.proactive_message_pool p "
+        f"WHERE p.language_level = '{language_level}' AND p.topic = '{topic_escaped}' "
+        f"AND p.message_type = '{message_type}' AND p.times_used < {POOL_MAX_USES} "
+        f"{word_filter}"
+        f"AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.proactive_pool_sends s "
+        f"WHERE s.template_id = p.id AND s.student_id = {student_id}) "
+        f"ORDER BY p.times_used ASC, RANDOM() LIMIT 1 FOR UPDATE SKIP LOCKED"
+        f") RETURNING id, template_text"
+        f"), logged AS ("
+        f"INSERT INTO {SCHEMA}.proactive_pool_sends (student_id, template_id) "
+        f"SELECT {student_id}, id FROM taken ON CONFLICT DO NOTHING"
+        f") SELECT template_text FROM taken"
     )
+    row = cur.fetchone()
     
-    with urllib.request.urlopen(req) as response:
-        result = json.loads(response.read().decode('utf-8'))
-        return result['candidates'][0]['content']['parts'][0]['text']
+    cur.close()
+    conn.close()
+    return row[0] if row else None
+
+def generate_pool_templates(language_level: str, topic_key: str, message_type: str, count: int = POOL_BATCH_SIZE) -> List[str]:
+    """Генерирует пачку шаблонов со слотами {name} и {word} одним вызовом Gemini"""
+    level_instructions = {
+        'A1': 'Use very simple words and short sentences.',
+        'A2': 'Use simple everyday vocabulary and clear sentences.',
+        'B1': 'Use common vocabulary and clear explanations.',
+        'B2': 'Use varied vocabulary and natural expressions.',
+        'C1': 'Use sophisticated vocabulary and complex structures.',
+        'C2': 'Use native-level vocabulary and expressions.'
+    }
+    
+    type_instructions = {
+        'story': 'Share a SHORT interesting story or fun fact, then ask "What do you think?" or similar',
+        'question': 'Ask an engaging open-ended question, thought-provoking but appropriate for the level',
+        'quiz': 'Create a fun mini-quiz or word challenge, interactive and educational'
+    }
+    
+    level_instruction = level_instructions.get(language_level, level_instructions['A1'])
+    topic_line = f"- Relate to this topic: {topic_key}" if topic_key != 'general' else "- Any everyday topic"
+    
+    prompt = f"""You are Anya, a friendly English tutor. Write {count} DIFFERENT {message_type} messages that engage a student in English practice.
+
+Language level: {language_level} ({level_instruction})
+
+Requirements for EACH message:
+- {type_instructions.get(message_type, type_instructions['question'])}
+{topic_line}
+- Write 2-4 sentences maximum
+- Be warm, enthusiastic, and natural
+- Use emoji naturally (but not too many!)
+- Write ONLY in English
+- Use the placeholder {{name}} exactly once where the student's name goes
+- In about half of the messages use the placeholder {{word}} once where a vocabulary word the student is learning goes (the word is any English noun/verb/adjective, so keep the sentence grammatical for any word)
+
+Put the messages into "messages"."""
+    
+    data = call_gemini_json(prompt, POOL_TEMPLATES_RESPONSE, max_output_tokens=2000, task='pool_templates')
+    
+    templates = []
+    for message in data['messages']:
+        if '{name}' in message:
+            templates.append(message.strip())
+    
+    return templates
+
+def save_pool_templates(language_level: str, topic_key: str, message_type: str, templates: List[str]):
+    """Сохраняет шаблоны в пул"""
+    if not templates:
+        return
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    topic_escaped = topic_key.replace("'", "''")
+    values = []
+    for template in templates:
+        template_escaped = template.replace("'", "''")
+        has_word_slot = 'TRUE' if '{word}' in template else 'FALSE'
+        values.append(f"('{language_level}', '{topic_escaped}', '{message_type}', '{template_escaped}', {has_word_slot})")
+    
+    cur.execute(
+        f"INSERT INTO {SCHEMA}.proactive_message_pool "
+        f"(language_level, topic, message_type, template_text, has_word_slot) "
+        f"VALUES {', '.join(values)}"
+    )
+    
+    cur.close()
+    conn.close()
+
+def get_pool_targets() -> List[tuple]:
+    """Возвращает все пары (уровень, тема), которые реально встречаются у студентов"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    cur.execute(
+        f"SELECT DISTINCT language_level, preferred_topics FROM {SCHEMA}.users WHERE role = 'student'"
+    )
+    
+    targets = set()
+    for row in cur.fetchall():
+        language_level = row[0] or 'A1'
+        targets.add((language_level, 'general'))
+        for topic in (row[1] or []):
+            targets.add((language_level, get_topic_key(topic)))
+    
+    cur.close()
+    conn.close()
+    return sorted(targets)
+
+def count_available_templates() -> Dict[tuple, int]:
+    """
+    Считает доступные шаблоны по (уровень, тема, тип) для студента, которому их
+    осталось меньше всех: неизрасходованные минус уже отправленные ему
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    cur.execute(
+        f"WITH unused AS ("
+        f"SELECT language_level, topic, message_type, COUNT(*) AS total "
+        f"FROM {SCHEMA}.proactive_message_pool WHERE times_used < {POOL_MAX_USES} "
+        f"GROUP BY language_level, topic, message_type"
+        f"), seen AS ("
+        f"SELECT p.language_level, p.topic, p.message_type, s.student_id, COUNT(*) AS sent "
+        f"FROM {SCHEMA}.proactive_pool_sends s "
+        f"JOIN {SCHEMA}.proactive_message_pool p ON p.id = s.template_id "
+        f"WHERE p.times_used < {POOL_MAX_USES} "
+        f"GROUP BY p.language_level, p.topic, p.message_type, s.student_id"
+        f") SELECT u.language_level, u.topic, u.message_type, u.total - COALESCE(MAX(seen.sent), 0) "
+        f"FROM unused u LEFT JOIN seen USING (language_level, topic, message_type) "
+        f"GROUP BY u.language_level, u.topic, u.message_type, u.total"
+    )
+    
+    counts = {(row[0], row[1], row[2]): row[3] for row in cur.fetchall()}
+    
+    cur.close()
+    conn.close()
+    return counts
+
+def refill_message_pool(max_refills: int = POOL_MAX_REFILLS_PER_RUN) -> int:
+    """Пополняет пул шаблонов там, где их осталось мало. Возвращает число новых шаблонов"""
+    counts = count_available_templates()
+    
+    # Сначала пополняем самые пустые комбинации
+    needed = []
+    for language_level, topic_key in get_pool_targets():
+        for message_type in MESSAGE_TYPES:
+            available = counts.get((language_level, topic_key, message_type), 0)
+            if available < POOL_MIN_AVAILABLE:
+                needed.append((available, language_level, topic_key, message_type))
+    needed.sort()
+    
+    generated = 0
+    for available, language_level, topic_key, message_type in needed[:max_refills]:
+        try:
+            templates = generate_pool_templates(language_level, topic_key, message_type)
+            save_pool_templates(language_level, topic_key, message_type, templates)
+            generated += len(templates)
+            print(f"[POOL] Refilled {language_level}/{topic_key}/{message_type}: {available} -> {available + len(templates)}")
+        except Exception as e:
+            print(f"[ERROR] Failed to refill pool {language_level}/{topic_key}/{message_type}: {e}")
+    
+    print(f"[POOL] Refill finished: {generated} templates for {min(len(needed), max_refills)}/{len(needed)} combinations")
+    return generated
+
+def get_words_without_phonetics(limit: int) -> List[str]:
+    """Слова из словаря, для которых еще нет транскрипции (сначала те, что учат студенты)"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    cur.execute(
+        f"SELECT LOWER(TRIM(w.english_text)) AS word, BOOL_OR(wp.word_id IS NOT NULL) AS in_progress "
+        f"FROM {SCHEMA}.words w "
+        f"LEFT JOIN {SCHEMA}.word_progress wp ON wp.word_id = w.id "
+        f"LEFT JOIN {SCHEMA}.word_phonetics p ON p.word = LOWER(TRIM(w.english_text)) "
+        f"WHERE p.word IS NULL AND TRIM(w.english_text) <> '' "
+        f"GROUP BY 1 ORDER BY in_progress DESC, word LIMIT {limit}"
+    )
+    
+    words = [row[0] for row in cur.fetchall()]
+    
+    cur.close()
+    conn.close()
+    return words
+
+def generate_phonetics_batch(words: List[str]) -> Dict[str, str]:
+    """Транскрипции пачки слов одним вызовом Gemini"""
+    words_json = json.dumps(words, ensure_ascii=False)
+    prompt = f"""Give the IPA phonetic transcription (British English) for each English word or phrase in this list:
+{words_json}
+
+One entry per item: "word" exactly as given, "ipa" - its transcription in slashes, e.g. "/ˈfæməli/"."""
+    
+    data = call_gemini_json(prompt, PHONETICS_RESPONSE, max_output_tokens=4000, task='phonetics_batch', temperature=0.2)
+    
+    # Берем только слова из запроса - лишние записи модели игнорируем
+    requested = set(words)
+    result = {}
+    for item in data['transcriptions']:
+        if item['word'] in requested:
+            transcription = llm_client.clean_transcription(item['ipa'])
+            if transcription:
+                result[item['word']] = transcription
+    return result
+
+def save_phonetics(transcriptions: Dict[str, str]):
+    """Сохраняет транскрипции в словарь одним INSERT"""
+    if not transcriptions:
+        return
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    values = []
+    for word, transcription in transcriptions.items():
+        word_escaped = word.replace("'", "''")
+        ipa_escaped = transcription.replace("'", "''")
+        values.append(f"('{word_escaped}', '{ipa_escaped}', 'backfill')")
+    
+    cur.execute(
+        f"INSERT INTO {SCHEMA}.word_phonetics (word, ipa, source) "
+        f"VALUES {', '.join(values)} ON CONFLICT (word) DO NOTHING"
+    )
+    
+    cur.close()
+    conn.close()
+
+def backfill_word_phonetics(max_words: int = PHONETICS_MAX_PER_RUN) -> int:
+    """Заполняет словарь транскрипций пачками. Возвращает число новых транскрипций"""
+    words = get_words_without_phonetics(max_words)
+    
+    saved = 0
+    for i in range(0, len(words), PHONETICS_BATCH_SIZE):
+        batch = words[i:i + PHONETICS_BATCH_SIZE]
+        try:
+            transcriptions = generate_phonetics_batch(batch)
+            save_phonetics(transcriptions)
+            saved += len(transcriptions)
+        except Exception as e:
+            print(f"[ERROR] Failed to backfill phonetics batch {i // PHONETICS_BATCH_SIZE + 1}: {e}")
+    
+    print(f"[PHONETICS] Backfill finished: {saved}/{len(words)} words")
+    return saved
+
+def get_bank_targets(include_prefill: bool, limit: int) -> List[tuple]:
+    """
+    Что пополнять в банке упражнений: (word_id, english, уровень, тип).
+    Сначала очередь от бота (варианты заканчиваются), затем - если include_prefill -
+    слова, которые студенты сейчас учат, но для которых в банке мало свежих вариантов
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    cur.execute(
+        f"SELECT q.word_id, w.english_text, q.language_level, q.exercise_type "
+        f"FROM {SCHEMA}.exercise_bank_queue q JOIN {SCHEMA}.words w ON w.id = q.word_id "
+        f"ORDER BY q.requested_at LIMIT {limit}"
+    )
+    targets = [tuple(row) for row in cur.fetchall()]
+    
+    if include_prefill and len(targets) < limit:
+        types_values = ', '.join(f"('{exercise_type}')" for exercise_type in EXERCISE_TYPES)
+        cur.execute(
+            f"SELECT DISTINCT wp.word_id, w.english_text, COALESCE(u.language_level, 'A1'), t.exercise_type "
+            f"FROM {SCHEMA}.word_progress wp "
+            f"JOIN {SCHEMA}.words w ON w.id = wp.word_id "
+            f"JOIN {SCHEMA}.users u ON u.telegram_id = wp.student_id "
+            f"CROSS JOIN (VALUES {types_values}) AS t(exercise_type) "
+            f"WHERE wp.status IN ('new', 'learning') AND ("
+            f"SELECT COUNT(*) FROM {SCHEMA}.exercise_bank b "
+            f"WHERE b.word_id = wp.word_id AND b.language_level = COALESCE(u.language_level, 'A1') "
+            f"AND b.exercise_type = t.exercise_type AND b.times_used < {BANK_MAX_USES}"
+            f") < {BANK_MIN_FRESH} "
+            f"LIMIT {limit - len(targets)}"
+        )
+        for row in cur.fetchall():
+            target = tuple(row)
+            if target not in targets:
+                targets.append(target)
+    
+    cur.close()
+    conn.close()
+    return targets
+
+def generate_bank_variants(words: List[str], language_level: str, exercise_type: str) -> Dict[str, List[str]]:
+    """Генерирует BANK_VARIANTS вариантов упражнения для пачки слов одним вызовом Gemini"""
+    words_json = json.dumps(words, ensure_ascii=False)
+    
+    if exercise_type == 'context':
+        task = f"""For each English word or phrase, write {BANK_VARIANTS} DIFFERENT simple sentences with a blank (___) where the word goes.
+- Natural and grammatically correct for level {language_level}
+- The sentence must make sense with the word in the blank
+- Use ___ exactly once
+
+Example item: {{"word": "book", "sentences": ["I read a ___ before bed", "This ___ has 300 pages"]}}"""
+        schema, field = CONTEXT_BANK_RESPONSE, 'sentences'
+    else:
+        task = f"""For each English word or phrase, write {BANK_VARIANTS} DIFFERENT sets of 3 short English associations (1-2 words each).
+- Hints clear but not too obvious, vocabulary simple enough for level {language_level}
+- Don't use the word itself or direct translations
+- Focus on: what it does, how it looks, where you find it, related concepts
+
+Example item: {{"word": "cat", "hint_sets": [["meow", "furry", "pet"], ["whiskers", "mouse", "purr"]]}}"""
+        schema, field = ASSOCIATION_BANK_RESPONSE, 'hint_sets'
+    
+    prompt = f"""{task}
+
+Words: {words_json}
+
+One item per word, "word" exactly as given."""
+    
+    data = call_gemini_json(prompt, schema, max_output_tokens=6000, task=f'exercise_bank_{exercise_type}')
+    
+    # Берем только слова из запроса - лишние записи модели игнорируем
+    by_word = {item['word']: item[field] for item in data['items'] if item['word'] in words}
+    
+    result = {}
+    for word in words:
+        variants = []
+        for variant in by_word.get(word) or []:
+            if exercise_type == 'context' and isinstance(variant, str) and '___' in variant:
+                variants.append(variant.strip())
+            elif exercise_type == 'association' and isinstance(variant, list) and len(variant) >= 3:
+                variants.append(json.dumps({'associations': [str(hint) for hint in variant[:3]]}, ensure_ascii=False))
+        if variants:
+            result[word] = variants[:BANK_VARIANTS]
+    return result
+
+def save_bank_variants(rows: List[tuple]):
+    """Сохраняет варианты упражнений (word_id, уровень, тип, содержимое) одним INSERT"""
+    if not rows:
+        return
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    values = []
+    for word_id, language_level, exercise_type, content in rows:
+        content_escaped = content.replace("'", "''")
+        values.append(f"({word_id}, '{language_level}', '{exercise_type}', '{content_escaped}')")
+    
+    cur.execute(
+        f"INSERT INTO {SCHEMA}.exercise_bank (word_id, language_level, exercise_type, content) "
+        f"VALUES {', '.join(values)}"
+    )
+    
+    cur.close()
+    conn.close()
+
+def clear_bank_queue(targets: List[tuple]):
+    """Удаляет обработанные запросы на пополнение из очереди"""
+    if not targets:
+        return
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    keys = ', '.join(f"({word_id}, '{language_level}', '{exercise_type}')" for word_id, _, language_level, exercise_type in targets)
+    cur.execute(
+        f"DELETE FROM {SCHEMA}.exercise_bank_queue "
+        f"WHERE (word_id, language_level, exercise_type) IN ({keys})"
+    )
+    
+    cur.close()
+    conn.close()
+
+def refill_exercise_bank(include_prefill: bool = False, max_words: int = BANK_MAX_WORDS_PER_RUN) -> int:
+    """Пополняет банк упражнений пачками по (уровень, тип). Возвращает число новых вариантов"""
+    targets = get_bank_targets(include_prefill, max_words)
+    
+    groups: Dict[tuple, List[tuple]] = {}
+    for target in targets:
+        groups.setdefault((target[2], target[3]), []).append(target)
+    
+    saved = 0
+    for (language_level, exercise_type), group in groups.items():
+        for i in range(0, len(group), BANK_WORDS_PER_CALL):
+            batch = group[i:i + BANK_WORDS_PER_CALL]
+            try:
+                variants = generate_bank_variants([target[1] for target in batch], language_level, exercise_type)
+                rows = []
+                for word_id, english, _, _ in batch:
+                    for content in variants.get(english, []):
+                        rows.append((word_id, language_level, exercise_type, content))
+                save_bank_variants(rows)
+                clear_bank_queue(batch)
+                saved += len(rows)
+            except Exception as e:
+                print(f"[ERROR] Failed to refill exercise bank {language_level}/{exercise_type}: {e}")
+    
+    print(f"[BANK] Refill finished: {saved} variants for {len(targets)} words")
+    return saved
+
+def ensure_llm_call_partitions() -> int:
+    """
+    Секции llm_calls по дням: создает на сегодня и LLM_CALLS_DAYS_AHEAD дней вперед (UTC),
+    удаляет старше LLM_CALLS_RETENTION_DAYS. Из llm_calls_default (строки дней без своей секции)
+    старые строки удаляются по тому же сроку. Возвращает число созданных секций
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT c.relname FROM pg_inherits i "
+        f"JOIN pg_class c ON c.oid = i.inhrelid "
+        f"JOIN pg_class p ON p.oid = i.inhparent "
+        f"JOIN pg_namespace n ON n.oid = p.relnamespace "
+        f"WHERE p.relname = 'llm_calls' AND n.nspname = '{SCHEMA}'"
+    )
+    existing = {row[0] for row in cur.fetchall()}
+    
+    today = datetime.now(timezone.utc).date()
+    created = 0
+    for offset in range(LLM_CALLS_DAYS_AHEAD + 1):
+        day = today + timedelta(days=offset)
+        name = f'llm_calls_{day:%Y%m%d}'
+        if name in existing:
+            continue
+        try:
+            cur.execute(
+                f"CREATE TABLE {SCHEMA}.{name} PARTITION OF {SCHEMA}.llm_calls "
+                f"FOR VALUES FROM ('{day} 00:00:00+00') TO ('{day + timedelta(days=1)} 00:00:00+00')"
+            )
+            created += 1
+        except Exception as e:
+            # Строки этого дня уже попали в llm_calls_default - день остается там
+            print(f"[WARNING] Failed to create partition {name}: {e}")
+    
+    cutoff = f'llm_calls_{today - timedelta(days=LLM_CALLS_RETENTION_DAYS):%Y%m%d}'
+    for name in sorted(existing):
+        if name != 'llm_calls_default' and name < cutoff:
+            cur.execute(f"DROP TABLE {SCHEMA}.{name}")
+            print(f"[INFO] Dropped old partition {name}")
+    
+    cur.execute(
+        f"DELETE FROM {SCHEMA}.llm_calls_default "
+        f"WHERE called_at < '{today - timedelta(days=LLM_CALLS_RETENTION_DAYS)} 00:00:00+00'"
+    )
+    if cur.rowcount:
+        print(f"[INFO] Deleted {cur.rowcount} old rows from llm_calls_default")
+    
+    cur.close()
+    conn.close()
+    return created
+
+def flush_llm_telemetry():
+    """Пишет накопленную телеметрию вызовов LLM в llm_calls одним запросом"""
+    if not llm_client.has_pending_telemetry():
+        return
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        flushed = llm_client.flush_telemetry(cur, SCHEMA, 'practice-scheduler')
+        cur.close()
+        conn.close()
+        print(f"[DEBUG] Flushed {flushed} LLM call events")
+    except Exception as e:
+        print(f"[WARNING] Failed to flush LLM telemetry: {e}")
+
+def is_off_peak() -> bool:
+    """Вне пиковых часов: большинство студентов (Москва) сейчас не получают сообщений"""
+    return not is_appropriate_time('Europe/Moscow')
 
 def send_telegram_message(chat_id: int, text: str):
     """Отправляет сообщение в Telegram"""
@@ -249,6 +841,14 @@ def update_last_practice_time(telegram_id: int):
     conn.close()
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Точка входа функции: запуск планировщика, затем телеметрия вызовов LLM пачкой"""
+    try:
+        return run_scheduler(event, context)
+    finally:
+        flush_llm_telemetry()
+        llm_client.set_telemetry_user(None)
+
+def run_scheduler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Practice Scheduler - отправляет проактивные сообщения от Ани студентам
     Запускается по cron (каждые 3 часа)
@@ -270,6 +870,51 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
+        body_str = event.get('body') or '{}'
+        try:
+            body_data = json.loads(body_str)
+        except Exception:
+            body_data = {}
+        
+        # Ручное/cron пополнение пула шаблонов без рассылки
+        if body_data.get('action') == 'refill_pool':
+            generated = refill_message_pool(body_data.get('max_refills', POOL_MAX_REFILLS_PER_RUN))
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'success': True, 'generated': generated}),
+                'isBase64Encoded': False
+            }
+        
+        # Ручное пополнение банка упражнений (очередь + слова, которые сейчас учат)
+        if body_data.get('action') == 'refill_exercise_bank':
+            saved = refill_exercise_bank(include_prefill=True, max_words=body_data.get('max_words', BANK_MAX_WORDS_PER_RUN))
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'success': True, 'saved': saved}),
+                'isBase64Encoded': False
+            }
+        
+        # Ручное заполнение словаря транскрипций без рассылки
+        if body_data.get('action') == 'backfill_phonetics':
+            saved = backfill_word_phonetics(body_data.get('max_words', PHONETICS_MAX_PER_RUN))
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'success': True, 'saved': saved}),
+                'isBase64Encoded': False
+            }
+        
         print("[INFO] Practice scheduler started")
         
         students = get_students_for_practice()
@@ -277,6 +922,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         sent_count = 0
         skipped_count = 0
+        pool_count = 0
+        live_count = 0
         
         for student in students:
             # Проверяем локальное время
@@ -292,25 +939,36 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 print(f"[SKIP] Student {student['telegram_id']} - daily limit reached ({messages_today}/5)")
                 continue
             
-            # Выбираем тип сообщения случайным образом
-            message_types = ['story', 'question', 'quiz']
-            message_type = random.choice(message_types)
+            # Выбираем тип сообщения и тему случайным образом
+            message_type = random.choice(MESSAGE_TYPES)
+            topic = random.choice(student['preferred_topics']) if student['preferred_topics'] else None
+            topic_key = get_topic_key(topic)
             
             # Получаем слова для практики
             session_words = get_session_words(student['telegram_id'], limit=5)
+            llm_client.set_telemetry_user(student['telegram_id'])
             
-            # Генерируем промпт
-            prompt = generate_practice_prompt(
-                message_type,
-                student['first_name'],
-                student['language_level'],
-                student['preferred_topics'],
-                session_words
-            )
-            
-            # Генерируем сообщение через Gemini
             try:
-                message = call_gemini(prompt)
+                # ⚡ Сначала берем готовый шаблон из пула - без вызова Gemini
+                template = take_pool_template(student['telegram_id'], student['language_level'], topic_key, message_type, bool(session_words))
+                
+                if template:
+                    message = fill_pool_template(template, student['first_name'], session_words)
+                    pool_count += 1
+                    print(f"[POOL] Hit {student['language_level']}/{topic_key}/{message_type} for {student['telegram_id']}")
+                else:
+                    # Пул пуст - генерируем вживую как раньше
+                    print(f"[POOL] Miss {student['language_level']}/{topic_key}/{message_type} - generating live")
+                    prompt = generate_practice_prompt(
+                        message_type,
+                        student['first_name'],
+                        student['language_level'],
+                        [topic] if topic else [],
+                        session_words
+                    )
+                    message = call_gemini(prompt)
+                    live_count += 1
+                
                 print(f"[DEBUG] Generated {message_type} for {student['telegram_id']}: {message[:50]}...")
                 
                 # Отправляем через Telegram
@@ -326,14 +984,47 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 print(f"[ERROR] Failed to generate/send message for {student['telegram_id']}: {e}")
                 continue
         
+        llm_client.set_telemetry_user(None)
+        
+        # Секции телеметрии вызовов LLM на ближайшие дни
+        partitions_created = 0
+        try:
+            partitions_created = ensure_llm_call_partitions()
+        except Exception as e:
+            print(f"[ERROR] LLM calls partitions failed: {e}")
+        
+        # Очередь банка упражнений разбираем каждый запуск, заполнение впрок - вне пиковых часов
+        off_peak = is_off_peak()
+        bank_saved = 0
+        try:
+            bank_saved = refill_exercise_bank(include_prefill=off_peak)
+        except Exception as e:
+            print(f"[ERROR] Exercise bank refill failed: {e}")
+        
+        # Вне пиковых часов пополняем пул на следующие рассылки и словарь транскрипций
+        pool_refilled = 0
+        phonetics_saved = 0
+        if off_peak:
+            pool_refilled = refill_message_pool()
+            try:
+                phonetics_saved = backfill_word_phonetics()
+            except Exception as e:
+                print(f"[ERROR] Phonetics backfill failed: {e}")
+        
         result = {
             'success': True,
             'sent': sent_count,
             'skipped': skipped_count,
+            'from_pool': pool_count,
+            'generated_live': live_count,
+            'pool_refilled': pool_refilled,
+            'phonetics_saved': phonetics_saved,
+            'exercise_bank_saved': bank_saved,
+            'llm_call_partitions_created': partitions_created,
             'total_students': len(students)
         }
         
-        print(f"[INFO] Practice scheduler finished: sent={sent_count}, skipped={skipped_count}")
+        print(f"[INFO] Practice scheduler finished: sent={sent_count}, skipped={skipped_count}, pool={pool_count}, live={live_count}")
         
         return {
             'statusCode': 200,
@@ -0,0 +1,110 @@
+"""
+Бюджет времени на обработку одного апдейта (дедлайн запроса).
+
+Раньше у каждого внешнего вызова в обработчике был свой фиксированный таймаут
+(Telegram 10 с, Gemini 12/25 с, Whisper 30 с, TTS 30 с), а update_word_progress_api
+и record_practice ждали webapp-api без таймаута вовсе. Голосовой ход складывал
+их подряд, выходил за лимит выполнения функции, платформа ее убивала - и студент
+не получал никакого ответа.
+
+Здесь дедлайн создается на входе в handler (start) из оставшегося времени функции
+(context.get_remaining_time_in_millis, если платформа его дает, иначе HANDLER_BUDGET)
+и живет в потоке обработчика. Внешний вызов берет таймаут через timeout(обычный):
+не больше обычного и не больше остатка бюджета минус резерв на ответ студенту
+(REPLY_RESERVE). Если на вызов времени уже нет - DeadlineExceeded (наследник
+TimeoutError), и обработчик уходит в запасной путь: текст вместо голоса,
+короткое сообщение вместо ответа. Сообщения в Telegram сами и есть ответ,
+поэтому они могут тратить резерв (reserve=0).
+
+Хедж в llm_client применяет ограничитель один раз в потоке обработчика: рабочие
+потоки хеджа получают уже урезанный таймаут (и остаток от него - для backup).
+
+Вне обработчика (фоновые потоки хеджа, локальный запуск) дедлайна нет -
+timeout() возвращает обычный таймаут. Рабочим потокам, которые делают часть
+ответа (озвучка по предложениям), дедлайн передается через bind(fn).
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+HANDLER_BUDGET = float(os.environ.get('HANDLER_TIME_BUDGET', '60'))  # секунды, если платформа не сообщает остаток
+PLATFORM_MARGIN = 1.0         # Запас до жесткого лимита платформы (ответ на webhook, логи)
+REPLY_RESERVE = 3.0           # Столько оставляем на запасной ответ студенту после упавшего вызова
+MIN_CALL_TIMEOUT = 1.0        # Меньше этого вызов не начинаем - он все равно не успеет
+
+_local = threading.local()
+
+class DeadlineExceeded(TimeoutError):
+    """
+    На внешний вызов не осталось времени в бюджете апдейта. Запрос не уходил - это не ошибка
+    прокси (log_proxy_failure ее не считает) и не ошибка общего вызова: ждущие в
+    llm_client.single_flight ее не наследуют (caller_local)
+    """
+    caller_local = True
+
+class Deadline:
+    """Момент, к которому обработка апдейта должна закончиться (по time.monotonic)"""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def timeout(self, preferred: float, reserve: float = REPLY_RESERVE, minimum: float = MIN_CALL_TIMEOUT) -> float:
+        """Таймаут вызова: обычный, но не дальше дедлайна минус reserve. DeadlineExceeded, если меньше minimum"""
+        available = self.remaining() - reserve
+        if available < minimum:
+            raise DeadlineExceeded(f'{max(available, 0):.1f}s left of {self.budget:.1f}s budget')
+        return min(preferred, available)
+
+    def has(self, seconds: float, reserve: float = REPLY_RESERVE) -> bool:
+        """Хватит ли времени на шаг длительностью seconds (с резервом на ответ)"""
+        return self.remaining() - reserve >= seconds
+
+def start(context: Any = None, budget: Optional[float] = HANDLER_BUDGET) -> Optional[Deadline]:
+    """
+    Создает дедлайн апдейта в текущем потоке. Остаток времени берется у платформы,
+    если она его сообщает, иначе budget; budget=None - без дедлайна, если платформа молчит
+    """
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if callable(get_remaining):
+        try:
+            budget = get_remaining() / 1000 - PLATFORM_MARGIN
+        except Exception as e:
+            print(f"[WARNING] Failed to read remaining time from context: {e}")
+    _local.deadline = Deadline(budget) if budget is not None else None
+    return _local.deadline
+
+def clear():
+    """Снимает дедлайн (конец обработки апдейта)"""
+    _local.deadline = None
+
+def bind(fn: Callable) -> Callable:
+    """Оборачивает fn для рабочего потока: внутри действует дедлайн текущего потока"""
+    bound_deadline = current()
+
+    def bound(*args, **kwargs):
+        _local.deadline = bound_deadline
+        return fn(*args, **kwargs)
+    return bound
+
+def current() -> Optional[Deadline]:
+    return getattr(_local, 'deadline', None)
+
+def timeout(preferred: float, reserve: float = REPLY_RESERVE, minimum: float = MIN_CALL_TIMEOUT) -> float:
+    """Таймаут внешнего вызова с учетом дедлайна апдейта (без дедлайна - preferred)"""
+    deadline = current()
+    return deadline.timeout(preferred, reserve, minimum) if deadline else preferred
+
+def has(seconds: float, reserve: float = REPLY_RESERVE) -> bool:
+    """Хватит ли времени на шаг длительностью seconds (без дедлайна - всегда да)"""
+    deadline = current()
+    return deadline.has(seconds, reserve) if deadline else True
+
+def remaining() -> Optional[float]:
+    """Остаток бюджета в секундах или None, если дедлайна нет"""
+    deadline = current()
+    return deadline.remaining() if deadline else None
@@ -0,0 +1,90 @@
+"""Окно истории диалога с бюджетом токенов и сводкой старых реплик"""
+import time
+from typing import Dict, List, Any, Callable, Tuple
+
+HISTORY_TOKEN_BUDGET = 1500      # Бюджет на сообщения истории в промпте
+MAX_HISTORY_MESSAGES = 15        # И не больше стольких сообщений
+MAX_MESSAGE_TOKENS = 300         # Одно сообщение истории обрезается до стольких токенов
+MAX_USER_MESSAGE_TOKENS = 1000   # Текущее сообщение студента - до стольких
+SUMMARY_MAX_TOKENS = 250         # Сводка в промпте - не длиннее
+SUMMARY_REFRESH_EVERY = 10       # Сворачиваем, когда за окном накопилось столько сообщений
+RECENT_FETCH_LIMIT = 40          # Сколько несвернутых сообщений читаем из БД
+
+_deferred: List[Tuple[Callable, tuple]] = []
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов"""
+    return len(text) // 4 + 1
+
+def clip_text(text: str, max_tokens: int) -> str:
+    """Обрезает текст до max_tokens (по оценке), стараясь не резать слово"""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    clipped = text[:max_chars]
+    space = clipped.rfind(' ', max_chars - 40)
+    if space > 0:
+        clipped = clipped[:space]
+    return clipped.rstrip() + ' …'
+
+def fit_history(history: List[Dict[str, str]], budget: int = HISTORY_TOKEN_BUDGET, max_messages: int = MAX_HISTORY_MESSAGES) -> List[Dict[str, str]]:
+    """
+    Свежие сообщения, которые влезают в бюджет (в хронологическом порядке).
+    Идем от последнего к первому и останавливаемся на первом не влезшем.
+    """
+    window = []
+    used = 0
+    for msg in reversed(history[-max_messages:]):
+        content = clip_text(msg['content'], MAX_MESSAGE_TOKENS)
+        tokens = estimate_tokens(content)
+        if used + tokens > budget:
+            break
+        used += tokens
+        window.append({'role': msg['role'], 'content': content})
+    window.reverse()
+    return window
+
+def needs_summary_refresh(unsummarized_count: int) -> bool:
+    """Пора ли сворачивать: за пределами окна накопилось SUMMARY_REFRESH_EVERY сообщений"""
+    return unsummarized_count >= MAX_HISTORY_MESSAGES + SUMMARY_REFRESH_EVERY
+
+def split_for_summary(messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Делит несвернутые сообщения на (те, что уходят в сводку, те, что остаются в окне)"""
+    return messages[:-MAX_HISTORY_MESSAGES], messages[-MAX_HISTORY_MESSAGES:]
+
+def build_summary_prompt(previous_summary: str, messages: List[Dict[str, Any]]) -> str:
+    """Промпт для обновления сводки: старая сводка + новые свернутые сообщения"""
+    lines = []
+    for msg in messages:
+        speaker = 'Student' if msg['role'] == 'user' else 'Anya'
+        lines.append(f"{speaker}: {clip_text(msg['content'], MAX_MESSAGE_TOKENS)}")
+    dialog = '\n'.join(lines)
+
+    return f'''You keep a running summary of a conversation between an English student and their tutor Anya.
+
+Previous summary:
+{previous_summary or '(none yet)'}
+
+New messages:
+{dialog}
+
+Write an updated summary in English, at most 120 words. Keep: facts the student shared about themselves,
+topics discussed, plans or promises made, and recurring mistakes. Drop greetings and small talk.
+Return ONLY the summary text.'''
+
+def defer(fn: Callable, *args):
+    """Откладывает фоновую работу до конца обработки апдейта"""
+    _deferred.append((fn, args))
+
+def run_deferred(time_limit: float = 10.0):
+    """Выполняет отложенные задачи (ответ студенту уже отправлен). Ошибки не пробрасываются"""
+    started = time.time()
+    while _deferred:
+        fn, args = _deferred.pop(0)
+        if time.time() - started > time_limit:
+            print(f"[WARNING] Deferred task {fn.__name__} skipped: time limit")
+            continue
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"[ERROR] Deferred task {fn.__name__} failed: {e}")
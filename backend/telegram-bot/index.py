@@ -8,12 +8,152 @@ import urllib.parse
 import random
 import re
 import requests
-import base64
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
 
+import llm_client
+import deadline
+import history_window
+import json_repair
+import mood_detector
+import multipart_stream
+import prompt_templates
+import proxy_health
+import sentence_pregrader
+import tts_cache
+import word_matcher
+
 SCHEMA = 't_p86463701_eloquent_school_site'
 
+# Half-open circuit breaker проверяет прокси дешевым GET метаданных модели
+proxy_health.set_probe(llm_client.probe)
+
+# Модель диалога по умолчанию (маршрут 'dialog' в llm_task_routes может ее заменить)
+DIALOG_MODEL = 'gemini-2.5-flash'
+
+# Банк заранее сгенерированных упражнений (см. exercise_bank, пополняет practice-scheduler)
+EXERCISE_BANK_MAX_USES = 30   # После стольких показов вариант считается израсходованным
+EXERCISE_BANK_MIN_FRESH = 2   # Если свежих вариантов осталось меньше - ставим слово в очередь на пополнение
+
+# Маркер, которым Gemini сообщает что студент освоил слово (вырезается из ответа)
+WORD_MASTERED_MARKER = '✅ WORD_MASTERED:'
+
+# Стриминг ответов в режиме диалога
+STREAM_DIALOG_REPLIES = os.environ.get('GEMINI_STREAMING', '1') == '1'
+STREAM_EDIT_INTERVAL = 1.0    # Не чаще одного editMessageText в секунду на чат
+STREAM_FIRST_MIN_CHARS = 60   # Первое сообщение - после первого предложения или стольких символов
+STREAM_TRUNCATED_NOTE = '(ответ прервался)'  # Приписка к ответу, стрим которого оборвался
+
+# Озвучка (OpenAI TTS) - параметры входят в ключ общего кэша озвучек (tts_cache)
+TTS_MODEL = 'tts-1'
+TTS_VOICE = 'nova'
+TTS_FORMAT = 'opus'
+
+# Длинный голосовой ответ озвучивается по предложениям: первое голосовое уходит, как только
+# готово первое предложение, остальные синтезируются параллельно и идут следом
+VOICE_PIPELINE_MIN_CHARS = 160  # Ответ короче - одно голосовое, как раньше
+VOICE_CHUNK_MIN_CHARS = 40      # Короткие предложения ("Great!") склеиваются со следующими
+VOICE_CHUNK_MAX_CHARS = 300     # Склеиваем предложения в голосовое после первого до такой длины
+VOICE_MAX_CHUNKS = 4            # Больше голосовых подряд - уже неудобно слушать, хвост идет последним куском
+VOICE_TTS_WORKERS = 3           # Одновременные синтезы кусков
+
+# Бюджет времени апдейта (см. deadline.py)
+VOICE_REPLY_MIN_SECONDS = 8   # Меньше осталось - отвечаем текстом вместо голоса
+WEBAPP_API_TIMEOUT = 5        # Прогресс слов и статистика практики в webapp-api
+DEADLINE_REPLY = '⏳ Не успела ответить вовремя - попробуй, пожалуйста, еще раз!'
+
+# Схемы ответов Gemini (structured output, см. llm_client.generate_json)
+_WORD_ITEM = {
+    'type': 'OBJECT',
+    'properties': {'english': {'type': 'STRING'}, 'russian': {'type': 'STRING'}},
+    'required': ['english', 'russian']
+}
+
+PLAN_BATCH_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'plan': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {
+                    'week': {'type': 'INTEGER'},
+                    'vocabulary': {'type': 'ARRAY', 'items': _WORD_ITEM},
+                    'phrases': {'type': 'ARRAY', 'items': _WORD_ITEM},
+                    'expressions': {'type': 'ARRAY', 'items': _WORD_ITEM}
+                },
+                'required': ['week', 'vocabulary', 'phrases', 'expressions']
+            }
+        }
+    },
+    'required': ['plan']
+}
+
+WORDS_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {'words': {'type': 'ARRAY', 'items': _WORD_ITEM}},
+    'required': ['words']
+}
+
+SENTENCE_CHECK_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'is_correct': {'type': 'BOOLEAN'},
+        'has_word': {'type': 'BOOLEAN'},
+        'grammar_ok': {'type': 'BOOLEAN'},
+        'feedback': {'type': 'STRING'},
+        'corrected': {'type': 'STRING'}
+    },
+    'required': ['is_correct', 'has_word', 'grammar_ok', 'feedback', 'corrected']
+}
+
+LEVEL_CHECK_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'actual_level': {'type': 'STRING', 'enum': ['A1', 'A2', 'B1', 'B2', 'C1']},
+        'is_correct': {'type': 'BOOLEAN'},
+        'correct_count': {'type': 'INTEGER'},
+        'reasoning': {'type': 'STRING'}
+    },
+    'required': ['actual_level', 'is_correct', 'correct_count', 'reasoning']
+}
+
+LEVEL_TEST_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'level': {'type': 'STRING', 'enum': ['A1', 'A2', 'B1', 'B2', 'C1', 'C2']},
+        'reasoning': {'type': 'STRING'}
+    },
+    'required': ['level', 'reasoning']
+}
+
+ADAPTIVE_QUESTION_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {'candidates': {'type': 'ARRAY', 'items': {'type': 'STRING'}}},
+    'required': ['candidates']
+}
+
+URGENT_GOALS_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {'goals': {'type': 'ARRAY', 'items': {'type': 'STRING'}}},
+    'required': ['goals']
+}
+
+TOPICS_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'topics': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {'topic': {'type': 'STRING'}, 'emoji': {'type': 'STRING'}},
+                'required': ['topic', 'emoji']
+            }
+        }
+    },
+    'required': ['topics']
+}
+
 # ⚡ CONNECTION POOL для высокой нагрузки
 _db_pool = None
 
@@ -76,112 +216,20 @@ def get_subscription_plans() -> dict:
 # Глобальный кэш для оптимизации ensure_user_has_words (живет только в рамках одного запроса)
 _words_ensured_cache = {}
 
-def clean_gemini_json(text: str) -> str:
-    """Очищает ответ Gemini от markdown и фиксит невалидный JSON"""
-    # Удаляем markdown блоки
-    text = text.replace('```json', '').replace('```', '').strip()
-    
-    # Пытаемся найти JSON объект в тексте
-    # Ищем первую { и последнюю }
-    start_idx = text.find('{')
-    end_idx = text.rfind('}')
-    
-    # Если не нашли закрывающую скобку - добавляем её
-    if start_idx != -1:
-        if end_idx == -1 or end_idx < start_idx:
-            # JSON не закрыт - добавляем закрывающую скобку
-            text = text[start_idx:] + '}'
-        else:
-            text = text[start_idx:end_idx+1]
-    
-    # Убираем все переносы строк и лишние пробелы внутри JSON
-    # Это агрессивный подход, но работает для простых структур
-    text = ' '.join(text.split())
-    
-    return text.strip()
-
 def safe_json_parse(text: str, fallback_fields: dict = None) -> dict:
-    """Безопасный парсинг JSON с fallback на regex извлечение"""
+    """
+    Безопасный парсинг JSON из ответа Gemini: оборванный или кривой JSON дочиняется
+    за один проход (json_repair), если JSON в ответе нет совсем - fallback_fields
+    """
     try:
-        cleaned = clean_gemini_json(text)
-        return json.loads(cleaned)
-    except json.JSONDecodeError as e:
-        print(f"[WARNING] JSON parse failed: {e}, trying aggressive fix...")
-        
-        # Агрессивная починка JSON
-        try:
-            fixed = clean_gemini_json(text)
-            
-            # ⚠️ CRITICAL: Удаляем незавершенные строки внутри массивов
-            # Ищем последнюю открывающую кавычку без закрывающей
-            # Паттерн: "текст без закрывающей кавычки до конца строки/файла
-            fixed = re.sub(r'"[^"]*$', '"', fixed)  # Закрываем последнюю незавершенную строку
-            
-            # Удаляем trailing commas
-            fixed = re.sub(r',\s*}', '}', fixed)
-            fixed = re.sub(r',\s*]', ']', fixed)
-            
-            # Удаляем незавершенные элементы после последней запятой
-            last_comma_idx = fixed.rfind(',')
-            last_closing_brace = max(fixed.rfind('}'), fixed.rfind(']'))
-            
-            if last_comma_idx > last_closing_brace and last_comma_idx != -1:
-                # Есть запятая после последней закрывающей скобки - обрезаем до последней завершенной строки
-                # Ищем последнюю завершенную строку перед этой запятой
-                last_complete_string = fixed.rfind('"', 0, last_comma_idx)
-                if last_complete_string != -1:
-                    fixed = fixed[:last_complete_string + 1]
-            
-            # Закрываем незакрытые скобки
-            open_braces = fixed.count('{')
-            close_braces = fixed.count('}')
-            if open_braces > close_braces:
-                fixed += '}' * (open_braces - close_braces)
-            
-            open_brackets = fixed.count('[')
-            close_brackets = fixed.count(']')
-            if open_brackets > close_brackets:
-                fixed += ']' * (open_brackets - close_brackets)
-            
-            print(f"[DEBUG] Attempting to parse fixed JSON...")
-            result = json.loads(fixed)
-            print(f"[SUCCESS] Fixed JSON successfully!")
-            return result
-            
-        except Exception as fix_error:
-            print(f"[ERROR] Failed to fix JSON: {fix_error}")
-            
-            # Последний fallback: извлекаем массивы через regex
-            if fallback_fields is None:
-                fallback_fields = {}
-            
-            result = fallback_fields.copy()
-            
-            # Извлекаем строковые поля: "key": "value"
-            string_pattern = r'"(\w+)"\s*:\s*"([^"]*)"'
-            for match in re.finditer(string_pattern, text):
-                key, value = match.groups()
-                result[key] = value
-            
-            # Извлекаем boolean поля: "key": true/false
-            bool_pattern = r'"(\w+)"\s*:\s*(true|false)'
-            for match in re.finditer(bool_pattern, text):
-                key, value = match.groups()
-                result[key] = value == 'true'
-            
-            # ⚠️ CRITICAL: Извлекаем массивы строк для "goals"
-            # Паттерн: "goals": ["Цель 1", "Цель 2", ...]
-            goals_pattern = r'"goals"\s*:\s*\[(.*?)\]'
-            goals_match = re.search(goals_pattern, text, re.DOTALL)
-            if goals_match:
-                goals_array_content = goals_match.group(1)
-                # Извлекаем все строки из массива
-                string_items = re.findall(r'"([^"]+)"', goals_array_content)
-                result['goals'] = string_items
-                print(f"[DEBUG] Extracted {len(string_items)} goals via regex")
-            
-            print(f"[WARNING] Extracted fields via regex: {result}")
-            return result
+        data, repairs = json_repair.parse(text)
+    except ValueError as e:
+        print(f"[ERROR] Failed to parse JSON: {e}, using fallback fields")
+        return dict(fallback_fields or {})
+
+    if repairs:
+        print(f"[WARNING] JSON repaired: {', '.join(repairs[:5])}")
+    return data
 
 def get_db_connection():
     """Получает подключение из пула (⚡ быстрее чем создавать новое)"""
@@ -226,104 +274,6 @@ def return_db_connection(conn):
     except:
         conn.close()
 
-def generate_adaptive_question(level: str, used_words: List[str]) -> Dict[str, Any]:
-    """Генерирует тестовый вопрос для адаптивного теста через Gemini"""
-    try:
-        api_key = os.environ['GEMINI_API_KEY']
-        proxy_id, proxy_url = get_active_proxy_from_db()
-        if not proxy_url:
-            proxy_url = os.environ.get('PROXY_URL', '')
-        
-        if not proxy_url:
-            raise Exception("No proxy available")
-        
-        # Формируем список использованных слов для исключения дубликатов
-        used_str = ', '.join(used_words) if used_words else 'none'
-        
-        prompt = f'''Generate ONE English learning test item for level {level}.
-
-Level guidelines:
-- A1: basic everyday words (cat, water, family, hello)
-- A2: common everyday vocabulary (travel, weather, hobby, meeting)
-- B1: common phrases and expressions (take care, by the way, it depends on)
-- B2: idioms and sophisticated vocabulary (break the ice, piece of cake, mindset)
-- C1: advanced academic vocabulary (paradigm, ambiguous, inevitable)
-- C2: native-level expressions (beat around the bush, hit the nail on the head)
-
-⚠️ CRITICAL: DO NOT use these already used words: {used_str}
-⚠️ EVERY word MUST be 100% NEW and NOT in the list above!
-
-Return ONLY valid JSON (no markdown):
-{{
-  "english": "word or phrase",
-  "russian": "перевод",
-  "type": "word",
-  "level": "{level}"
-}}
-
-Types: "word" (single word), "phrase" (2-3 words), "expression" (idiom/set phrase)'''
-        
-        gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-        
-        payload = {
-            'contents': [{'parts': [{'text': prompt}]}],
-            'generationConfig': {'temperature': 0.8, 'maxOutputTokens': 500}
-        }
-        
-        proxy_handler = urllib.request.ProxyHandler({
-            'http': f'http://{proxy_url}',
-            'https': f'http://{proxy_url}'
-        })
-        opener = urllib.request.build_opener(proxy_handler)
-        
-        req = urllib.request.Request(
-            gemini_url,
-            data=json.dumps(payload).encode('utf-8'),
-            headers={'Content-Type': 'application/json'}
-        )
-        
-        with opener.open(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            text = result['candidates'][0]['content']['parts'][0]['text']
-            
-            data = safe_json_parse(text, {
-                'english': 'hello',
-                'russian': 'привет',
-                'type': 'word',
-                'level': level
-            })
-            
-            log_proxy_success(proxy_id)
-            
-            print(f"[DEBUG generate_adaptive_question] Generated: {data}")
-            return data
-            
-    except Exception as e:
-        print(f"[ERROR generate_adaptive_question] Failed: {e}")
-        import traceback
-        traceback.print_exc()
-        
-        if proxy_id:
-            log_proxy_failure(proxy_id, str(e))
-        
-        # Fallback на простое слово
-        fallback_words = {
-            'A1': {'english': 'hello', 'russian': 'привет'},
-            'A2': {'english': 'travel', 'russian': 'путешествие'},
-            'B1': {'english': 'experience', 'russian': 'опыт'},
-            'B2': {'english': 'opportunity', 'russian': 'возможность'},
-            'C1': {'english': 'paradigm', 'russian': 'парадигма'},
-            'C2': {'english': 'ambiguous', 'russian': 'неоднозначный'}
-        }
-        
-        word = fallback_words.get(level, fallback_words['A1'])
-        return {
-            'english': word['english'],
-            'russian': word['russian'],
-            'type': 'word',
-            'level': level
-        }
-
 def get_prompt_from_db(code: str, fallback: str = '') -> str:
     """Получает промпт из БД по коду + КЕШ 5 минут"""
     def fetch():
@@ -350,12 +300,72 @@ def get_prompt_from_db(code: str, fallback: str = '') -> str:
     
     return get_cached(f'prompt_{code}', fetch, ttl=300)
 
-def get_active_proxy_from_db() -> tuple:
-    """Получает случайный активный прокси из БД + КЕШ список на 1 минуту - возвращает (id, url)"""
+def load_llm_routes() -> List[Dict[str, Any]]:
+    """Маршруты задач LLM из админки (модель, лимит токенов, таймаут) - llm_client перечитывает их раз в 5 минут"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT task, model, max_output_tokens, timeout_seconds FROM {SCHEMA}.llm_task_routes "
+        f"WHERE is_active = TRUE"
+    )
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return [{'task': r[0], 'model': r[1], 'max_output_tokens': r[2], 'timeout_seconds': r[3]} for r in rows]
+
+def load_context_cache(prompt_hash: str):
+    """Имя кэша контекста Gemini, созданного любым инстансом бота для этого промпта: (имя, истекает) или None"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT cache_name, EXTRACT(EPOCH FROM expires_at) FROM {SCHEMA}.gemini_context_caches "
+        f"WHERE prompt_hash = '{prompt_hash}'"
+    )
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    return (row[0], float(row[1])) if row else None
+
+def save_context_cache(prompt_hash: str, model: str, cache_name: str, expires_at: float):
+    """
+    Запоминает кэш контекста для всех инстансов. Более новый кэш заменяет запись;
+    отметка "истек" (expires_at=0) применяется, только если запись про тот же кэш
+    """
+    model_escaped = model.replace("'", "''")
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"INSERT INTO {SCHEMA}.gemini_context_caches (prompt_hash, model, cache_name, expires_at) "
+        f"VALUES ('{prompt_hash}', '{model_escaped}', '{cache_name}', TO_TIMESTAMP({expires_at})) "
+        f"ON CONFLICT (prompt_hash) DO UPDATE SET model = EXCLUDED.model, cache_name = EXCLUDED.cache_name, "
+        f"expires_at = EXCLUDED.expires_at, updated_at = CURRENT_TIMESTAMP "
+        f"WHERE {SCHEMA}.gemini_context_caches.cache_name = EXCLUDED.cache_name "
+        f"OR {SCHEMA}.gemini_context_caches.expires_at < EXCLUDED.expires_at"
+    )
+    cur.close()
+    conn.close()
+
+llm_client.set_route_loader(load_llm_routes)
+llm_client.set_context_cache_store(load_context_cache, save_context_cache)
+llm_client.set_timeout_limiter(deadline.timeout)
+tts_cache.configure(get_db_connection, SCHEMA)
+
+def get_dialog_model() -> str:
+    """Модель диалога по маршруту задачи 'dialog' - с ней создается кэш контекста и идут запросы диалога"""
+    return llm_client.get_route('dialog', DIALOG_MODEL, 12)['model']
+
+def get_active_proxy_from_db(exclude: set = None) -> tuple:
+    """Выбирает самый "здоровый" из активных прокси (power-of-two-choices) + КЕШ список на 1 минуту - возвращает (id, url)"""
     def fetch():
         conn = get_db_connection()
         cur = conn.cursor()
         
+        # Заодно сбрасываем накопленную статистику прокси
+        try:
+            proxy_health.flush_stats(cur, SCHEMA)
+        except Exception as e:
+            print(f"[WARNING] Failed to flush proxy stats: {e}")
+        
         cur.execute(
             f"SELECT id, host, port, username, password "
             f"FROM {SCHEMA}.proxies WHERE is_active = TRUE"
@@ -370,6 +380,12 @@ def get_active_proxy_from_db() -> tuple:
                 proxy_url = f"{host}:{port}"
             proxies.append((proxy_id, proxy_url))
         
+        # Раз в минуту сводим оценки здоровья прокси с другими инстансами
+        try:
+            proxy_health.sync_with_db(cur, SCHEMA)
+        except Exception as e:
+            print(f"[WARNING] Failed to sync proxy health: {e}")
+        
         cur.close()
         conn.close()
         
@@ -379,62 +395,67 @@ def get_active_proxy_from_db() -> tuple:
     if not proxies:
         return None, None
     
-    return random.choice(proxies)
+    return proxy_health.choose(proxies, exclude)
+
+def _last_call_latency_ms():
+    """Латентность последнего вызова через llm_client (None если вызов шел мимо него)"""
+    timing = llm_client.pop_last_call_timing()
+    return timing['elapsed_ms'] if timing else None
 
 def log_proxy_success(proxy_id: int):
-    """Логирует успешный запрос через прокси"""
-    if not proxy_id:
+    """Логирует успешный запрос через прокси (в памяти, в БД уходит пачкой через flush_proxy_stats)"""
+    proxy_health.record(proxy_id, True, _last_call_latency_ms())
+
+def log_proxy_failure(proxy_id: int, error: Any, error_message: str = None):
+    """
+    Логирует ошибку прокси (в памяти). Вывод из ротации - через circuit breaker, см. proxy_health.
+    error - исключение вызова (или текст ошибки), error_message - текст для статистики, если не str(error).
+    DeadlineExceeded не считается: запрос не уходил, кончился бюджет апдейта, а не прокси
+    """
+    if isinstance(error, deadline.DeadlineExceeded):
+        print(f"[DEBUG] Proxy {proxy_id} not blamed: {error}")
         return
-    
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute(
-        f"UPDATE {SCHEMA}.proxies SET "
-        f"total_requests = total_requests + 1, "
-        f"successful_requests = successful_requests + 1, "
-        f"last_used_at = CURRENT_TIMESTAMP "
-        f"WHERE id = {proxy_id}"
-    )
-    
-    cur.close()
-    conn.close()
+    proxy_health.record(proxy_id, False, _last_call_latency_ms(), error_message or str(error))
 
-def log_proxy_failure(proxy_id: int, error_message: str):
-    """Логирует ошибку прокси и автоматически отключает при >5 ошибках подряд"""
-    if not proxy_id:
+def flush_proxy_stats():
+    """Сбрасывает накопленную статистику прокси в БД одним запросом"""
+    if not proxy_health.has_pending_stats():
         return
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    error_escaped = error_message[:500].replace("'", "''")
-    
-    cur.execute(
-        f"UPDATE {SCHEMA}.proxies SET "
-        f"total_requests = total_requests + 1, "
-        f"failed_requests = failed_requests + 1, "
-        f"last_error = '{error_escaped}', "
-        f"last_error_at = CURRENT_TIMESTAMP "
-        f"WHERE id = {proxy_id}"
-    )
-    
-    # Проверяем процент ошибок - если >80% и >3 запросов - отключаем
-    cur.execute(
-        f"SELECT total_requests, failed_requests FROM {SCHEMA}.proxies WHERE id = {proxy_id}"
-    )
-    row = cur.fetchone()
-    
-    if row:
-        total, failed = row
-        if total >= 3 and (failed / total) > 0.8:
-            cur.execute(
-                f"UPDATE {SCHEMA}.proxies SET is_active = FALSE WHERE id = {proxy_id}"
-            )
-            print(f"[WARNING] Proxy {proxy_id} auto-disabled: {failed}/{total} failures ({failed/total*100:.1f}%)")
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        flushed = proxy_health.flush_stats(cur, SCHEMA)
+        cur.close()
+        conn.close()
+        if flushed:
+            print(f"[DEBUG] Flushed stats for {flushed} proxies")
+    except Exception as e:
+        print(f"[WARNING] Failed to flush proxy stats: {e}")
+
+def flush_llm_telemetry():
+    """Пишет накопленную телеметрию вызовов LLM/речи в llm_calls одним запросом"""
+    if not llm_client.has_pending_telemetry():
+        return
     
-    cur.close()
-    conn.close()
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        flushed = llm_client.flush_telemetry(cur, SCHEMA, 'telegram-bot')
+        cur.close()
+        conn.close()
+        print(f"[DEBUG] Flushed {flushed} LLM call events")
+    except Exception as e:
+        print(f"[WARNING] Failed to flush LLM telemetry: {e}")
+
+def update_user_id(event: Dict[str, Any]):
+    """telegram_id автора апдейта (сообщение или нажатие кнопки), None если его нет"""
+    try:
+        update = json.loads(event.get('body') or '{}')
+    except Exception:
+        return None
+    message = update.get('message') or update.get('callback_query') or {}
+    return (message.get('from') or {}).get('id')
 
 def get_user(telegram_id: int):
     """Получает пользователя из БД"""
@@ -516,7 +537,6 @@ def auto_generate_new_words(student_id: int, how_many: int = 10) -> Dict[str, An
         print(f"[DEBUG] Student has {len(existing_words)} existing items")
         
         # Генерируем новый контент через Gemini
-        api_key = os.environ['GEMINI_API_KEY']
         proxy_id, proxy_url = get_active_proxy_from_db()
         if not proxy_url:
             proxy_url = os.environ.get('PROXY_URL', '')
@@ -568,146 +588,130 @@ Return ONLY valid JSON:
   "expressions": [{{"english": "expression1", "russian": "перевод1"}}, {{"english": "expression2", "russian": "перевод2"}}]
 }}'''
 
-        gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-        
         payload = {
             'contents': [{'parts': [{'text': prompt}]}],
             'generationConfig': {'temperature': 0.9, 'maxOutputTokens': 3000, 'topP': 0.95}
         }
         
-        proxy_handler = urllib.request.ProxyHandler({
-            'http': f'http://{proxy_url}',
-            'https': f'http://{proxy_url}'
-        })
-        opener = urllib.request.build_opener(proxy_handler)
+        text = llm_client.generate_text('gemini-2.5-flash', payload, proxy_url, timeout=30, task='auto_generate_words')
         
-        req = urllib.request.Request(
-            gemini_url,
-            data=json.dumps(payload).encode('utf-8'),
-            headers={'Content-Type': 'application/json'}
-        )
+        data = safe_json_parse(text, {'vocabulary': [], 'phrases': [], 'expressions': []})
         
-        with opener.open(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            text = result['candidates'][0]['content']['parts'][0]['text']
+        print(f"[DEBUG] Gemini generated: {len(data.get('vocabulary', []))} words, {len(data.get('phrases', []))} phrases, {len(data.get('expressions', []))} expressions")
+        
+        # Сохраняем в БД
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        added_count = 0
+        new_items = []
+        
+        # Добавляем vocabulary
+        for item in data.get('vocabulary', []):
+            english = item['english'].strip().lower()
+            russian = item['russian'].strip()
             
-            data = safe_json_parse(text, {'vocabulary': [], 'phrases': [], 'expressions': []})
+            # СТРОГАЯ проверка дубликатов
+            if english in existing_words:
+                print(f"[WARNING] Skipping DUPLICATE vocabulary: {english}")
+                continue
             
-            print(f"[DEBUG] Gemini generated: {len(data.get('vocabulary', []))} words, {len(data.get('phrases', []))} phrases, {len(data.get('expressions', []))} expressions")
+            english_escaped = english.replace("'", "''")
+            russian_escaped = russian.replace("'", "''")
             
-            # Сохраняем в БД
-            conn = get_db_connection()
-            cur = conn.cursor()
+            cur.execute(
+                f"INSERT INTO {SCHEMA}.words (english_text, russian_translation) "
+                f"VALUES ('{english_escaped}', '{russian_escaped}') "
+                f"ON CONFLICT (english_text) DO UPDATE SET russian_translation = EXCLUDED.russian_translation "
+                f"RETURNING id"
+            )
+            word_id = cur.fetchone()[0]
             
-            added_count = 0
-            new_items = []
+            cur.execute(
+                f"INSERT INTO {SCHEMA}.student_words (student_id, word_id, teacher_id) "
+                f"VALUES ({student_id}, {word_id}, {student_id}) "
+                f"ON CONFLICT DO NOTHING"
+            )
             
-            # Добавляем vocabulary
-            for item in data.get('vocabulary', []):
-                english = item['english'].strip().lower()
-                russian = item['russian'].strip()
-                
-                # СТРОГАЯ проверка дубликатов
-                if english in existing_words:
-                    print(f"[WARNING] Skipping DUPLICATE vocabulary: {english}")
-                    continue
-                
-                english_escaped = english.replace("'", "''")
-                russian_escaped = russian.replace("'", "''")
-                
-                cur.execute(
-                    f"INSERT INTO {SCHEMA}.words (english_text, russian_translation) "
-                    f"VALUES ('{english_escaped}', '{russian_escaped}') "
-                    f"ON CONFLICT (english_text) DO UPDATE SET russian_translation = EXCLUDED.russian_translation "
-                    f"RETURNING id"
-                )
-                word_id = cur.fetchone()[0]
-                
-                cur.execute(
-                    f"INSERT INTO {SCHEMA}.student_words (student_id, word_id, teacher_id) "
-                    f"VALUES ({student_id}, {word_id}, {student_id}) "
-                    f"ON CONFLICT DO NOTHING"
-                )
-                
-                existing_words.append(english)
-                added_count += 1
-                new_items.append(f"📖 {english} — {russian}")
-                print(f"[DEBUG] Added vocabulary: {english}")
+            existing_words.append(english)
+            added_count += 1
+            new_items.append(f"📖 {english} — {russian}")
+            print(f"[DEBUG] Added vocabulary: {english}")
+        
+        # Добавляем phrases
+        for item in data.get('phrases', []):
+            english = item['english'].strip().lower()
+            russian = item['russian'].strip()
             
-            # Добавляем phrases
-            for item in data.get('phrases', []):
-                english = item['english'].strip().lower()
-                russian = item['russian'].strip()
-                
-                if english in existing_words:
-                    print(f"[WARNING] Skipping DUPLICATE phrase: {english}")
-                    continue
-                
-                english_escaped = english.replace("'", "''")
-                russian_escaped = russian.replace("'", "''")
-                
-                cur.execute(
-                    f"INSERT INTO {SCHEMA}.words (english_text, russian_translation) "
-                    f"VALUES ('{english_escaped}', '{russian_escaped}') "
-                    f"ON CONFLICT (english_text) DO UPDATE SET russian_translation = EXCLUDED.russian_translation "
-                    f"RETURNING id"
-                )
-                word_id = cur.fetchone()[0]
-                
-                cur.execute(
-                    f"INSERT INTO {SCHEMA}.student_words (student_id, word_id, teacher_id) "
-                    f"VALUES ({student_id}, {word_id}, {student_id}) "
-                    f"ON CONFLICT DO NOTHING"
-                )
-                
-                existing_words.append(english)
-                added_count += 1
-                new_items.append(f"💭 {english} — {russian}")
-                print(f"[DEBUG] Added phrase: {english}")
+            if english in existing_words:
+                print(f"[WARNING] Skipping DUPLICATE phrase: {english}")
+                continue
             
-            # Добавляем expressions
-            for item in data.get('expressions', []):
-                english = item['english'].strip().lower()
-                russian = item['russian'].strip()
-                
-                if english in existing_words:
-                    print(f"[WARNING] Skipping DUPLICATE expression: {english}")
-                    continue
-                
-                english_escaped = english.replace("'", "''")
-                russian_escaped = russian.replace("'", "''")
-                
-                cur.execute(
-                    f"INSERT INTO {SCHEMA}.words (english_text, russian_translation) "
-                    f"VALUES ('{english_escaped}', '{russian_escaped}') "
-                    f"ON CONFLICT (english_text) DO UPDATE SET russian_translation = EXCLUDED.russian_translation "
-                    f"RETURNING id"
-                )
-                word_id = cur.fetchone()[0]
-                
-                cur.execute(
-                    f"INSERT INTO {SCHEMA}.student_words (student_id, word_id, teacher_id) "
-                    f"VALUES ({student_id}, {word_id}, {student_id}) "
-                    f"ON CONFLICT DO NOTHING"
-                )
-                
-                existing_words.append(english)
-                added_count += 1
-                new_items.append(f"✨ {english} — {russian}")
-                print(f"[DEBUG] Added expression: {english}")
+            english_escaped = english.replace("'", "''")
+            russian_escaped = russian.replace("'", "''")
             
-            cur.close()
-            conn.close()
+            cur.execute(
+                f"INSERT INTO {SCHEMA}.words (english_text, russian_translation) "
+                f"VALUES ('{english_escaped}', '{russian_escaped}') "
+                f"ON CONFLICT (english_text) DO UPDATE SET russian_translation = EXCLUDED.russian_translation "
+                f"RETURNING id"
+            )
+            word_id = cur.fetchone()[0]
             
-            log_proxy_success(proxy_id)
+            cur.execute(
+                f"INSERT INTO {SCHEMA}.student_words (student_id, word_id, teacher_id) "
+                f"VALUES ({student_id}, {word_id}, {student_id}) "
+                f"ON CONFLICT DO NOTHING"
+            )
             
-            print(f"[DEBUG auto_generate_new_words] Successfully added {added_count} new items")
-            return {
-                'added_count': added_count,
-                'new_items': new_items,
-                'language_level': language_level
-            }
+            existing_words.append(english)
+            added_count += 1
+            new_items.append(f"💭 {english} — {russian}")
+            print(f"[DEBUG] Added phrase: {english}")
+        
+        # Добавляем expressions
+        for item in data.get('expressions', []):
+            english = item['english'].strip().lower()
+            russian = item['russian'].strip()
+            
+            if english in existing_words:
+                print(f"[WARNING] Skipping DUPLICATE expression: {english}")
+                continue
+            
+            english_escaped = english.replace("'", "''")
+            russian_escaped = russian.replace("'", "''")
+            
+            cur.execute(
+                f"INSERT INTO {SCHEMA}.words (english_text, russian_translation) "
+                f"VALUES ('{english_escaped}', '{russian_escaped}') "
+                f"ON CONFLICT (english_text) DO UPDATE SET russian_translation = EXCLUDED.russian_translation "
+                f"RETURNING id"
+            )
+            word_id = cur.fetchone()[0]
+            
+            cur.execute(
+                f"INSERT INTO {SCHEMA}.student_words (student_id, word_id, teacher_id) "
+                f"VALUES ({student_id}, {word_id}, {student_id}) "
+                f"ON CONFLICT DO NOTHING"
+            )
             
+            existing_words.append(english)
+            added_count += 1
+            new_items.append(f"✨ {english} — {russian}")
+            print(f"[DEBUG] Added expression: {english}")
+        
+        cur.close()
+        conn.close()
+        
+        log_proxy_success(proxy_id)
+        
+        print(f"[DEBUG auto_generate_new_words] Successfully added {added_count} new items")
+        return {
+            'added_count': added_count,
+            'new_items': new_items,
+            'language_level': language_level
+        }
+        
     except Exception as e:
         print(f"[ERROR auto_generate_new_words] Failed: {e}")
         import traceback
@@ -911,28 +915,77 @@ def create_user(telegram_id: int, username: str, first_name: str, last_name: str
     cur.close()
     conn.close()
 
-def get_conversation_history(user_id: int) -> List[Dict[str, str]]:
-    """Получает историю диалога"""
+def get_conversation_context(user_id: int) -> tuple:
+    """
+    Получает контекст диалога: (свежие сообщения, еще не свернутые в сводку; сводка более старых).
+    Если за окном истории накопилось достаточно сообщений - откладывает обновление сводки
+    """
     conn = get_db_connection()
     cur = conn.cursor()
     
-    cur.execute(f"SELECT id FROM {SCHEMA}.conversations WHERE user_id = {user_id} ORDER BY updated_at DESC LIMIT 1")
+    cur.execute(f"SELECT id, summary, COALESCE(summary_until_message_id, 0) FROM {SCHEMA}.conversations WHERE user_id = {user_id} ORDER BY updated_at DESC LIMIT 1")
     row = cur.fetchone()
     
     if not row:
         cur.close()
         conn.close()
-        return []
+        return [], ''
     
-    conversation_id = row[0]
+    conversation_id, summary, summary_until = row
     
-    cur.execute(f"SELECT role, content FROM {SCHEMA}.messages WHERE conversation_id = {conversation_id} ORDER BY created_at ASC LIMIT 50")
+    # Последние сообщения после сводки (раньше читались ПЕРВЫЕ 50 сообщений диалога)
+    cur.execute(
+        f"SELECT id, role, content FROM {SCHEMA}.messages "
+        f"WHERE conversation_id = {conversation_id} AND id > {summary_until} "
+        f"ORDER BY id DESC LIMIT {history_window.RECENT_FETCH_LIMIT}"
+    )
     
-    history = [{'role': row[0], 'content': row[1]} for row in cur.fetchall()]
+    history = [{'id': row[0], 'role': row[1], 'content': row[2]} for row in reversed(cur.fetchall())]
     
     cur.close()
     conn.close()
-    return history
+    
+    if history_window.needs_summary_refresh(len(history)):
+        to_summarize, _ = history_window.split_for_summary(history)
+        history_window.defer(refresh_conversation_summary, conversation_id, summary, summary_until, to_summarize)
+    
+    return history, summary or ''
+
+def refresh_conversation_summary(conversation_id: int, previous_summary: str, previous_until: int, messages: List[Dict[str, Any]]):
+    """Сворачивает старые сообщения в сводку диалога (выполняется после ответа студенту)"""
+    proxy_id, proxy_url = get_gemini_proxy()
+    if not proxy_url:
+        return
+    
+    payload = {
+        'contents': [{'parts': [{'text': history_window.build_summary_prompt(previous_summary, messages)}]}],
+        'generationConfig': {'temperature': 0.3, 'maxOutputTokens': 500}
+    }
+    
+    try:
+        text = llm_client.generate_text('gemini-2.5-flash', payload, proxy_url, timeout=15, task='history_summary')
+        log_proxy_success(proxy_id)
+    except Exception as e:
+        print(f"[ERROR refresh_conversation_summary] Failed: {e}")
+        if proxy_id:
+            log_proxy_failure(proxy_id, e)
+        return
+    
+    summary = history_window.clip_text(text.strip(), history_window.SUMMARY_MAX_TOKENS).replace("'", "''")
+    summary_until = messages[-1]['id']
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    # Условие на старую границу - если сводку уже обновил параллельный запрос, не перетираем ее
+    cur.execute(
+        f"UPDATE {SCHEMA}.conversations SET summary = '{summary}', summary_until_message_id = {summary_until}, "
+        f"summary_updated_at = CURRENT_TIMESTAMP "
+        f"WHERE id = {conversation_id} AND COALESCE(summary_until_message_id, 0) = {previous_until}"
+    )
+    cur.close()
+    conn.close()
+    
+    print(f"[DEBUG] Conversation {conversation_id} summary refreshed: {len(messages)} messages folded")
 
 def save_message(user_id: int, role: str, content: str):
     """Сохраняет сообщение"""
@@ -955,33 +1008,29 @@ def save_message(user_id: int, role: str, content: str):
     cur.close()
     conn.close()
 
+def get_emotion_matcher():
+    """Скомпилированный набор слов настроений: строки emotion_keywords из админки + встроенные - КЕШ 5 минут"""
+    def fetch():
+        rows = []
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cur.execute(
+                f"SELECT mood, keyword, language FROM {SCHEMA}.emotion_keywords "
+                f"WHERE is_active = TRUE"
+            )
+            rows = [{'mood': r[0], 'keyword': r[1], 'language': r[2]} for r in cur.fetchall()]
+            cur.close()
+            conn.close()
+        except Exception as e:
+            print(f"[WARNING] Failed to load emotion keywords from DB: {e}")
+        return mood_detector.compile_matcher(mood_detector.merge_keywords(rows))
+    
+    return get_cached('emotion_matcher', fetch, ttl=300)
+
 def detect_emotional_context(message: str) -> str:
-    """Определяет эмоциональный контекст сообщения"""
-    message_lower = message.lower()
-    
-    # Тяжелые эмоции (грусть, страх, боль)
-    heavy_keywords = ['death', 'dead', 'died', 'dying', 'kill', 'suicide', 
-                      'fear', 'scared', 'afraid', 'terrified', 'panic',
-                      'lonely', 'alone', 'depression', 'depressed', 'sad', 'cry', 'crying',
-                      'difficult', 'hard time', 'struggle', 'pain', 'hurt', 'suffering',
-                      'lost', 'miss', 'gone', 'never', 'hate', 'angry', 'upset']
-    
-    # Позитивные эмоции
-    positive_keywords = ['happy', 'joy', 'excited', 'love', 'amazing', 'wonderful',
-                        'great', 'awesome', 'perfect', 'fantastic', 'excellent']
-    
-    # Нейтральные/обучающие
-    learning_keywords = ['how', 'what', 'why', 'when', 'where', 'explain', 'mean',
-                        'help', 'learn', 'study', 'practice']
-    
-    if any(word in message_lower for word in heavy_keywords):
-        return 'empathetic'
-    elif any(word in message_lower for word in positive_keywords):
-        return 'enthusiastic'
-    elif any(word in message_lower for word in learning_keywords):
-        return 'educational'
-    else:
-        return 'casual'
+    """Определяет эмоциональный контекст сообщения (целые слова, один проход - см. mood_detector)"""
+    return mood_detector.detect(message, get_emotion_matcher())
 
 def get_emoji_for_mood(mood: str) -> str:
     """Возвращает подходящий emoji для настроения"""
@@ -1042,7 +1091,7 @@ def update_word_progress_api(student_id: int, word_id: int, is_correct: bool):
             method='POST'
         )
         
-        with urllib.request.urlopen(req) as resp:
+        with urllib.request.urlopen(req, timeout=deadline.timeout(WEBAPP_API_TIMEOUT)) as resp:
             result = json.loads(resp.read().decode('utf-8'))
             print(f"[DEBUG] Word progress updated: word_id={word_id}, is_correct={is_correct}, result={result}")
             return result
@@ -1051,19 +1100,12 @@ def update_word_progress_api(student_id: int, word_id: int, is_correct: bool):
         return None
 
 def detect_words_in_text(text: str, session_words: List[Dict[str, Any]]) -> List[int]:
-    """Определяет, какие слова из сессии использованы в тексте"""
-    text_lower = text.lower()
-    # Убираем пунктуацию для точного поиска
-    text_clean = re.sub(r'[^\w\s]', ' ', text_lower)
-    words_in_text = set(text_clean.split())
-    
-    used_word_ids = []
-    for word in session_words:
-        # Проверяем точное совпадение слова
-        if word['english'].lower() in words_in_text:
-            used_word_ids.append(word['id'])
-    
-    return used_word_ids
+    """
+    Определяет, какие слова из сессии использованы в тексте: фразы ("figure it out")
+    и формы слов ("travelled") тоже. Набор слов сессии компилируется один раз (word_matcher)
+    и переиспользуется для сообщения студента и ответа Ани
+    """
+    return word_matcher.get_matcher(session_words).find(text)
 
 def get_learning_mode_keyboard():
     """Возвращает Inline Keyboard с режимами обучения"""
@@ -1204,15 +1246,76 @@ def get_random_word(telegram_id: int, language_level: str = 'A1') -> Dict[str, A
     return None
 
 def get_word_transcription(word: str) -> str:
+    """
+    Транскрипция слова (IPA). Словарь word_phonetics в БД общий для всех студентов:
+    при промахе спрашиваем Gemini и сохраняем ответ - каждое слово запрашивается один раз.
+    Массово словарь заполняет practice-scheduler (backfill_word_phonetics).
+    Одновременные запросы одного слова ждут один поход в БД/Gemini (single_flight)
+    """
+    key = word.strip().lower()
+    if not key:
+        return ''
+    
+    cache_key = f'ipa_{key}'
+    if cache_key in _cache:
+        return _cache[cache_key]
+    
+    transcription = llm_client.single_flight(f'ipa:{key}', lambda: resolve_word_transcription(key, word))
+    
+    # Транскрипция не меняется - держим в памяти инстанса без TTL
+    if transcription:
+        _cache[cache_key] = transcription
+        _cache_ttl[cache_key] = time.time()
+    return transcription
+
+def resolve_word_transcription(key: str, word: str) -> str:
+    """Транскрипция из word_phonetics, при промахе - из Gemini с сохранением в словарь"""
+    transcription = load_word_transcription(key)
+    if not transcription:
+        transcription = fetch_word_transcription(word)
+        if transcription:
+            save_word_transcription(key, transcription)
+    return transcription
+
+def load_word_transcription(key: str) -> str:
+    """Транскрипция из словаря word_phonetics ('' если слова там нет)"""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        key_escaped = key.replace("'", "''")
+        cur.execute(f"SELECT ipa FROM {SCHEMA}.word_phonetics WHERE word = '{key_escaped}'")
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        return row[0] if row else ''
+    except Exception as e:
+        print(f"[WARNING] Failed to load transcription for '{key}': {e}")
+        return ''
+
+def save_word_transcription(key: str, transcription: str):
+    """Сохраняет транскрипцию в словарь word_phonetics"""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        key_escaped = key.replace("'", "''")
+        ipa_escaped = transcription.replace("'", "''")
+        cur.execute(
+            f"INSERT INTO {SCHEMA}.word_phonetics (word, ipa, source) VALUES ('{key_escaped}', '{ipa_escaped}', 'lazy') "
+            f"ON CONFLICT (word) DO NOTHING"
+        )
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"[WARNING] Failed to save transcription for '{key}': {e}")
+
+def fetch_word_transcription(word: str) -> str:
     """Получает транскрипцию слова через Gemini"""
+    proxy_id = None
     try:
-        api_key = os.environ['GEMINI_API_KEY']
         proxy_id, proxy_url = get_active_proxy_from_db()
         if not proxy_url:
             proxy_url = os.environ.get('PROXY_URL', '')
         
-        gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent?key={api_key}'
-        
         prompt = f"Return ONLY the phonetic transcription (IPA) for the English word '{word}'. No explanations, just the transcription in format: /transcription/"
         
         payload = {
@@ -1220,27 +1323,13 @@ def get_word_transcription(word: str) -> str:
             'generationConfig': {'temperature': 0.1, 'maxOutputTokens': 100}
         }
         
-        proxy_handler = urllib.request.ProxyHandler({
-            'http': f'http://{proxy_url}',
-            'https': f'http://{proxy_url}'
-        })
-        opener = urllib.request.build_opener(proxy_handler)
-        
-        req = urllib.request.Request(
-            gemini_url,
-            data=json.dumps(payload).encode('utf-8'),
-            headers={'Content-Type': 'application/json'}
-        )
-        
-        with opener.open(req, timeout=10) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            transcription = result['candidates'][0]['content']['parts'][0]['text'].strip()
-            log_proxy_success(proxy_id)
-            return transcription
+        transcription = llm_client.generate_text('gemini-2.0-flash-exp', payload, proxy_url, timeout=10, task='transcription')
+        log_proxy_success(proxy_id)
+        return llm_client.clean_transcription(transcription)
     except Exception as e:
         print(f"[ERROR] Failed to get transcription: {e}")
         if proxy_id:
-            log_proxy_failure(proxy_id, str(e))
+            log_proxy_failure(proxy_id, e)
         return ''
 
 def generate_sentence_exercise(word: Dict[str, Any], language_level: str) -> tuple:
@@ -1262,10 +1351,56 @@ def generate_sentence_exercise(word: Dict[str, Any], language_level: str) -> tup
     
     return message, keyboard
 
-def generate_context_exercise(word: Dict[str, Any], language_level: str, all_words: List[Dict[str, Any]] = None) -> tuple:
-    """Генерирует упражнение Fill in the blanks с вариантами ответа через Gemini"""
+def take_bank_exercise(word_id: int, language_level: str, exercise_type: str) -> str:
+    """
+    Берет наименее использованный вариант упражнения из банка и помечает его использованным.
+    Если свежих вариантов мало - ставит (слово, уровень, тип) в очередь на пополнение.
+    None - в банке ничего нет (или БД недоступна), упражнение генерируется вживую
+    """
+    if not word_id:
+        return None
+    
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        
+        bank_filter = (
+            f"word_id = {int(word_id)} AND language_level = '{language_level}' "
+            f"AND exercise_type = '{exercise_type}' AND times_used < {EXERCISE_BANK_MAX_USES}"
+        )
+        cur.execute(
+            f"SELECT id, content FROM {SCHEMA}.exercise_bank WHERE {bank_filter} "
+            f"ORDER BY times_used ASC, RANDOM() LIMIT {EXERCISE_BANK_MIN_FRESH + 1}"
+        )
+        rows = cur.fetchall()
+        
+        if rows:
+            cur.execute(
+                f"UPDATE {SCHEMA}.exercise_bank SET times_used = times_used + 1, last_used_at = CURRENT_TIMESTAMP "
+                f"WHERE id = {rows[0][0]}"
+            )
+        
+        if len(rows) <= EXERCISE_BANK_MIN_FRESH:
+            cur.execute(
+                f"INSERT INTO {SCHEMA}.exercise_bank_queue (word_id, language_level, exercise_type) "
+                f"VALUES ({int(word_id)}, '{language_level}', '{exercise_type}') ON CONFLICT DO NOTHING"
+            )
+        
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"[WARNING] Exercise bank unavailable: {e}")
+        return None
+    
+    if not rows:
+        print(f"[DEBUG] Exercise bank miss: {exercise_type} word_id={word_id} level={language_level}")
+        return None
+    return rows[0][1]
+
+def generate_context_sentence(word: Dict[str, Any], language_level: str) -> str:
+    """Генерирует предложение с пропуском (___) для слова через Gemini"""
+    proxy_id = None
     try:
-        api_key = os.environ['GEMINI_API_KEY']
         proxy_id, proxy_url = get_active_proxy_from_db()
         if not proxy_url:
             proxy_url = os.environ.get('PROXY_URL', '')
@@ -1291,38 +1426,31 @@ Examples:
 
 Return ONLY the sentence with ___, nothing else.'''
 
-            gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-            
             payload = {
                 'contents': [{'parts': [{'text': prompt}]}],
                 'generationConfig': {'temperature': 0.7, 'maxOutputTokens': 100}
             }
             
-            proxy_handler = urllib.request.ProxyHandler({
-                'http': f'http://{proxy_url}',
-                'https': f'http://{proxy_url}'
-            })
-            opener = urllib.request.build_opener(proxy_handler)
-            
-            req = urllib.request.Request(
-                gemini_url,
-                data=json.dumps(payload).encode('utf-8'),
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            with opener.open(req, timeout=10) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                sentence_template = result['candidates'][0]['content']['parts'][0]['text'].strip()
-                log_proxy_success(proxy_id)
-                print(f"[DEBUG] Generated sentence: {sentence_template}")
+            sentence_template = llm_client.generate_text('gemini-2.5-flash', payload, proxy_url, timeout=10, task='context_exercise').strip()
+            log_proxy_success(proxy_id)
+            print(f"[DEBUG] Generated sentence: {sentence_template}")
     
     except Exception as e:
         print(f"[ERROR] Failed to generate context sentence: {e}")
         if proxy_id:
-            log_proxy_failure(proxy_id, str(e))
+            log_proxy_failure(proxy_id, e)
         # Fallback на простое предложение
         sentence_template = f"I like ___"
     
+    return sentence_template
+
+def generate_context_exercise(word: Dict[str, Any], language_level: str, all_words: List[Dict[str, Any]] = None) -> tuple:
+    """Генерирует упражнение Fill in the blanks с вариантами ответа: предложение из банка или через Gemini"""
+    # ⚡ PERFORMANCE: готовое предложение из банка - без вызова Gemini в пути ответа
+    sentence_template = take_bank_exercise(word.get('id'), language_level, 'context')
+    if not sentence_template:
+        sentence_template = generate_context_sentence(word, language_level)
+    
     # Генерируем варианты ответов (правильный + 3 неправильных) - НА АНГЛИЙСКОМ
     options = [word['english']]  # Правильный ответ
     
@@ -1371,11 +1499,29 @@ def get_mastered_words(student_id: int) -> List[str]:
     return mastered_words
 
 def generate_association_exercise(word: Dict[str, Any], language_level: str, student_id: int = None) -> tuple:
-    """Генерирует упражнение с ассоциациями через Gemini, используя освоенные слова"""
+    """Генерирует упражнение с ассоциациями: подсказки из банка или через Gemini (с освоенными словами)"""
+    # ⚡ PERFORMANCE: готовые подсказки из банка - без вызова Gemini и без загрузки освоенных слов
+    hints = None
+    bank_content = take_bank_exercise(word.get('id'), language_level, 'association')
+    if bank_content:
+        hints = safe_json_parse(bank_content, {}).get('associations')
+    if not hints:
+        hints = generate_association_hints(word, language_level, student_id)
+    
+    hints_text = ', '.join(hints[:3])
+    
+    # Убираем транскрипцию и кнопку произношения
+    message = f"🎯 Guess the word by associations:\n\n{hints_text}\n\n"
+    message += f"🔑 Слово: <b>{word['english']}</b>"
+    message += f"\n🇷🇺 {word['russian']}"
+    
+    return (message, word['english'])
+
+def generate_association_hints(word: Dict[str, Any], language_level: str, student_id: int = None) -> List[str]:
+    """Генерирует 3 ассоциации к слову через Gemini, используя освоенные слова студента"""
     try:
-        print(f"[DEBUG generate_association_exercise] Starting for word: {word['english']}, level: {language_level}")
+        print(f"[DEBUG generate_association_hints] Starting for word: {word['english']}, level: {language_level}")
         
-        api_key = os.environ['GEMINI_API_KEY']
         proxy_id, proxy_url = get_active_proxy_from_db()
         if not proxy_url:
             proxy_url = os.environ.get('PROXY_URL', '')
@@ -1383,12 +1529,7 @@ def generate_association_exercise(word: Dict[str, Any], language_level: str, stu
         
         if not proxy_url:
             print(f"[WARNING] No proxy available - using fallback associations")
-            hints = ['word', 'thing', 'item']
-            hints_text = ', '.join(hints)
-            return (
-                f"🎯 Guess the word by associations:\n\n{hints_text}\n\nRussian translation: {word['russian']}",
-                word['english']
-            )
+            return ['word', 'thing', 'item']
         
         # Получаем освоенные слова студента
         mastered_words = []
@@ -1419,61 +1560,94 @@ Return ONLY valid JSON:
 
         print(f"[DEBUG] Calling Gemini for associations...")
         
-        gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-        
         payload = {
             'contents': [{'parts': [{'text': prompt}]}],
             'generationConfig': {'temperature': 0.7, 'maxOutputTokens': 500}
         }
         
-        proxy_handler = urllib.request.ProxyHandler({
-            'http': f'http://{proxy_url}',
-            'https': f'http://{proxy_url}'
-        })
-        opener = urllib.request.build_opener(proxy_handler)
+        text = llm_client.generate_text('gemini-2.5-flash', payload, proxy_url, timeout=15, task='association_exercise')
         
-        req = urllib.request.Request(
-            gemini_url,
-            data=json.dumps(payload).encode('utf-8'),
-            headers={'Content-Type': 'application/json'}
-        )
+        print(f"[DEBUG] Gemini response for associations: {text}")
+        
+        data = safe_json_parse(text, {'associations': ['word', 'thing', 'item']})
+        hints = data.get('associations', ['word', 'thing', 'item'])[:3]
+        
+        print(f"[DEBUG] Parsed associations: {hints}")
+        
+        log_proxy_success(proxy_id)
+        
+        return hints
         
-        with opener.open(req, timeout=15) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            text = result['candidates'][0]['content']['parts'][0]['text']
-            
-            print(f"[DEBUG] Gemini response for associations: {text}")
-            
-            data = safe_json_parse(text, {'associations': ['word', 'thing', 'item']})
-            hints = data.get('associations', ['word', 'thing', 'item'])[:3]
-            
-            print(f"[DEBUG] Parsed associations: {hints}")
-            
-            log_proxy_success(proxy_id)
-            
-            hints_text = ', '.join(hints)
-            
-            # Убираем транскрипцию и кнопку произношения
-            message = f"🎯 Guess the word by associations:\n\n{hints_text}\n\n"
-            message += f"🔑 Слово: <b>{word['english']}</b>"
-            message += f"\n🇷🇺 {word['russian']}"
-            
-            return (message, word['english'])
-            
     except Exception as e:
         print(f"[ERROR] Failed to generate associations for '{word['english']}': {e}")
         import traceback
         traceback.print_exc()
         
         # Fallback на простые ассоциации
-        hints = ['word', 'thing', 'item']
-        hints_text = ', '.join(hints)
-        
-        message = f"🎯 Guess the word by associations:\n\n{hints_text}\n\n"
-        message += f"🔑 Слово: <b>{word['english']}</b>"
-        message += f"\n🇷🇺 {word['russian']}"
-        
-        return (message, word['english'])
+        return ['word', 'thing', 'item']
+
+def check_sentence_with_gemini(user_answer: str, correct_answer: str, language_level: str) -> Dict[str, Any]:
+    """Проверка предложения студента через Gemini (грамматика + использование слова)"""
+    proxy_id, proxy_url = get_active_proxy_from_db()
+    if not proxy_url:
+        proxy_id = None
+        proxy_url = os.environ.get('PROXY_URL', '')
+    
+    check_prompt = f'''Check if this English sentence is grammatically correct and uses the word "{correct_answer}" properly.
+
+Student's sentence: "{user_answer}"
+Required word: {correct_answer}
+Student level: {language_level}
+
+⚠️ CRITICAL - Check for these errors:
+1. Subject-verb agreement (I am/he is, I have/he has)
+2. Verb tenses (present/past/future)
+3. Articles (a/an/the)
+4. Word order
+5. Does sentence contain the required word?
+
+Respond ONLY with this JSON:
+{{
+  "is_correct": true/false,
+  "has_word": true/false,
+  "grammar_ok": true/false,
+  "feedback": "short explanation in Russian about the mistake",
+  "corrected": "corrected sentence if needed (or empty string if correct)"
+}}
+
+Rules:
+- is_correct = true ONLY if: has_word=true AND grammar_ok=true AND no major errors
+- has_word = true if sentence contains the required word "{correct_answer}"
+- grammar_ok = true if there are NO grammar mistakes (even small ones!)
+- feedback should explain the error clearly in Russian
+- corrected should show the fixed sentence
+
+Example:
+Input: "I has a voice"
+Output: {{"is_correct": false, "has_word": true, "grammar_ok": false, "feedback": "Ошибка: 'I has' неправильно. С местоимением 'I' используется 'have', а не 'has'", "corrected": "I have a voice"}}'''
+    
+    payload = {
+        'contents': [{'parts': [{'text': check_prompt}]}],
+        'generationConfig': {'temperature': 0.3, 'maxOutputTokens': 2000}
+    }
+    
+    try:
+        check_data = llm_client.generate_json('gemini-2.5-flash', payload, SENTENCE_CHECK_RESPONSE, proxy_url, timeout=15, task='sentence_check')
+    except llm_client.LLMError as e:
+        if e.status_code is not None:
+            raise
+        # Ответ пришел, но не по схеме даже после починки - прокси исправен
+        print(f'[WARNING] Sentence check response rejected: {e}')
+        log_proxy_success(proxy_id)
+        return {'is_correct': False, 'feedback': 'Ошибка проверки', 'corrected': '', 'has_word': False, 'grammar_ok': False}
+    print(f'[DEBUG] Parsed check_data: {check_data}')
+    
+    log_proxy_success(proxy_id)
+    
+    # Запоминаем только настоящий вердикт (fallback выше сюда не доходит)
+    sentence_pregrader.remember(user_answer, correct_answer, language_level, check_data)
+    
+    return check_data
 
 def generate_translation_exercise(word: Dict[str, Any]) -> tuple:
     """Генерирует упражнение на перевод"""
@@ -1483,23 +1657,101 @@ def generate_translation_exercise(word: Dict[str, Any]) -> tuple:
     
     return (message, word['english'])
 
-def call_gemini(user_message: str, history: List[Dict[str, str]], session_words: List[Dict[str, Any]] = None, language_level: str = 'A1', preferred_topics: List[Dict[str, str]] = None, urgent_goals: List[str] = None, learning_goal: str = None, learning_mode: str = 'standard') -> str:
-    """Вызывает Gemini API через прокси с учетом слов, уровня, тем и срочных целей"""
-    print(f"[DEBUG call_gemini] Received session_words: {session_words}")
-    print(f"[DEBUG call_gemini] Received language_level: {language_level}")
-    print(f"[DEBUG call_gemini] Received learning_mode: {learning_mode}, learning_goal: {learning_goal}")
-    
-    api_key = os.environ['GEMINI_API_KEY']
-    
-    # Получаем прокси из БД (приоритет) или из env как fallback
-    proxy_id, proxy_url = get_active_proxy_from_db()
-    if not proxy_url:
-        proxy_id = None
-        proxy_url = os.environ.get('PROXY_URL', '')
-        print("[DEBUG] Using PROXY_URL from env (no active proxies in DB)")
-    
-    # Определяем эмоциональный контекст
-    emotional_mode = detect_emotional_context(user_message)
+# ⚡ PERFORMANCE: статические блоки системного промпта диалога компилируются один раз при загрузке модуля
+_WORD_CHECK_TEMPLATE = prompt_templates.compile_template(
+    "\n\n🎯 CRITICAL TASK - WORD MASTERY CHECK:\n"
+    f"The word '{prompt_templates.slot('english')}' ({prompt_templates.slot('russian')}) has been used 5 times in conversations.\n"
+    "NOW you must CHECK if the student truly knows this word.\n\n"
+    "Your task:\n"
+    f"1. Ask a question that REQUIRES using '{prompt_templates.slot('english')}' in the answer\n"
+    "2. Make it natural and conversational (not like a test)\n"
+    "3. The question should be related to the word's meaning\n\n"
+    "Examples:\n"
+    "- For 'cat': 'Do you have any pets? Tell me about them!' or 'What animals do you like?'\n"
+    "- For 'travel': 'Where would you like to go? Tell me about your dream destination!'\n"
+    "- For 'book': 'What are you reading these days? Any favorite books?'\n\n"
+    f"After the student answers, analyze if they used '{prompt_templates.slot('english')}' correctly.\n"
+    f"If YES → reply with: '✅ WORD_MASTERED: {prompt_templates.slot('english')}' at the END of your message (after regular response)\n"
+    "If NO or incorrectly → continue teaching naturally"
+)
+
+_VOCABULARY_TEMPLATE = prompt_templates.compile_template(
+    "\n\n🎯 CRITICAL VOCABULARY TASK:\n"
+    f"You MUST use these words in your responses: {prompt_templates.slot('words')}\n\n"
+    "RULES:\n"
+    "- Use AT LEAST 1 word from this list in EVERY response\n"
+    "- ⚠️ CRITICAL: When you use a word, wrap it in **bold**: **travel**, **plausible**, **weekend**\n"
+    "- Make examples or mini-stories with the word to make it memorable!\n"
+    "- Show the word in CONTEXT so student understands usage\n\n"
+    "🎨 HOW TO TEACH WORDS EFFECTIVELY:\n\n"
+    "1. **Simple usage** (30% of time):\n"
+    "   'That sounds **plausible**! Makes sense.'\n\n"
+    "2. **Quick example** (40% of time):\n"
+    "   'Nice! So you want to **emmerse** yourself in the game world? Like when you play and forget about everything else?'\n"
+    "   'That's **plausible**! Like saying a story could really happen in real life.'\n\n"
+    "3. **Mini-story** (20% of time - 2-3 sentences):\n"
+    "   'Speaking of **travel** ✈️ - I once met a guy who traveled to 30 countries in one year! He said the best part was trying local food. Have you traveled anywhere cool?'\n"
+    "   'You know, **plausible** is interesting! 🤔 My friend told me he saw a UFO - I said 'hmm, not very plausible!' But then he showed me a photo! Was it **plausible** after all? What do you think?'\n\n"
+    "4. **Comparison** (10% of time):\n"
+    "   'So **plausible** means believable - like 'that excuse sounds plausible' vs 'that excuse sounds ridiculous'. Make sense?'\n\n"
+    "⚠️ IMPORTANT RULES:\n"
+    "- VARY your approach - don't always use same pattern!\n"
+    "- Each word should appear in DIFFERENT context every time\n"
+    "- After giving example/story, ask a follow-up question\n"
+    "- Keep it conversational and fun, not like a textbook\n"
+    "- Use emojis sparingly (1-2 max per message)\n\n"
+    "⚠️ CRITICAL: DO NOT just repeat the same word without showing HOW to use it!\n"
+    "⚠️ CRITICAL: ROTATE through words - don't use same word every message!"
+)
+
+_TOPICS_TEMPLATE = prompt_templates.compile_template(
+    f"\n\nStudent's favorite topics: {prompt_templates.slot('topics')}\nFeel free to bring up these topics in conversation."
+)
+
+_SUMMARY_TEMPLATE = prompt_templates.compile_template(
+    f"\n\n📝 EARLIER IN THIS CONVERSATION (summary of older messages):\n{prompt_templates.slot('summary')}\n"
+    "Stay consistent with it, but don't retell it to the student."
+)
+
+_URGENT_TASK_TEMPLATE = prompt_templates.compile_template(
+    f"\n\n🚨 STUDENT'S URGENT TASK: {prompt_templates.slot('learning_goal')}\n\n"
+    f"Specific goals to practice:\n{prompt_templates.slot('goals_list')}"
+)
+
+_SPECIFIC_GOAL_TEMPLATE = prompt_templates.compile_template(
+    f"\n\n🎯 STUDENT'S GOAL: {prompt_templates.slot('learning_goal')}"
+)
+
+_CONVERSATION_IN_PROGRESS_BLOCK = (
+    "\n\n⚠️⚠️⚠️ ABSOLUTELY CRITICAL - CONVERSATION IN PROGRESS ⚠️⚠️⚠️\n"
+    "This is a CONTINUATION of an existing conversation. You are ALREADY talking to this person.\n\n"
+    "FORBIDDEN GREETINGS (DO NOT USE):\n"
+    "- 'Hey there' / 'Hi there' / 'Hello' / 'Hey' / 'Hi'\n"
+    "- 'So glad' / 'Glad we're back' / 'Good to see you' / 'Welcome back'\n"
+    "- 'Glad we got things working' / 'Nice to chat again'\n"
+    "- ANY form of greeting or welcoming phrase\n\n"
+    "CORRECT APPROACH:\n"
+    "- Jump DIRECTLY into responding to their last message\n"
+    "- Continue the conversation naturally as if you never stopped\n"
+    "- If they ask a question, answer it directly (no greeting first)\n"
+    "- If they make a statement, react to it naturally (no greeting first)\n\n"
+    "EXAMPLE - WRONG vs RIGHT:\n"
+    "Student: 'No'\n"
+    "❌ WRONG: 'Hey there! So glad we got things working...'\n"
+    "✅ RIGHT: 'Got it! That's totally fine.'\n\n"
+    "⚠️ DO NOT say 'Hey there' / 'Hi' / 'Hello' / 'Glad we're back' - you're already talking\n"
+    "- Continue like you're in the middle of a text conversation\n"
+    "- NEVER greet someone you're already talking to - that's weird!\n"
+    "- Imagine you just sent your last message 10 seconds ago - you wouldn't say 'Hey' again!"
+)
+
+def _dialog_skeleton_source(empathetic_prompt_template: str, error_correction_rules: str, emotional_mode: str, language_level: str, learning_mode: str) -> str:
+    """
+    Исходник скелета системного промпта диалога для prompt_templates. Скелет без слотов:
+    он одинаков для всех студентов с тем же ключом и целиком уходит в кэш контекста Gemini.
+    Emoji настроения выбирается один раз на скелет, цель студента и список целей -
+    отдельный блок запроса (_URGENT_TASK_TEMPLATE, _SPECIFIC_GOAL_TEMPLATE).
+    """
     mood_emoji = get_emoji_for_mood(emotional_mode)
     
     # Определяем сложность диалога по уровню
@@ -1514,10 +1766,6 @@ def call_gemini(user_message: str, history: List[Dict[str, str]], session_words:
     
     level_instruction = level_instructions.get(language_level, level_instructions['A1'])
     
-    # Получаем промпты из БД
-    empathetic_prompt_template = get_prompt_from_db('empathetic_mode', '')
-    error_correction_rules = get_prompt_from_db('error_correction_rules', '')
-    
     # Если промпты не найдены в БД - используем fallback (но это не должно случаться)
     if not empathetic_prompt_template:
         empathetic_prompt_template = """You are Anya, a caring friend who teaches English. Your student's level is {language_level}.
@@ -1596,17 +1844,13 @@ Then continue with your regular response.
         # КРИТИЧНО: Используем learning_mode для выбора промпта, НЕ наличие learning_goal!
         if learning_mode == 'urgent_task':
             # РЕЖИМ СРОЧНОЙ ЗАДАЧИ - Аня играет роли из целей
-            goals_list = '\n'.join([f'  {i+1}. {goal}' for i, goal in enumerate(urgent_goals)])
             system_prompt = f"""You are Anya, a friendly English tutor helping someone with an URGENT TASK. Your student's level is {language_level}.
 
 {error_correction_rules}
 
 🚨 URGENT TASK MODE - Role-playing scenarios!
 
-Student's urgent task: {learning_goal}
-
-Specific goals to practice:
-{goals_list}
+The student's urgent task and the specific goals to practice are in the "STUDENT'S URGENT TASK" block below.
 
 Your mission:
 - Play characters from these scenarios (airport staff, hotel receptionist, restaurant waiter, conference attendee, taxi driver, etc.)
@@ -1642,7 +1886,7 @@ Remember: You're helping them prepare for REAL situations. Make it practical and
 
 {error_correction_rules}
 
-🎯 CRITICAL: Student's specific goal: {learning_goal}
+🎯 CRITICAL: Student's specific goal is in the "STUDENT'S GOAL" block below.
 
 Your mission:
 - Talk ONLY about topics related to their goal
@@ -1812,127 +2056,89 @@ IMPORTANT:
 - MOST OF THE TIME: just react naturally without long stories
 - Be encouraging but don't skip corrections!"""
     
+    return system_prompt
+
+def build_gemini_payload(user_message: str, history: List[Dict[str, str]], session_words: List[Dict[str, Any]] = None, language_level: str = 'A1', preferred_topics: List[Dict[str, str]] = None, urgent_goals: List[str] = None, learning_goal: str = None, learning_mode: str = 'standard', conversation_summary: str = None, proxy_url: str = None) -> Dict[str, Any]:
+    """
+    Собирает запрос к Gemini для диалога: системный промпт (systemInstruction), история и новое сообщение.
+    История урезается до бюджета токенов, более старые реплики приходят сводкой (conversation_summary).
+    С proxy_url стабильный скелет промпта уходит в кэш контекста Gemini через этот прокси.
+    """
+    # Определяем эмоциональный контекст
+    emotional_mode = detect_emotional_context(user_message)
+    
+    # Получаем промпты из БД
+    empathetic_prompt_template = get_prompt_from_db('empathetic_mode', '')
+    error_correction_rules = get_prompt_from_db('error_correction_rules', '')
+    
+    # ⚡ PERFORMANCE: скелет промпта собирается один раз на (версия промптов, режим, уровень, режим обучения)
+    # и дальше переиспользуется как есть - готовая строка, без сборки на запрос.
+    # Сами тексты промптов из БД входят в ключ - после правки в админке соберется новый скелет
+    skeleton = prompt_templates.get_compiled(
+        ('dialog', empathetic_prompt_template, error_correction_rules, emotional_mode, language_level, learning_mode),
+        lambda: _dialog_skeleton_source(empathetic_prompt_template, error_correction_rules, emotional_mode, language_level, learning_mode)
+    )
+    
+    # Собираем промпт кусками: [0] - скелет, остальное - часть конкретного запроса
+    prompt_parts = [prompt_templates.render(skeleton)]
+    
+    # Цель студента - в запросе, а не в скелете (скелет общий для всех студентов и кэшируется)
+    if emotional_mode != 'empathetic' and learning_mode == 'urgent_task':
+        prompt_parts.append(prompt_templates.render(_URGENT_TASK_TEMPLATE, {
+            'learning_goal': str(learning_goal),
+            'goals_list': '\n'.join([f'  {i+1}. {goal}' for i, goal in enumerate(urgent_goals or [])])
+        }))
+    elif emotional_mode != 'empathetic' and learning_mode == 'specific_topic':
+        prompt_parts.append(prompt_templates.render(_SPECIFIC_GOAL_TEMPLATE, {'learning_goal': str(learning_goal)}))
+    
     if session_words:
         print(f"[DEBUG call_gemini] Adding {len(session_words)} words to prompt")
         check_word = next((w for w in session_words if w.get('needs_check')), None)
         
         if check_word:
             print(f"[DEBUG call_gemini] Found check word: {check_word}")
-            system_prompt += f"\n\n🎯 CRITICAL TASK - WORD MASTERY CHECK:\n"
-            system_prompt += f"The word '{check_word['english']}' ({check_word['russian']}) has been used 5 times in conversations.\n"
-            system_prompt += f"NOW you must CHECK if the student truly knows this word.\n\n"
-            system_prompt += f"Your task:\n"
-            system_prompt += f"1. Ask a question that REQUIRES using '{check_word['english']}' in the answer\n"
-            system_prompt += f"2. Make it natural and conversational (not like a test)\n"
-            system_prompt += f"3. The question should be related to the word's meaning\n\n"
-            system_prompt += f"Examples:\n"
-            system_prompt += f"- For 'cat': 'Do you have any pets? Tell me about them!' or 'What animals do you like?'\n"
-            system_prompt += f"- For 'travel': 'Where would you like to go? Tell me about your dream destination!'\n"
-            system_prompt += f"- For 'book': 'What are you reading these days? Any favorite books?'\n\n"
-            system_prompt += f"After the student answers, analyze if they used '{check_word['english']}' correctly.\n"
-            system_prompt += f"If YES → reply with: '✅ WORD_MASTERED: {check_word['english']}' at the END of your message (after regular response)\n"
-            system_prompt += f"If NO or incorrectly → continue teaching naturally"
+            prompt_parts.append(prompt_templates.render(_WORD_CHECK_TEMPLATE, {'english': check_word['english'], 'russian': check_word['russian']}))
         else:
             words_list = [f"{w['english']} ({w['russian']})" for w in session_words[:10]]
             print(f"[DEBUG call_gemini] Adding word list to prompt: {words_list}")
             
             # ЖОРСТКИЙ НАКАЗ використовувати слова + примеры + короткие истории
-            system_prompt += f"\n\n🎯 CRITICAL VOCABULARY TASK:\n"
-            system_prompt += f"You MUST use these words in your responses: {', '.join(words_list)}\n\n"
-            system_prompt += f"RULES:\n"
-            system_prompt += f"- Use AT LEAST 1 word from this list in EVERY response\n"
-            system_prompt += f"- ⚠️ CRITICAL: When you use a word, wrap it in **bold**: **travel**, **plausible**, **weekend**\n"
-            system_prompt += f"- Make examples or mini-stories with the word to make it memorable!\n"
-            system_prompt += f"- Show the word in CONTEXT so student understands usage\n\n"
-            
-            system_prompt += f"🎨 HOW TO TEACH WORDS EFFECTIVELY:\n\n"
-            system_prompt += f"1. **Simple usage** (30% of time):\n"
-            system_prompt += f"   'That sounds **plausible**! Makes sense.'\n\n"
-            
-            system_prompt += f"2. **Quick example** (40% of time):\n"
-            system_prompt += f"   'Nice! So you want to **emmerse** yourself in the game world? Like when you play and forget about everything else?'\n"
-            system_prompt += f"   'That's **plausible**! Like saying a story could really happen in real life.'\n\n"
-            
-            system_prompt += f"3. **Mini-story** (20% of time - 2-3 sentences):\n"
-            system_prompt += f"   'Speaking of **travel** ✈️ - I once met a guy who traveled to 30 countries in one year! He said the best part was trying local food. Have you traveled anywhere cool?'\n"
-            system_prompt += f"   'You know, **plausible** is interesting! 🤔 My friend told me he saw a UFO - I said 'hmm, not very plausible!' But then he showed me a photo! Was it **plausible** after all? What do you think?'\n\n"
-            
-            system_prompt += f"4. **Comparison** (10% of time):\n"
-            system_prompt += f"   'So **plausible** means believable - like 'that excuse sounds plausible' vs 'that excuse sounds ridiculous'. Make sense?'\n\n"
-            
-            system_prompt += f"⚠️ IMPORTANT RULES:\n"
-            system_prompt += f"- VARY your approach - don't always use same pattern!\n"
-            system_prompt += f"- Each word should appear in DIFFERENT context every time\n"
-            system_prompt += f"- After giving example/story, ask a follow-up question\n"
-            system_prompt += f"- Keep it conversational and fun, not like a textbook\n"
-            system_prompt += f"- Use emojis sparingly (1-2 max per message)\n\n"
-            
-            system_prompt += f"⚠️ CRITICAL: DO NOT just repeat the same word without showing HOW to use it!\n"
-            system_prompt += f"⚠️ CRITICAL: ROTATE through words - don't use same word every message!"
+            prompt_parts.append(prompt_templates.render(_VOCABULARY_TEMPLATE, {'words': ', '.join(words_list)}))
     else:
         print(f"[DEBUG call_gemini] NO session_words provided!")
     
     if preferred_topics and len(preferred_topics) > 0:
         topics_list = [f"{t['emoji']} {t['topic']}" for t in preferred_topics[:5]]
-        system_prompt += f"\n\nStudent's favorite topics: {', '.join(topics_list)}\nFeel free to bring up these topics in conversation."
+        prompt_parts.append(prompt_templates.render(_TOPICS_TEMPLATE, {'topics': ', '.join(topics_list)}))
     
-    # Формируем содержимое для Gemini (system prompt + история + новое сообщение)
+    # Формируем содержимое для Gemini (история + новое сообщение), системный промпт - отдельно
     contents = []
     
+    if conversation_summary:
+        summary = history_window.clip_text(conversation_summary, history_window.SUMMARY_MAX_TOKENS)
+        prompt_parts.append(prompt_templates.render(_SUMMARY_TEMPLATE, {'summary': summary}))
+    
     # Если есть история - указываем что это продолжение диалога
     if history and len(history) > 0:
-        system_prompt += "\n\n⚠️⚠️⚠️ ABSOLUTELY CRITICAL - CONVERSATION IN PROGRESS ⚠️⚠️⚠️\n"
-        system_prompt += "This is a CONTINUATION of an existing conversation. You are ALREADY talking to this person.\n\n"
-        system_prompt += "FORBIDDEN GREETINGS (DO NOT USE):\n"
-        system_prompt += "- 'Hey there' / 'Hi there' / 'Hello' / 'Hey' / 'Hi'\n"
-        system_prompt += "- 'So glad' / 'Glad we're back' / 'Good to see you' / 'Welcome back'\n"
-        system_prompt += "- 'Glad we got things working' / 'Nice to chat again'\n"
-        system_prompt += "- ANY form of greeting or welcoming phrase\n\n"
-        system_prompt += "CORRECT APPROACH:\n"
-        system_prompt += "- Jump DIRECTLY into responding to their last message\n"
-        system_prompt += "- Continue the conversation naturally as if you never stopped\n"
-        system_prompt += "- If they ask a question, answer it directly (no greeting first)\n"
-        system_prompt += "- If they make a statement, react to it naturally (no greeting first)\n\n"
-        system_prompt += "EXAMPLE - WRONG vs RIGHT:\n"
-        system_prompt += "Student: 'No'\n"
-        system_prompt += "❌ WRONG: 'Hey there! So glad we got things working...'\n"
-        system_prompt += "✅ RIGHT: 'Got it! That's totally fine.'\n\n"
-        system_prompt += "⚠️ DO NOT say 'Hey there' / 'Hi' / 'Hello' / 'Glad we're back' - you're already talking\n"
-        system_prompt += "- Continue like you're in the middle of a text conversation\n"
-        system_prompt += "- NEVER greet someone you're already talking to - that's weird!\n"
-        system_prompt += "- Imagine you just sent your last message 10 seconds ago - you wouldn't say 'Hey' again!"
-    
-    # Добавляем системный промпт как первое сообщение пользователя
-    contents.append({
-        'role': 'user',
-        'parts': [{'text': system_prompt}]
-    })
-    
-    # Добавляем ответ модели что она поняла
-    contents.append({
-        'role': 'model',
-        'parts': [{'text': 'Understood! I will follow these instructions.'}]
-    })
+        prompt_parts.append(_CONVERSATION_IN_PROGRESS_BLOCK)
     
-    # Добавляем историю диалога
-    for msg in history[-15:]:
+    # Добавляем историю диалога: свежие сообщения в пределах бюджета токенов
+    for msg in history_window.fit_history(history):
         role = 'user' if msg['role'] == 'user' else 'model'
         contents.append({
             'role': role,
             'parts': [{'text': msg['content']}]
         })
     
-    # Добавляем новое сообщение
+    # Добавляем новое сообщение (огромный вставленный текст обрезается - размер промпта предсказуем)
     contents.append({
         'role': 'user',
-        'parts': [{'text': user_message}]
+        'parts': [{'text': history_window.clip_text(user_message, history_window.MAX_USER_MESSAGE_TOKENS)}]
     })
     
     # ⚡ OPTIMIZATION: Убрана проверка ListModels - тормозила запросы
     
     # Подготавливаем запрос к Gemini REST API
-    gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-    
     payload = {
         'contents': contents,
         'generationConfig': {
@@ -1942,46 +2148,138 @@ IMPORTANT:
         }
     }
     
+    # ⚡ PERFORMANCE: скелет одинаков для всех студентов с тем же уровнем и режимом -
+    # он кэшируется в Gemini (ключ - текст промпта, т.е. версия промптов из БД + уровень + режим).
+    # Цель, слова, темы и пометка о продолжении диалога остаются частью конкретного запроса
+    return llm_client.with_system_prompt(
+        payload, get_dialog_model(), prompt_parts[0], ''.join(prompt_parts[1:]), proxy_url,
+        label=f'dialog-{language_level}-{learning_mode}-{emotional_mode}'
+    )
+
+def get_gemini_proxy() -> tuple:
+    """Прокси для Gemini: из БД (приоритет) или из env как fallback - возвращает (id, url)"""
+    proxy_id, proxy_url = get_active_proxy_from_db()
+    if not proxy_url:
+        proxy_id = None
+        proxy_url = os.environ.get('PROXY_URL', '')
+        print("[DEBUG] Using PROXY_URL from env (no active proxies in DB)")
+    return proxy_id, proxy_url
+
+def call_gemini(user_message: str, history: List[Dict[str, str]], session_words: List[Dict[str, Any]] = None, language_level: str = 'A1', preferred_topics: List[Dict[str, str]] = None, urgent_goals: List[str] = None, learning_goal: str = None, learning_mode: str = 'standard', conversation_summary: str = None) -> str:
+    """Вызывает Gemini API через прокси с учетом слов, уровня, тем и срочных целей"""
+    print(f"[DEBUG call_gemini] Received session_words: {session_words}")
+    print(f"[DEBUG call_gemini] Received language_level: {language_level}")
+    print(f"[DEBUG call_gemini] Received learning_mode: {learning_mode}, learning_goal: {learning_goal}")
+    
+    proxy_id, proxy_url = get_gemini_proxy()
+    payload = build_gemini_payload(user_message, history, session_words, language_level, preferred_topics, urgent_goals, learning_goal, learning_mode, conversation_summary, proxy_url=proxy_url)
+    
     # ВСЕГДА используем прокси (прямое подключение из РФ заблокировано Google)
     if not proxy_url:
         raise Exception("PROXY_URL is required for Gemini API access from Russia")
     
     print(f"[DEBUG] Calling Gemini with proxy...")
-    print(f"[DEBUG] URL: {gemini_url[:80]}...")
     
-    proxy_handler = urllib.request.ProxyHandler({
-        'http': f'http://{proxy_url}',
-        'https': f'http://{proxy_url}'
-    })
-    opener = urllib.request.build_opener(proxy_handler)
-    
-    req = urllib.request.Request(
-        gemini_url,
-        data=json.dumps(payload).encode('utf-8'),
-        headers={'Content-Type': 'application/json'}
-    )
+    # Запасной прокси для хеджа: если основной завис дольше p90 - запрос дублируется через него
+    backup = get_active_proxy_from_db(exclude={proxy_id}) if proxy_id else None
     
     try:
-        with opener.open(req, timeout=12) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            print(f"[DEBUG] Gemini success with proxy!")
-            
-            # Логируем успешный запрос через прокси
-            log_proxy_success(proxy_id)
-            
-            return result['candidates'][0]['content']['parts'][0]['text']
+        text, winner_id = llm_client.generate_text_hedged(
+            get_dialog_model(), payload, (proxy_id, proxy_url), backup,
+            timeout=12, task='dialog', on_other_result=proxy_health.record
+        )
+        print(f"[DEBUG] Gemini success with proxy!")
+        
+        # Логируем успешный запрос через прокси (победивший в хедже)
+        log_proxy_success(winner_id)
+        
+        return text
     except Exception as e:
+        # LLMError уже содержит HTTP статус и начало тела ответа
         error_message = str(e)
-        if isinstance(e, urllib.error.HTTPError):
-            error_body = e.read().decode('utf-8') if e.fp else 'no body'
-            error_message = f"HTTP {e.code}: {error_body[:200]}"
         
         print(f"[ERROR] Gemini API failed: {error_message}")
         
-        # Логируем ошибку прокси
-        log_proxy_failure(proxy_id, error_message)
+        # Логируем ошибку прокси
+        log_proxy_failure(proxy_id, e)
+        
+        raise
+
+def visible_stream_text(text: str) -> str:
+    """
+    Часть стримящегося ответа, которую можно показать пользователю:
+    без маркера WORD_MASTERED и без его начала, если маркер разрезан между кусками
+    """
+    marker_pos = text.find(WORD_MASTERED_MARKER)
+    if marker_pos != -1:
+        return text[:marker_pos].rstrip()
+    
+    for size in range(min(len(WORD_MASTERED_MARKER) - 1, len(text)), 0, -1):
+        if text.endswith(WORD_MASTERED_MARKER[:size]):
+            return text[:-size].rstrip()
+    return text
+
+def _plain_partial_text(text: str) -> str:
+    """Промежуточный текст без HTML тегов (незакрытый тег ломает parse_mode=HTML)"""
+    text = re.sub(r'<[^>]*>', '', text)
+    return re.sub(r'<[^>]*$', '', text)
+
+def stream_gemini_reply(chat_id: int, user_message: str, history: List[Dict[str, str]], session_words: List[Dict[str, Any]] = None, language_level: str = 'A1', preferred_topics: List[Dict[str, str]] = None, urgent_goals: List[str] = None, learning_goal: str = None, learning_mode: str = 'standard', conversation_summary: str = None, reply_markup=None) -> tuple:
+    """
+    Стримит ответ Gemini прямо в чат: первое предложение отправляется сразу,
+    дальше сообщение дописывается через edit_telegram_message не чаще STREAM_EDIT_INTERVAL.
+    Возвращает (текст ответа, message_id, truncated) - message_id = None если в чат ничего не ушло,
+    тогда ответ отправляет вызывающий код как обычно. truncated = True - стрим оборвался
+    (ошибка после первого сообщения или кончился бюджет апдейта) и текст неполный.
+    """
+    proxy_id, proxy_url = get_gemini_proxy()
+    if not proxy_url:
+        raise Exception("PROXY_URL is required for Gemini API access from Russia")
+    
+    payload = build_gemini_payload(user_message, history, session_words, language_level, preferred_topics, urgent_goals, learning_goal, learning_mode, conversation_summary, proxy_url=proxy_url)
+    
+    full_text = ''
+    shown_text = ''
+    message_id = None
+    last_edit_at = 0.0
+    truncated = False
+    
+    try:
+        for chunk in llm_client.stream_text(get_dialog_model(), payload, proxy_url, timeout=12, task='dialog_stream'):
+            full_text += chunk
+            if not deadline.has(0):
+                # Бюджет апдейта на исходе - отдаем то, что успело прийти
+                print(f"[WARNING] Dialog stream cut by deadline after {len(full_text)} chars")
+                truncated = True
+                break
+            visible = _plain_partial_text(visible_stream_text(full_text)).strip()
+            
+            if message_id is None:
+                # Ждем первое законченное предложение
+                if len(visible) >= STREAM_FIRST_MIN_CHARS or re.search(r'[.!?\n]', visible):
+                    result = send_telegram_message(chat_id, visible, reply_markup, parse_mode=None)
+                    message_id = result['result']['message_id']
+                    shown_text = visible
+                    last_edit_at = time.time()
+            elif visible != shown_text and time.time() - last_edit_at >= STREAM_EDIT_INTERVAL:
+                try:
+                    edit_telegram_message(chat_id, message_id, visible, parse_mode=None)
+                    shown_text = visible
+                except Exception as e:
+                    print(f"[WARNING] Failed to edit streamed message: {e}")
+                last_edit_at = time.time()
+        
+        log_proxy_success(proxy_id)
+    except Exception as e:
+        print(f"[ERROR] Gemini stream failed: {e}")
+        log_proxy_failure(proxy_id, e)
         
-        raise
+        if message_id is None:
+            # Пользователь еще ничего не видел - отвечаем обычным (не стриминговым) вызовом
+            return call_gemini(user_message, history, session_words, language_level, preferred_topics, urgent_goals, learning_goal, learning_mode, conversation_summary), None, False
+        truncated = True
+    
+    return full_text, message_id, truncated
 
 def get_reply_keyboard():
     """Возвращает актуальную клавиатуру для всех пользователей"""
@@ -1996,6 +2294,79 @@ def get_reply_keyboard():
         'persistent': True
     }
 
+def split_voice_chunks(text: str) -> List[str]:
+    """
+    Куски голосового ответа по границам предложений. Первый кусок - первое предложение
+    (чтобы первое голосовое пришло быстро), следующие - предложения, склеенные до VOICE_CHUNK_MAX_CHARS
+    """
+    text = text.strip()
+    if len(text) < VOICE_PIPELINE_MIN_CHARS:
+        return [text]
+    
+    chunks = []
+    for sentence in re.split(r'(?<=[.!?…])\s+|\n+', text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if chunks and (len(chunks[-1]) < VOICE_CHUNK_MIN_CHARS
+                       or len(chunks) >= VOICE_MAX_CHUNKS
+                       or (len(chunks) > 1 and len(chunks[-1]) + len(sentence) < VOICE_CHUNK_MAX_CHARS)):
+            chunks[-1] = f"{chunks[-1]} {sentence}"
+        else:
+            chunks.append(sentence)
+    return chunks or [text]
+
+def send_voice_chunks(chat_id: int, chunks: List[str]) -> int:
+    """
+    Озвучивает куски параллельно и отправляет голосовые по порядку, как только готов очередной.
+    Возвращает, сколько кусков отправлено голосом (остальные не успели или не озвучились)
+    """
+    synthesize = deadline.bind(llm_client.bind_telemetry_user(text_to_speech))
+    executor = ThreadPoolExecutor(max_workers=min(VOICE_TTS_WORKERS, len(chunks)))
+    futures = [executor.submit(synthesize, chunk) for chunk in chunks]
+    sent = 0
+    try:
+        for future in futures:
+            if sent and not deadline.has(0):
+                print(f"[WARNING] Voice reply cut after {sent}/{len(chunks)} chunks: {deadline.remaining():.1f}s left")
+                break
+            send_telegram_voice(chat_id, future.result())
+            sent += 1
+    except Exception as e:
+        print(f"[ERROR] Failed to generate voice response (chunk {sent + 1}/{len(chunks)}): {e}")
+    finally:
+        # Недоозвученные куски не ждем; уже начатые синтезы доедут в кэш озвучек
+        executor.shutdown(wait=False, cancel_futures=True)
+    return sent
+
+def send_voice_or_text(chat_id: int, text: str, reply_markup=None):
+    """
+    Голосовой ответ (длинный - несколькими голосовыми по предложениям, см. split_voice_chunks);
+    текстом - если до дедлайна апдейта меньше VOICE_REPLY_MIN_SECONDS или озвучка не удалась:
+    ответ не должен пропасть из-за таймаута. Если не озвучился только хвост - текстом идет хвост
+    """
+    if deadline.has(VOICE_REPLY_MIN_SECONDS):
+        chunks = split_voice_chunks(text)
+        sent = send_voice_chunks(chat_id, chunks)
+        if sent == len(chunks):
+            return
+        if sent:
+            text = ' '.join(chunks[sent:])
+    else:
+        print(f"[WARNING] Voice reply skipped: {deadline.remaining():.1f}s left")
+    send_telegram_message(chat_id, text, reply_markup)
+
+def notify_deadline_exceeded(event: Dict[str, Any]):
+    """Короткий ответ в чат апдейта, который не успел обработаться за бюджет времени"""
+    try:
+        update = json.loads(event.get('body') or '{}')
+        message = update.get('message') or (update.get('callback_query') or {}).get('message') or {}
+        chat_id = (message.get('chat') or {}).get('id')
+        if chat_id:
+            send_telegram_message(chat_id, DEADLINE_REPLY, parse_mode=None)
+    except Exception as e:
+        print(f"[WARNING] Failed to send deadline notice: {e}")
+
 def send_chat_action(chat_id: int, action: str = 'typing'):
     """Отправляет индикатор активности бота (печатает, отправляет фото и тд)"""
     token = os.environ['TELEGRAM_BOT_TOKEN']
@@ -2014,7 +2385,7 @@ def send_chat_action(chat_id: int, action: str = 'typing'):
     )
     
     try:
-        with urllib.request.urlopen(req, timeout=3) as response:
+        with urllib.request.urlopen(req, timeout=deadline.timeout(3)) as response:
             return json.loads(response.read().decode('utf-8'))
     except Exception as e:
         print(f"[WARNING] Failed to send chat action: {e}")
@@ -2043,7 +2414,7 @@ def send_telegram_voice(chat_id: int, voice_url: str, caption: str = None):
     )
     
     try:
-        with urllib.request.urlopen(req, timeout=15) as response:
+        with urllib.request.urlopen(req, timeout=deadline.timeout(15, reserve=0)) as response:
             return json.loads(response.read().decode('utf-8'))
     except Exception as e:
         print(f"[ERROR] Failed to send voice: {e}")
@@ -2067,7 +2438,7 @@ def send_telegram_sticker(chat_id: int, sticker_id: str):
     )
     
     try:
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with urllib.request.urlopen(req, timeout=deadline.timeout(10, reserve=0)) as response:
             result = json.loads(response.read().decode('utf-8'))
             print(f"[DEBUG] Sticker sent: {result}")
             return result
@@ -2102,7 +2473,7 @@ def send_telegram_message(chat_id: int, text: str, reply_markup=None, parse_mode
     )
     
     try:
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with urllib.request.urlopen(req, timeout=deadline.timeout(10, reserve=0)) as response:
             result = json.loads(response.read().decode('utf-8'))
             print(f"[DEBUG] Telegram API response: {result}")
             return result
@@ -2110,7 +2481,7 @@ def send_telegram_message(chat_id: int, text: str, reply_markup=None, parse_mode
         print(f"[ERROR] Failed to send message: {e}")
         raise
 
-def edit_telegram_message(chat_id: int, message_id: int, text: str):
+def edit_telegram_message(chat_id: int, message_id: int, text: str, parse_mode='HTML'):
     """Редактирует сообщение в Telegram"""
     token = os.environ['TELEGRAM_BOT_TOKEN']
     url = f'https://api.telegram.org/bot{token}/editMessageText'
@@ -2118,17 +2489,19 @@ def edit_telegram_message(chat_id: int, message_id: int, text: str):
     data = {
         'chat_id': chat_id,
         'message_id': message_id,
-        'text': text,
-        'parse_mode': 'HTML'
+        'text': text
     }
     
+    if parse_mode:
+        data['parse_mode'] = parse_mode
+    
     req = urllib.request.Request(
         url,
         data=json.dumps(data).encode('utf-8'),
         headers={'Content-Type': 'application/json'}
     )
     
-    with urllib.request.urlopen(req, timeout=10) as response:
+    with urllib.request.urlopen(req, timeout=deadline.timeout(10, reserve=0)) as response:
         return json.loads(response.read().decode('utf-8'))
 
 def set_bot_commands():
@@ -2155,7 +2528,7 @@ def set_bot_commands():
     )
     
     try:
-        with urllib.request.urlopen(req, timeout=10) as response:
+        with urllib.request.urlopen(req, timeout=deadline.timeout(10)) as response:
             result = json.loads(response.read().decode('utf-8'))
             print(f"[DEBUG] Bot commands set: {result}")
             return result
@@ -2163,23 +2536,27 @@ def set_bot_commands():
         print(f"[ERROR] Failed to set bot commands: {e}")
         return None
 
-def download_telegram_file(file_id: str) -> bytes:
-    """Скачивает файл из Telegram"""
+def open_telegram_file(file_id: str):
+    """
+    Открывает файл из Telegram на чтение (без скачивания целиком).
+    Ответ urllib - поток с read(n); длина файла в response.length (None, если Telegram ее не сообщил)
+    """
     token = os.environ['TELEGRAM_BOT_TOKEN']
     
     # Получаем путь к файлу
     url = f'https://api.telegram.org/bot{token}/getFile?file_id={file_id}'
-    with urllib.request.urlopen(url, timeout=10) as response:
+    with urllib.request.urlopen(url, timeout=deadline.timeout(10)) as response:
         data = json.loads(response.read().decode('utf-8'))
         file_path = data['result']['file_path']
     
-    # Скачиваем файл
     file_url = f'https://api.telegram.org/file/bot{token}/{file_path}'
-    with urllib.request.urlopen(file_url, timeout=15) as response:
-        return response.read()
+    return urllib.request.urlopen(file_url, timeout=deadline.timeout(15))
 
-def speech_to_text(audio_data: bytes) -> str:
-    """Распознает речь через OpenAI Whisper с прокси"""
+def speech_to_text(file_id: str) -> str:
+    """
+    Распознает голосовое из Telegram через OpenAI Whisper с прокси.
+    Файл идет из ответа Telegram прямо в тело загрузки (MultipartStream) по keep-alive сессии прокси
+    """
     openai_api_key = os.environ.get('OPENAI_API_KEY')
     
     if not openai_api_key:
@@ -2195,56 +2572,47 @@ def speech_to_text(audio_data: bytes) -> str:
     if not proxy_url:
         raise Exception("PROXY_URL is required for OpenAI API access")
     
-    # Сохраняем audio_data во временный файл (Whisper требует файл)
-    with tempfile.NamedTemporaryFile(suffix='.ogg', delete=False) as temp_audio:
-        temp_audio.write(audio_data)
-        temp_audio_path = temp_audio.name
+    url = 'https://api.openai.com/v1/audio/transcriptions'
+    
+    # Настройка прокси для requests
+    proxies = {
+        'http': f'http://{proxy_url}',
+        'https': f'http://{proxy_url}'
+    }
     
+    started = time.perf_counter()
     try:
-        url = 'https://api.openai.com/v1/audio/transcriptions'
-        
-        # Настройка прокси для requests
-        proxies = {
-            'http': f'http://{proxy_url}',
-            'https': f'http://{proxy_url}'
-        }
-        
-        with open(temp_audio_path, 'rb') as audio_file:
-            files = {
-                'file': ('voice.ogg', audio_file, 'audio/ogg')
-            }
-            data = {
-                'model': 'whisper-1',
-                'language': 'en'
-            }
+        with open_telegram_file(file_id) as audio_stream:
+            body = multipart_stream.MultipartStream(
+                {'model': 'whisper-1', 'language': 'en'},
+                'file', 'voice.ogg', audio_stream, audio_stream.length, 'audio/ogg'
+            )
             headers = {
-                'Authorization': f'Bearer {openai_api_key}'
+                'Authorization': f'Bearer {openai_api_key}',
+                'Content-Type': body.content_type
             }
-            
-            response = requests.post(
+            response = llm_client.get_session(proxy_url).post(
                 url,
                 headers=headers,
-                files=files,
-                data=data,
+                data=body,
                 proxies=proxies,
-                timeout=30
+                timeout=deadline.timeout(30)
             )
-        
         response.raise_for_status()
-        result = response.json()
-        
-        # Логируем успешный запрос через прокси
-        log_proxy_success(proxy_id)
-        
-        return result.get('text', '')
+    except Exception as e:
+        llm_client.record_external_call('whisper', 'whisper-1', proxy_url, started, False, e)
+        raise
+    llm_client.record_external_call('whisper', 'whisper-1', proxy_url, started, True)
     
-    finally:
-        # Удаляем временный файл
-        if os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
+    result = response.json()
+    
+    # Логируем успешный запрос через прокси
+    log_proxy_success(proxy_id)
+    
+    return result.get('text', '')
 
-def text_to_speech_openai(text: str) -> str:
-    """Генерирует озвучку через OpenAI TTS с прокси и возвращает CDN URL"""
+def synthesize_speech_openai(text: str) -> bytes:
+    """Синтез речи через OpenAI TTS с прокси - аудио в формате opus"""
     api_key = os.environ.get('OPENAI_API_KEY')
     if not api_key:
         raise Exception('OPENAI_API_KEY not configured')
@@ -2263,10 +2631,10 @@ def text_to_speech_openai(text: str) -> str:
     url = 'https://api.openai.com/v1/audio/speech'
     
     payload = {
-        'model': 'tts-1',
+        'model': TTS_MODEL,
         'input': text,
-        'voice': 'nova',
-        'response_format': 'opus'
+        'voice': TTS_VOICE,
+        'response_format': TTS_FORMAT
     }
     
     # Используем прокси для OpenAI
@@ -2285,34 +2653,21 @@ def text_to_speech_openai(text: str) -> str:
         }
     )
     
+    started = time.perf_counter()
+    audio_data = None
     try:
-        with opener.open(req, timeout=30) as response:
+        with opener.open(req, timeout=deadline.timeout(30)) as response:
             audio_data = response.read()
-            print(f"[DEBUG] OpenAI TTS success! Audio size: {len(audio_data)} bytes")
-            
-            # Логируем успешный запрос через прокси
-            log_proxy_success(proxy_id)
-            
-            # Сохраняем в S3
-            import boto3
-            s3 = boto3.client('s3',
-                endpoint_url='https://bucket.poehali.dev',
-                aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-                aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-            )
-            
-            file_key = f"voice/{hash(text)}.opus"
-            s3.put_object(
-                Bucket='files',
-                Key=file_key,
-                Body=audio_data,
-                ContentType='audio/ogg'
-            )
-            
-            cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
-            return cdn_url
-            
+        llm_client.record_external_call('tts', TTS_MODEL, proxy_url, started, True)
+        print(f"[DEBUG] OpenAI TTS success! Audio size: {len(audio_data)} bytes")
+        
+        # Логируем успешный запрос через прокси
+        log_proxy_success(proxy_id)
+        return audio_data
+        
     except Exception as e:
+        if audio_data is None:
+            llm_client.record_external_call('tts', TTS_MODEL, proxy_url, started, False, e)
         error_message = str(e)
         if isinstance(e, urllib.error.HTTPError):
             error_body = e.read().decode('utf-8') if e.fp else 'no body'
@@ -2321,12 +2676,23 @@ def text_to_speech_openai(text: str) -> str:
         print(f"[ERROR] OpenAI TTS failed: {error_message}")
         
         # Логируем ошибку прокси
-        log_proxy_failure(proxy_id, error_message)
+        log_proxy_failure(proxy_id, e, error_message)
         
         raise
 
+def text_to_speech_openai(text: str) -> str:
+    """CDN URL озвучки через OpenAI TTS: из общего кэша озвучек или синтез с загрузкой в S3 (tts_cache)"""
+    url, cached = tts_cache.get_audio(text, TTS_VOICE, TTS_MODEL, TTS_FORMAT, synthesize_speech_openai)
+    if cached:
+        print(f"[DEBUG] TTS cache hit: {url}")
+    return url
+
 def text_to_speech(text: str) -> str:
-    """Генерирует озвучку через OpenAI TTS (было Yandex)"""
+    """
+    Генерирует озвучку через OpenAI TTS (было Yandex).
+    Одинаковый текст (произношение слова, приветствие) синтезируется один раз за все время,
+    одновременные запросы одного текста ждут один синтез - см. tts_cache
+    """
     return text_to_speech_openai(text)
 
 def generate_plan_batch(student_id: int, learning_goal: str, language_level: str, preferred_topics: List[Dict[str, str]], batch_num: int) -> Dict[str, Any]:
@@ -2336,7 +2702,6 @@ def generate_plan_batch(student_id: int, learning_goal: str, language_level: str
     try:
         print(f"[DEBUG] generate_plan_batch STARTED: batch={batch_num}")
         
-        api_key = os.environ['GEMINI_API_KEY']
         proxy_id, proxy_url = get_active_proxy_from_db()
         if not proxy_url:
             proxy_id = None
@@ -2345,8 +2710,6 @@ def generate_plan_batch(student_id: int, learning_goal: str, language_level: str
         if not proxy_url:
             return {'success': False, 'error': 'PROXY_URL is required'}
         
-        gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-        
         topics_display = ', '.join([f"{t.get('emoji', '💡')} {t.get('topic', 'Общие темы')}" for t in preferred_topics[:5]]) if preferred_topics else '💡 Общие темы'
         
         week_start = (batch_num - 1) * 2 + 1
@@ -2382,74 +2745,40 @@ Return JSON: {{"plan": [{{"week": 1, "vocabulary": [{{"english": "word", "russia
             }
         }
         
-        proxy_handler = urllib.request.ProxyHandler({
-            'http': f'http://{proxy_url}',
-            'https': f'http://{proxy_url}'
-        })
-        opener = urllib.request.build_opener(proxy_handler)
-        
-        req = urllib.request.Request(
-            gemini_url,
-            data=json.dumps(payload).encode('utf-8'),
-            headers={'Content-Type': 'application/json'}
-        )
-            
-        # Пытаемся сгенерировать план с retry
+        # Формат держит structured output (PLAN_BATCH_RESPONSE): повтор нужен только при сбое прокси, не ради JSON
         max_retries = 2
         for attempt in range(max_retries):
             print(f"[DEBUG] Calling Gemini API for weeks {week_start}-{week_end}... (timeout=25s, attempt {attempt+1}/{max_retries})")
             try:
-                with opener.open(req, timeout=25) as response:
-                    print(f"[DEBUG] Gemini API responded for weeks {week_start}-{week_end}!")
-                    gemini_result = json.loads(response.read().decode('utf-8'))
-                    plan_text = gemini_result['candidates'][0]['content']['parts'][0]['text']
-                    
-                    print(f"[DEBUG] Parsing JSON for weeks {week_start}-{week_end}...")
-                    print(f"[DEBUG] Raw Gemini response length: {len(plan_text)} chars")
-                    
-                    # Используем safe_json_parse для обработки кривого JSON
-                    batch_data = safe_json_parse(plan_text, None)
-                    
-                    if not batch_data or 'plan' not in batch_data:
-                        print(f"[WARNING] Failed to parse JSON on attempt {attempt+1}")
-                        print(f"[DEBUG] Raw response (first 1000 chars): {plan_text[:1000]}")
-                        if attempt < max_retries - 1:
-                            print(f"[DEBUG] Retrying...")
-                            continue
-                        else:
-                            return {'success': False, 'error': f'Failed to parse Gemini response after {max_retries} attempts'}
-                    
-                    batch_weeks = batch_data.get('plan', [])
-                    
-                    if not batch_weeks or len(batch_weeks) == 0:
-                        print(f"[WARNING] Empty plan array on attempt {attempt+1}")
-                        if attempt < max_retries - 1:
-                            print(f"[DEBUG] Retrying...")
-                            continue
-                        else:
-                            return {'success': False, 'error': f'Gemini returned empty plan after {max_retries} attempts'}
-                    
+                batch_data = llm_client.generate_json('gemini-2.5-flash', payload, PLAN_BATCH_RESPONSE, proxy_url, timeout=25, task='learning_plan')
+                print(f"[DEBUG] Gemini API responded for weeks {week_start}-{week_end}!")
+                log_proxy_success(proxy_id)
+                break
+                
+            except llm_client.LLMError as api_error:
+                if api_error.status_code is None:
+                    # Прокси ответил, но ответ не по схеме даже после починки - повтор того же запроса не поможет
                     log_proxy_success(proxy_id)
-                    print(f"[DEBUG] Generated {len(batch_weeks)} weeks successfully on attempt {attempt+1}")
-                    break
-                    
+                    return {'success': False, 'error': f'Failed to parse Gemini response: {api_error}'}
+                failure = api_error
             except Exception as api_error:
-                print(f"[ERROR] Gemini API call failed on attempt {attempt+1}: {api_error}")
-                log_proxy_failure(proxy_id, str(api_error))
-                if attempt < max_retries - 1:
-                    print(f"[DEBUG] Retrying with new proxy...")
-                    # Получаем новый прокси для retry
-                    proxy_id, proxy_url = get_active_proxy_from_db()
-                    if not proxy_url:
-                        proxy_url = os.environ.get('PROXY_URL', '')
-                    proxy_handler = urllib.request.ProxyHandler({
-                        'http': f'http://{proxy_url}',
-                        'https': f'http://{proxy_url}'
-                    })
-                    opener = urllib.request.build_opener(proxy_handler)
-                    continue
-                else:
-                    return {'success': False, 'error': f'Gemini API error after {max_retries} attempts: {str(api_error)}'}
+                failure = api_error
+            
+            print(f"[ERROR] Gemini API call failed on attempt {attempt+1}: {failure}")
+            log_proxy_failure(proxy_id, failure)
+            if attempt < max_retries - 1:
+                print(f"[DEBUG] Retrying with new proxy...")
+                # Получаем новый прокси для retry
+                proxy_id, proxy_url = get_active_proxy_from_db(exclude={proxy_id})
+                if not proxy_url:
+                    proxy_url = os.environ.get('PROXY_URL', '')
+            else:
+                return {'success': False, 'error': f'Gemini API error after {max_retries} attempts: {str(failure)}'}
+        
+        batch_weeks = batch_data['plan']
+        if not batch_weeks:
+            return {'success': False, 'error': 'Gemini returned empty plan'}
+        print(f"[DEBUG] Generated {len(batch_weeks)} weeks successfully")
         
         plan_weeks = batch_weeks
         
@@ -2483,28 +2812,19 @@ Return ONLY valid JSON:
                     'generationConfig': {'temperature': 0.9, 'maxOutputTokens': 2000}
                 }
                 
-                replacement_req = urllib.request.Request(
-                    gemini_url,
-                    data=json.dumps(replacement_payload).encode('utf-8'),
-                    headers={'Content-Type': 'application/json'}
-                )
+                replacement_data = llm_client.generate_json('gemini-2.5-flash', replacement_payload, WORDS_RESPONSE, proxy_url, timeout=25, task='learning_plan_replacements')
                 
-                with opener.open(replacement_req, timeout=25) as resp:
-                    replacement_result = json.loads(resp.read().decode('utf-8'))
-                    replacement_text = replacement_result['candidates'][0]['content']['parts'][0]['text']
-                    replacement_data = safe_json_parse(replacement_text, {'words': []})
-                    
-                    print(f"[DEBUG] Got {len(replacement_data.get('words', []))} replacement words")
-                    
-                    # Заменяем дубликаты в plan_weeks
-                    replacement_idx = 0
-                    for week_data in plan_weeks:
-                        for category in ['vocabulary', 'phrases', 'expressions']:
-                            for i, item in enumerate(week_data.get(category, [])):
-                                if item['english'].strip().lower() in duplicates and replacement_idx < len(replacement_data['words']):
-                                    week_data[category][i] = replacement_data['words'][replacement_idx]
-                                    replacement_idx += 1
-                                    print(f"[DEBUG] Replaced duplicate '{item['english']}' with '{replacement_data['words'][replacement_idx-1]['english']}'")
+                print(f"[DEBUG] Got {len(replacement_data.get('words', []))} replacement words")
+                
+                # Заменяем дубликаты в plan_weeks
+                replacement_idx = 0
+                for week_data in plan_weeks:
+                    for category in ['vocabulary', 'phrases', 'expressions']:
+                        for i, item in enumerate(week_data.get(category, [])):
+                            if item['english'].strip().lower() in duplicates and replacement_idx < len(replacement_data['words']):
+                                week_data[category][i] = replacement_data['words'][replacement_idx]
+                                replacement_idx += 1
+                                print(f"[DEBUG] Replaced duplicate '{item['english']}' with '{replacement_data['words'][replacement_idx-1]['english']}'")
             except Exception as e:
                 print(f"[ERROR] Failed to get replacements: {e}")
         
@@ -2696,13 +3016,10 @@ Return ONLY valid JSON:
 
 def generate_adaptive_question(level: str, used_words: list) -> dict:
     """Генерирует вопрос для адаптивного теста через Gemini"""
-    api_key = os.environ['GEMINI_API_KEY']
     proxy_id, proxy_url = get_active_proxy_from_db()
     if not proxy_url:
         proxy_url = os.environ.get('PROXY_URL', '')
     
-    gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-    
     # Для высоких уровней (B2+) используем фразы и выражения
     import random
     item_types = ['word', 'phrase', 'expression'] if level in ['B2', 'C1', 'C2'] else ['word', 'phrase']
@@ -2710,9 +3027,8 @@ def generate_adaptive_question(level: str, used_words: list) -> dict:
     
     used_words_str = ', '.join(used_words) if used_words else 'none'
     
-    # Пытаемся сгенерировать уникальное слово (максимум 3 попытки)
-    for attempt in range(3):
-        prompt = f'''You are testing English level. Generate ONE {chosen_type} for level {level}.
+    # Несколько кандидатов за один вызов: уникальность проверяем локально, без повторного вызова
+    prompt = f'''You are testing English level. Generate 5 different candidates of type {chosen_type} for level {level}.
 
 CRITICAL: You MUST NOT use these words: {used_words_str}
 
@@ -2729,76 +3045,51 @@ Level guidelines:
 - C1+: advanced vocabulary
 - C2: native-level expressions
 
-Return ONLY short JSON:
-{{"english": "word_here", "type": "{chosen_type}", "level": "{level}"}}'''
-        
-        payload = {
-            'contents': [{'parts': [{'text': prompt}]}],
-            'generationConfig': {
-                'temperature': 0.9 + (attempt * 0.05),
-                'maxOutputTokens': 2000,
-                'topP': 0.95,
-                'topK': 50
-            }
+Return the candidates in the "candidates" list, most typical for the level first.'''
+    
+    payload = {
+        'contents': [{'parts': [{'text': prompt}]}],
+        'generationConfig': {
+            'temperature': 0.9,
+            'maxOutputTokens': 2000,
+            'topP': 0.95,
+            'topK': 50
         }
-        
-        proxy_handler = urllib.request.ProxyHandler({
-            'http': f'http://{proxy_url}',
-            'https': f'http://{proxy_url}'
-        })
-        opener = urllib.request.build_opener(proxy_handler)
-        
-        req = urllib.request.Request(
-            gemini_url,
-            data=json.dumps(payload).encode('utf-8'),
-            headers={'Content-Type': 'application/json'}
-        )
-        
+    }
+    
+    # Формат держит structured output (ADAPTIVE_QUESTION_RESPONSE): повтор нужен только при сбое прокси, не ради JSON
+    max_retries = 2
+    for attempt in range(max_retries):
         try:
-            with opener.open(req, timeout=30) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                text = result['candidates'][0]['content']['parts'][0]['text']
-                
-                print(f"[DEBUG] Gemini generated (level={level}, type={chosen_type}, attempt={attempt+1}): {text[:200]}")
-                
-                # Парсим БЕЗ fallback
-                item = safe_json_parse(text, None)
-                
-                if not item or 'english' not in item:
-                    print(f"[ERROR] Invalid JSON on attempt {attempt+1}: {text[:200]}")
-                    if attempt == 2:
-                        raise Exception(f"Gemini failed after 3 attempts")
-                    continue
-                
-                # Проверяем уникальность
-                if item['english'] not in used_words:
-                    print(f"[DEBUG] Accepted: {item['english']}")
-                    log_proxy_success(proxy_id)
-                    return item
-                else:
-                    print(f"[WARNING] Word '{item['english']}' already used")
-                    
-        except Exception as e:
-            error_msg = str(e)
-            print(f"[ERROR] Attempt {attempt+1} failed: {error_msg}")
-            
-            # Логируем ошибку прокси
-            log_proxy_failure(proxy_id, error_msg)
-            
-            # Если прокси упал - берем новый на следующей попытке
-            if attempt < 2:
-                print(f"[WARNING] Proxy failed, getting new one for attempt {attempt+2}")
-                proxy_id, proxy_url = get_active_proxy_from_db()
-                if not proxy_url:
-                    proxy_url = os.environ.get('PROXY_URL', '')
-                proxy_handler = urllib.request.ProxyHandler({
-                    'http': f'http://{proxy_url}',
-                    'https': f'http://{proxy_url}'
-                })
-                opener = urllib.request.build_opener(proxy_handler)
-                continue
-            else:
+            data = llm_client.generate_json('gemini-2.5-flash', payload, ADAPTIVE_QUESTION_RESPONSE, proxy_url, timeout=30, task='adaptive_question')
+            break
+        except llm_client.LLMError as e:
+            if e.status_code is None:
+                # Прокси ответил, но ответ не по схеме даже после починки - повтор того же запроса не поможет
+                log_proxy_success(proxy_id)
                 raise
+            failure = e
+        except Exception as e:
+            failure = e
+        
+        print(f"[ERROR] Attempt {attempt+1} failed: {failure}")
+        log_proxy_failure(proxy_id, failure)
+        if attempt == max_retries - 1:
+            raise failure
+        print(f"[WARNING] Proxy failed, getting new one for attempt {attempt+2}")
+        proxy_id, proxy_url = get_active_proxy_from_db(exclude={proxy_id})
+        if not proxy_url:
+            proxy_url = os.environ.get('PROXY_URL', '')
+    
+    log_proxy_success(proxy_id)
+    print(f"[DEBUG] Gemini generated (level={level}, type={chosen_type}): {data['candidates']}")
+    
+    used = {w.strip().lower() for w in used_words}
+    for candidate in data['candidates']:
+        if candidate.strip() and candidate.strip().lower() not in used:
+            print(f"[DEBUG] Accepted: {candidate}")
+            return {'english': candidate.strip(), 'type': chosen_type, 'level': level}
+        print(f"[WARNING] Word '{candidate}' already used")
     
     raise Exception(f"Failed to generate unique {chosen_type} for level {level}")
 
@@ -2856,6 +3147,24 @@ def generate_plan_async(chat_id: int, user_id: int):
         traceback.print_exc()
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Точка входа функции: обрабатывает апдейт, затем выполняет отложенную работу
+    (обновление сводки диалога) и одним запросом сбрасывает статистику прокси.
+    Все внешние вызовы берут таймауты из бюджета времени апдейта (deadline)
+    """
+    deadline.start(context)
+    llm_client.set_telemetry_user(update_user_id(event))
+    try:
+        return handle_update(event, context)
+    finally:
+        left = deadline.remaining()
+        history_window.run_deferred(10.0 if left is None else min(10.0, max(left - deadline.PLATFORM_MARGIN, 0.0)))
+        flush_proxy_stats()
+        flush_llm_telemetry()
+        llm_client.set_telemetry_user(None)
+        deadline.clear()
+
+def handle_update(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Обработчик Telegram webhook - бот отвечает прямо в чате
     """
@@ -2906,6 +3215,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         body_data = json.loads(body_str) if body_str else {}
         
         if body_data.get('action') == 'generate_plan_async':
+            # Фоновая генерация плана - отдельный вызов функции: бюджет хода к ней не относится,
+            # ограничивает только остаток времени от платформы (если она его сообщает)
+            deadline.start(context, budget=None)
             try:
                 user_id = body_data['user_id']
                 chat_id = body_data['chat_id']
@@ -3037,6 +3349,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             body_data = {}
         
         if body_data.get('action') == 'generate_plan_async':
+            # Фоновая генерация плана - отдельный вызов функции: бюджет хода к ней не относится,
+            # ограничивает только остаток времени от платформы (если она его сообщает)
+            deadline.start(context, budget=None)
             try:
                 user_id = body_data['user_id']
                 chat_id = body_data['chat_id']
@@ -4528,7 +4843,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     import traceback
                     traceback.print_exc()
                     if 'proxy_id' in locals() and proxy_id:
-                        log_proxy_failure(proxy_id, str(e))
+                        log_proxy_failure(proxy_id, e)
                 
                 return {
                     'statusCode': 200,
@@ -4575,11 +4890,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             try:
-                # Скачиваем аудио (БЕЗ текстовых уведомлений - только голос!)
-                audio_data = download_telegram_file(voice['file_id'])
-                
-                # Распознаем речь
-                recognized_text = speech_to_text(audio_data)
+                # Распознаем речь (аудио идет из Telegram прямо в Whisper, БЕЗ текстовых уведомлений - только голос!)
+                recognized_text = speech_to_text(voice['file_id'])
                 
                 if not recognized_text:
                     send_telegram_message(chat_id, '❌ Не удалось распознать речь. Попробуй еще раз!')
@@ -4594,7 +4906,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 preferred_topics = existing_user.get('preferred_topics', [])
                 
                 # Получаем историю диалога
-                history = get_conversation_history(telegram_id)
+                history, conversation_summary = get_conversation_context(telegram_id)
                 
                 # Получаем слова для практики
                 session_words = None
@@ -4609,7 +4921,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 learning_mode = existing_user.get('learning_mode', 'standard')
                 learning_goal = existing_user.get('learning_goal') if learning_mode in ['specific_topic', 'urgent_task'] else None
                 
-                response_text = call_gemini(recognized_text, history, session_words, language_level, preferred_topics, urgent_goals, learning_goal, learning_mode)
+                response_text = call_gemini(recognized_text, history, session_words, language_level, preferred_topics, urgent_goals, learning_goal, learning_mode, conversation_summary)
                 
                 # ⚠️ CRITICAL: В голосовом режиме отправляем исправления ТЕКСТОМ (отдельно)
                 # Ищем блок исправлений в ответе: 🔧 Fix / Correct:
@@ -4651,11 +4963,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 if correction_block:
                     send_telegram_message(chat_id, correction_block, parse_mode='HTML')
                 
-                # Генерируем голосовой ответ (БЕЗ исправлений - только чистый ответ)
-                voice_url = text_to_speech(clean_response)
-                
-                # Отправляем голосовой ответ
-                send_telegram_voice(chat_id, voice_url)
+                # Генерируем голосовой ответ (БЕЗ исправлений - только чистый ответ).
+                # Если на озвучку не хватает времени или она упала - отвечаем текстом
+                send_voice_or_text(chat_id, clean_response)
                 
                 # Сохраняем в историю (полный ответ с исправлениями для контекста)
                 save_message(telegram_id, 'user', recognized_text)
@@ -4672,7 +4982,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 print(f"[ERROR] Voice processing failed: {e}")
                 import traceback
                 traceback.print_exc()
-                send_telegram_message(chat_id, '❌ Ошибка обработки голосового. Проверь что говоришь на английском!')
+                if isinstance(e, TimeoutError) or not deadline.has(0):
+                    send_telegram_message(chat_id, DEADLINE_REPLY, parse_mode=None)
+                else:
+                    send_telegram_message(chat_id, '❌ Ошибка обработки голосового. Проверь что говоришь на английском!')
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json'},
@@ -5052,18 +5365,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 send_telegram_message(chat_id, '⏳ Проверяю...', parse_mode=None)
                 
                 # Инициализируем переменные для использования во всем блоке
-                api_key = os.environ.get('GEMINI_API_KEY', '')
                 proxy_id = None
                 proxy_url = None
-                gemini_url = ''
                 
                 try:
                     proxy_id, proxy_url = get_active_proxy_from_db()
                     if not proxy_url:
                         proxy_url = os.environ.get('PROXY_URL', '')
                     
-                    gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-                    
                     # Проверяем текущий ответ (КОРОТКИЙ промпт)
                     check_prompt = f'''Check translation:
 English: {current_item["english"]}
@@ -5079,25 +5388,11 @@ IMPORTANT: "expected" must be RUSSIAN!'''
                         'generationConfig': {'temperature': 0.3, 'maxOutputTokens': 2000}
                     }
                     
-                    proxy_handler = urllib.request.ProxyHandler({
-                        'http': f'http://{proxy_url}',
-                        'https': f'http://{proxy_url}'
-                    })
-                    opener = urllib.request.build_opener(proxy_handler)
+                    check_text = llm_client.generate_text('gemini-2.5-flash', payload, proxy_url, timeout=30, task='level_test_check')
                     
-                    req = urllib.request.Request(
-                        gemini_url,
-                        data=json.dumps(payload).encode('utf-8'),
-                        headers={'Content-Type': 'application/json'}
-                    )
+                    print(f"[DEBUG] Gemini check response: {check_text[:300]}")
                     
-                    with opener.open(req, timeout=30) as response:
-                        check_result = json.loads(response.read().decode('utf-8'))
-                        check_text = check_result['candidates'][0]['content']['parts'][0]['text']
-                        
-                        print(f"[DEBUG] Gemini check response: {check_text[:300]}")
-                        
-                        check_data = safe_json_parse(check_text, {'correct': False, 'expected': '???'})
+                    check_data = safe_json_parse(check_text, {'correct': False, 'expected': '???'})
                     
                     is_correct = check_data.get('correct', False)
                     expected = check_data.get('expected', '???')
@@ -5123,19 +5418,11 @@ Example: {{"russian": "путешествие"}}'''
                             'generationConfig': {'temperature': 0.2, 'maxOutputTokens': 100}
                         }
                         
-                        translate_req = urllib.request.Request(
-                            gemini_url,
-                            data=json.dumps(translate_payload).encode('utf-8'),
-                            headers={'Content-Type': 'application/json'}
-                        )
-                        
                         try:
-                            with opener.open(translate_req, timeout=15) as translate_resp:
-                                translate_result = json.loads(translate_resp.read().decode('utf-8'))
-                                translate_text = translate_result['candidates'][0]['content']['parts'][0]['text']
-                                translate_data = safe_json_parse(translate_text, {'russian': expected})
-                                expected = translate_data.get('russian', expected)
-                                print(f"[DEBUG] Got Russian translation: {expected}")
+                            translate_text = llm_client.generate_text('gemini-2.5-flash', translate_payload, proxy_url, timeout=15, task='level_test_translate')
+                            translate_data = safe_json_parse(translate_text, {'russian': expected})
+                            expected = translate_data.get('russian', expected)
+                            print(f"[DEBUG] Got Russian translation: {expected}")
                         except Exception as e:
                             print(f"[WARNING] Failed to get Russian translation: {e}")
                             expected = '(перевод не определен)'
@@ -5193,18 +5480,14 @@ No markdown, no explanations, just JSON.'''
                             'generationConfig': {'temperature': 0.3, 'maxOutputTokens': 300}
                         }
                         
-                        req = urllib.request.Request(
-                            gemini_url,
-                            data=json.dumps(payload).encode('utf-8'),
-                            headers={'Content-Type': 'application/json'}
-                        )
-                        
-                        with opener.open(req, timeout=30) as response:
-                            final_result = json.loads(response.read().decode('utf-8'))
-                            final_text = final_result['candidates'][0]['content']['parts'][0]['text']
-                            print(f"[DEBUG] Gemini level analysis response: {final_text}")
-                            final_data = safe_json_parse(final_text, {'level': 'A2', 'reasoning': 'Базовый уровень'})
-                            print(f"[DEBUG] Parsed level data: {final_data}")
+                        try:
+                            final_data = llm_client.generate_json('gemini-2.5-flash', payload, LEVEL_TEST_RESPONSE, proxy_url, timeout=30, task='level_test_analysis')
+                        except llm_client.LLMError as e:
+                            if e.status_code is not None:
+                                raise
+                            print(f"[WARNING] Level analysis response rejected: {e}")
+                            final_data = {'level': 'A2', 'reasoning': 'Базовый уровень'}
+                        print(f"[DEBUG] Parsed level data: {final_data}")
                         
                         actual_level = final_data.get('level', 'A1')
                         reasoning = final_data.get('reasoning', '')
@@ -5404,13 +5687,10 @@ No markdown, no explanations, just JSON.'''
                     send_telegram_message(chat_id, '⏳ Проверяю переводы...', parse_mode=None)
                     
                     try:
-                        api_key = os.environ['GEMINI_API_KEY']
                         proxy_id, proxy_url = get_active_proxy_from_db()
                         if not proxy_url:
                             proxy_url = os.environ.get('PROXY_URL', '')
                         
-                        gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-                        
                         # Формируем список слов и фраз для проверки
                         items_str = ''
                         for i, item in enumerate(test_phrases, 1):
@@ -5462,23 +5742,7 @@ No markdown, no explanations, just JSON.'''
                             'generationConfig': {'temperature': 0.3, 'maxOutputTokens': 500}
                         }
                         
-                        proxy_handler = urllib.request.ProxyHandler({
-                            'http': f'http://{proxy_url}',
-                            'https': f'http://{proxy_url}'
-                        })
-                        opener = urllib.request.build_opener(proxy_handler)
-                        
-                        req = urllib.request.Request(
-                            gemini_url,
-                            data=json.dumps(payload).encode('utf-8'),
-                            headers={'Content-Type': 'application/json'}
-                        )
-                        
-                        with opener.open(req, timeout=30) as response:
-                            gemini_result = json.loads(response.read().decode('utf-8'))
-                            result_text = gemini_result['candidates'][0]['content']['parts'][0]['text']
-                            result_text = result_text.replace('```json', '').replace('```', '').strip()
-                            result = json.loads(result_text)
+                        result = llm_client.generate_json('gemini-2.5-flash', payload, LEVEL_CHECK_RESPONSE, proxy_url, timeout=30, task='level_check')
                         
                         actual_level = result.get('actual_level', claimed_level)
                         is_correct = result.get('is_correct', True)
@@ -5743,13 +6007,10 @@ No markdown, no explanations, just JSON.'''
                 
                 try:
                     # Генерируем цели через Gemini
-                    api_key = os.environ['GEMINI_API_KEY']
                     proxy_id, proxy_url = get_active_proxy_from_db()
                     if not proxy_url:
                         proxy_url = os.environ.get('PROXY_URL', '')
                     
-                    gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-                    
                     prompt = f'''Задача: Сгенерируй 5-7 конкретных целей для срочной задачи студента.
 
 Студент написал: "{text}"
@@ -5782,33 +6043,14 @@ No markdown, no explanations, just JSON.'''
                         }
                     }
                     
-                    proxy_handler = urllib.request.ProxyHandler({
-                        'http': f'http://{proxy_url}',
-                        'https': f'http://{proxy_url}'
-                    })
-                    opener = urllib.request.build_opener(proxy_handler)
-                    
-                    req = urllib.request.Request(
-                        gemini_url,
-                        data=json.dumps(payload).encode('utf-8'),
-                        headers={'Content-Type': 'application/json'}
-                    )
+                    goals_data = llm_client.generate_json('gemini-2.5-flash', payload, URGENT_GOALS_RESPONSE, proxy_url, timeout=30, task='urgent_goals')
                     
-                    with opener.open(req, timeout=30) as response:
-                        gemini_result = json.loads(response.read().decode('utf-8'))
-                        goals_text = gemini_result['candidates'][0]['content']['parts'][0]['text']
-                        
-                        print(f"[DEBUG] Raw Gemini response: {goals_text}")
-                        
-                        goals_data = safe_json_parse(goals_text, {'goals': []})
-                        
-                        print(f"[DEBUG] Parsed goals_data: {goals_data}")
+                    print(f"[DEBUG] Parsed goals_data: {goals_data}")
                     
-                    goals_list = goals_data.get('goals', [])
+                    goals_list = [goal for goal in goals_data['goals'] if goal.strip()]
                     
-                    if not goals_list or len(goals_list) == 0:
-                        print(f"[ERROR] Empty goals_list after parsing! goals_data: {goals_data}")
-                        raise Exception(f"Gemini returned empty goals. Raw response: {goals_text[:200]}")
+                    if not goals_list:
+                        raise Exception(f"Gemini returned empty goals: {goals_data}")
                     
                     log_proxy_success(proxy_id)
                     
@@ -5901,7 +6143,7 @@ No markdown, no explanations, just JSON.'''
                     print(f"[ERROR] Failed to generate urgent goals: {e}")
                     import traceback
                     traceback.print_exc()
-                    log_proxy_failure(proxy_id, str(e))
+                    log_proxy_failure(proxy_id, e)
                     send_telegram_message(chat_id, '❌ Не удалось проанализировать задачу. Попробуй еще раз или напиши /start', parse_mode=None)
                 
                 return {
@@ -5918,13 +6160,10 @@ No markdown, no explanations, just JSON.'''
                 
                 try:
                     # Парсим интересы через Gemini
-                    api_key = os.environ['GEMINI_API_KEY']
                     proxy_id, proxy_url = get_active_proxy_from_db()
                     if not proxy_url:
                         proxy_url = os.environ.get('PROXY_URL', '')
                     
-                    gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-                    
                     prompt = f'''Студент описал свои интересы: "{text}"
 
 Извлеки из текста темы в формате JSON массива объектов.
@@ -5949,24 +6188,8 @@ No markdown, no explanations, just JSON.'''
                         'generationConfig': {'temperature': 0.3, 'maxOutputTokens': 500}
                     }
                     
-                    proxy_handler = urllib.request.ProxyHandler({
-                        'http': f'http://{proxy_url}',
-                        'https': f'http://{proxy_url}'
-                    })
-                    opener = urllib.request.build_opener(proxy_handler)
-                    
-                    req = urllib.request.Request(
-                        gemini_url,
-                        data=json.dumps(payload).encode('utf-8'),
-                        headers={'Content-Type': 'application/json'}
-                    )
-                    
-                    with opener.open(req, timeout=30) as response:
-                        gemini_result = json.loads(response.read().decode('utf-8'))
-                        topics_text = gemini_result['candidates'][0]['content']['parts'][0]['text']
-                        topics_text = topics_text.replace('```json', '').replace('```', '').strip()
-                        topics_data = json.loads(topics_text)
-                        topics_list = topics_data.get('topics', [])
+                    topics_data = llm_client.generate_json('gemini-2.5-flash', payload, TOPICS_RESPONSE, proxy_url, timeout=30, task='topic_goals')
+                    topics_list = topics_data['topics']
                     
                     # Сохраняем темы в БД
                     conn = get_db_connection()
@@ -6094,111 +6317,53 @@ No markdown, no explanations, just JSON.'''
                     if conversation_mode == 'sentence':
                         # Проверяем предложение через AI
                         try:
-                            api_key = os.environ['GEMINI_API_KEY']
-                            proxy_id, proxy_url = get_active_proxy_from_db()
-                            if not proxy_url:
-                                proxy_id = None
-                                proxy_url = os.environ.get('PROXY_URL', '')
-                            
-                            check_prompt = f'''Check if this English sentence is grammatically correct and uses the word "{correct_answer}" properly.
-
-Student's sentence: "{user_answer}"
-Required word: {correct_answer}
-Student level: {language_level}
-
-⚠️ CRITICAL - Check for these errors:
-1. Subject-verb agreement (I am/he is, I have/he has)
-2. Verb tenses (present/past/future)
-3. Articles (a/an/the)
-4. Word order
-5. Does sentence contain the required word?
-
-Respond ONLY with this JSON:
-{{
-  "is_correct": true/false,
-  "has_word": true/false,
-  "grammar_ok": true/false,
-  "feedback": "short explanation in Russian about the mistake",
-  "corrected": "corrected sentence if needed (or empty string if correct)"
-}}
-
-Rules:
-- is_correct = true ONLY if: has_word=true AND grammar_ok=true AND no major errors
-- has_word = true if sentence contains the required word "{correct_answer}"
-- grammar_ok = true if there are NO grammar mistakes (even small ones!)
-- feedback should explain the error clearly in Russian
-- corrected should show the fixed sentence
-
-Example:
-Input: "I has a voice"
-Output: {{"is_correct": false, "has_word": true, "grammar_ok": false, "feedback": "Ошибка: 'I has' неправильно. С местоимением 'I' используется 'have', а не 'has'", "corrected": "I have a voice"}}'''
-                            
-                            gemini_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
-                            payload = {
-                                'contents': [{'parts': [{'text': check_prompt}]}],
-                                'generationConfig': {'temperature': 0.3, 'maxOutputTokens': 2000}
-                            }
-                            
-                            proxy_handler = urllib.request.ProxyHandler({
-                                'http': f'http://{proxy_url}',
-                                'https': f'http://{proxy_url}'
-                            })
-                            opener = urllib.request.build_opener(proxy_handler)
+                            # ⚡ PERFORMANCE: явно неподходящие ответы (нет слова, не английский, слишком коротко)
+                            # отклоняются локально, повторные - из запомненных вердиктов; в Gemini идут только правдоподобные
+                            check_data = sentence_pregrader.pregrade(user_answer, correct_answer, language_level)
+                            if check_data is None:
+                                check_data = check_sentence_with_gemini(user_answer, correct_answer, language_level)
+                            else:
+                                print(f'[DEBUG] Sentence pre-graded without Gemini: {check_data}')
                             
-                            req = urllib.request.Request(
-                                gemini_url,
-                                data=json.dumps(payload).encode('utf-8'),
-                                headers={'Content-Type': 'application/json'}
-                            )
+                            is_correct = check_data.get('is_correct', False)
+                            feedback = check_data.get('feedback', '')
+                            corrected = check_data.get('corrected', '')
                             
-                            with opener.open(req, timeout=15) as response:
-                                result = json.loads(response.read().decode('utf-8'))
-                                check_text = result['candidates'][0]['content']['parts'][0]['text']
-                                print(f'[DEBUG] Gemini raw response for sentence check: {check_text}')
-                                
-                                check_data = safe_json_parse(check_text, {'is_correct': False, 'feedback': 'Ошибка проверки', 'corrected': '', 'has_word': False, 'grammar_ok': False})
-                                print(f'[DEBUG] Parsed check_data: {check_data}')
+                            if is_correct:
+                                send_telegram_message(chat_id, f'✅ Отлично! {feedback} 🎉', get_reply_keyboard())
                                 
-                                log_proxy_success(proxy_id)
+                                # Переходим к следующему слову
+                                if current_word_id:
+                                    update_word_progress_api(telegram_id, current_word_id, True)
                                 
-                                is_correct = check_data.get('is_correct', False)
-                                feedback = check_data.get('feedback', '')
-                                corrected = check_data.get('corrected', '')
+                                clear_exercise_state(telegram_id)
                                 
-                                if is_correct:
-                                    send_telegram_message(chat_id, f'✅ Отлично! {feedback} 🎉', get_reply_keyboard())
-                                    
-                                    # Переходим к следующему слову
-                                    if current_word_id:
-                                        update_word_progress_api(telegram_id, current_word_id, True)
-                                    
-                                    clear_exercise_state(telegram_id)
-                                    
-                                    word = get_random_word(telegram_id, language_level)
-                                    if word:
-                                        exercise_text = generate_sentence_exercise(word, language_level)
-                                        update_exercise_state(telegram_id, word['id'], word['english'])
-                                        send_telegram_message(chat_id, exercise_text, get_reply_keyboard())
-                                    else:
-                                        send_telegram_message(chat_id, '✅ Упражнения закончились! Используй /modes для выбора другого режима.', get_reply_keyboard())
-                                        update_conversation_mode(telegram_id, 'dialog')
+                                word = get_random_word(telegram_id, language_level)
+                                if word:
+                                    exercise_text = generate_sentence_exercise(word, language_level)
+                                    update_exercise_state(telegram_id, word['id'], word['english'])
+                                    send_telegram_message(chat_id, exercise_text, get_reply_keyboard())
                                 else:
-                                    # ⚠️ КРИТИЧНО: При ошибке показываем исправление и просим ПОВТОРИТЬ ТО ЖЕ СЛОВО
-                                    response_text = '🔧 Fix / Correct:\n'
-                                    response_text += f'❌ {user_answer}\n'
+                                    send_telegram_message(chat_id, '✅ Упражнения закончились! Используй /modes для выбора другого режима.', get_reply_keyboard())
+                                    update_conversation_mode(telegram_id, 'dialog')
+                            else:
+                                # ⚠️ КРИТИЧНО: При ошибке показываем исправление и просим ПОВТОРИТЬ ТО ЖЕ СЛОВО
+                                response_text = '🔧 Fix / Correct:\n'
+                                response_text += f'❌ {user_answer}\n'
+                                if corrected:
                                     response_text += f'✅ {corrected}\n'
-                                    response_text += f'🇷🇺 {feedback}\n\n'
-                                    response_text += f'Попробуй еще раз со словом: {correct_answer}'
-                                    
-                                    send_telegram_message(chat_id, response_text, get_reply_keyboard(), parse_mode=None)
-                                    
-                                    # НЕ обновляем прогресс и НЕ меняем слово - пусть повторит!
-                                    # current_exercise_word_id и current_exercise_answer остаются те же
-                                    return {
-                                        'statusCode': 200,
-                                        'headers': {'Content-Type': 'application/json'},
-                                        'body': json.dumps({'status': 'retry_same_word'})
-                                    }
+                                response_text += f'🇷🇺 {feedback}\n\n'
+                                response_text += f'Попробуй еще раз со словом: {correct_answer}'
+                                
+                                send_telegram_message(chat_id, response_text, get_reply_keyboard(), parse_mode=None)
+                                
+                                # НЕ обновляем прогресс и НЕ меняем слово - пусть повторит!
+                                # current_exercise_word_id и current_exercise_answer остаются те же
+                                return {
+                                    'statusCode': 200,
+                                    'headers': {'Content-Type': 'application/json'},
+                                    'body': json.dumps({'status': 'retry_same_word'})
+                                }
                         
                         except Exception as e:
                             print(f'[ERROR] Failed to check sentence: {e}')
@@ -6326,7 +6491,7 @@ Output: {{"is_correct": false, "has_word": true, "grammar_ok": false, "feedback"
                 
             else:
                 # Режим диалога или голосового - обрабатываем через Gemini
-                history = get_conversation_history(telegram_id)
+                history, conversation_summary = get_conversation_context(telegram_id)
                 
                 # Если ученик - загружаем слова для практики
                 session_words = None
@@ -6465,6 +6630,8 @@ Output: {{"is_correct": false, "has_word": true, "grammar_ok": false, "feedback"
                 save_message(telegram_id, 'user', text)
                 
                 # Получаем ответ AI с учетом слов, уровня, тем и срочных целей
+                streamed_message_id = None
+                reply_truncated = False
                 try:
                     print(f"[DEBUG] Calling Gemini with message: {text}")
                     print(f"[DEBUG] session_words={session_words}, language_level={language_level}")
@@ -6479,7 +6646,14 @@ Output: {{"is_correct": false, "has_word": true, "grammar_ok": false, "feedback"
                         learning_goal = None
                     
                     print(f"[DEBUG] learning_mode={learning_mode}, learning_goal={learning_goal}")
-                    ai_response = call_gemini(text, history, session_words, language_level, preferred_topics, urgent_goals, learning_goal, learning_mode)
+                    if STREAM_DIALOG_REPLIES and conversation_mode != 'voice':
+                        # Текстовый диалог: первое предложение уходит в чат сразу, дальше сообщение дописывается
+                        ai_response, streamed_message_id, reply_truncated = stream_gemini_reply(
+                            chat_id, text, history, session_words, language_level, preferred_topics,
+                            urgent_goals, learning_goal, learning_mode, conversation_summary, reply_markup=get_reply_keyboard()
+                        )
+                    else:
+                        ai_response = call_gemini(text, history, session_words, language_level, preferred_topics, urgent_goals, learning_goal, learning_mode, conversation_summary)
                     print(f"[DEBUG] Gemini response: {ai_response[:100]}...")
                     
                     # Логируем успешный ответ Gemini
@@ -6520,22 +6694,26 @@ Output: {{"is_correct": false, "has_word": true, "grammar_ok": false, "feedback"
                     ai_response = "Sorry, I'm having technical difficulties right now. Please try again in a moment! 🔧"
                 
                 # Проверяем маркер освоения слова
-                mastered_word_marker = '✅ WORD_MASTERED:'
-                if mastered_word_marker in ai_response:
-                    # Извлекаем слово
-                    marker_pos = ai_response.find(mastered_word_marker)
-                    word_text = ai_response[marker_pos + len(mastered_word_marker):].strip().split()[0]
+                if WORD_MASTERED_MARKER in ai_response:
+                    # Извлекаем слово (или фразу - сравниваем с началом текста после маркера)
+                    marker_pos = ai_response.find(WORD_MASTERED_MARKER)
+                    word_text = ' '.join(sentence_pregrader.tokenize(ai_response[marker_pos + len(WORD_MASTERED_MARKER):])) + ' '
                     
-                    # Находим word_id
+                    # Находим word_id (самое длинное совпадение: "figure out" важнее "figure")
                     if session_words:
-                        mastered_word = next((w for w in session_words if w['english'].lower() == word_text.lower()), None)
+                        candidates = [w for w in session_words if word_text.startswith(' '.join(sentence_pregrader.tokenize(w['english'])) + ' ')]
+                        mastered_word = max(candidates, key=lambda w: len(w['english']), default=None)
                         if mastered_word:
                             update_word_progress_api(telegram_id, mastered_word['id'], is_correct=True)
-                            print(f"[SUCCESS] Word '{word_text}' marked as mastered!")
+                            print(f"[SUCCESS] Word '{mastered_word['english']}' marked as mastered!")
                     
                     # Убираем маркер из ответа пользователю
                     ai_response = ai_response[:marker_pos].strip()
                 
+                if reply_truncated:
+                    # Неполный ответ не выдаем за целый - ни в чате, ни в истории диалога
+                    ai_response = f"{ai_response.strip()}… {STREAM_TRUNCATED_NOTE}" if ai_response.strip() else STREAM_TRUNCATED_NOTE
+                
                 # Обновляем прогресс использованных слов учеником
                 for word_id in used_word_ids:
                     update_word_progress_api(telegram_id, word_id, True)
@@ -6554,13 +6732,18 @@ Output: {{"is_correct": false, "has_word": true, "grammar_ok": false, "feedback"
                 
                 # В режиме 'voice' отправляем ТОЛЬКО голосовое сообщение (БЕЗ текста)
                 if conversation_mode == 'voice':
+                    send_voice_or_text(chat_id, ai_response, get_reply_keyboard())
+                elif streamed_message_id:
+                    # Ответ уже в чате - финальная правка с полным текстом и HTML разметкой
                     try:
-                        voice_url = text_to_speech(ai_response)
-                        send_telegram_voice(chat_id, voice_url)
+                        edit_telegram_message(chat_id, streamed_message_id, ai_response)
                     except Exception as e:
-                        print(f"[ERROR] Failed to generate voice response: {e}")
-                        # Fallback - отправляем текст если голос не сгенерировался
-                        send_telegram_message(chat_id, ai_response, get_reply_keyboard())
+                        print(f"[WARNING] Final HTML edit failed, retrying as plain text: {e}")
+                        try:
+                            edit_telegram_message(chat_id, streamed_message_id, ai_response, parse_mode=None)
+                        except Exception as plain_error:
+                            # Например "message is not modified" - текст уже совпадает
+                            print(f"[WARNING] Final edit skipped: {plain_error}")
                 else:
                     # В обычном режиме диалога отправляем текст
                     send_telegram_message(chat_id, ai_response, get_reply_keyboard())
@@ -6589,7 +6772,7 @@ Output: {{"is_correct": false, "has_word": true, "grammar_ok": false, "feedback"
                             method='POST'
                         )
                         
-                        with urllib.request.urlopen(record_req) as resp:
+                        with urllib.request.urlopen(record_req, timeout=deadline.timeout(WEBAPP_API_TIMEOUT)) as resp:
                             result = json.loads(resp.read().decode('utf-8'))
                             # Если разблокировали достижение - отправляем уведомление
                             if result.get('unlocked_achievements'):
@@ -6610,6 +6793,16 @@ Output: {{"is_correct": false, "has_word": true, "grammar_ok": false, "feedback"
         print(f"[ERROR] Exception in handler: {e}")
         import traceback
         traceback.print_exc()
+        if isinstance(e, deadline.DeadlineExceeded):
+            # Не успели за бюджет апдейта - студент получает короткий ответ, а Telegram
+            # не присылает апдейт повторно (200 вместо 500)
+            notify_deadline_exceeded(event)
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'ok': True}),
+                'isBase64Encoded': False
+            }
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json'},
@@ -0,0 +1,180 @@
+"""Терпимый разбор JSON из ответов модели за один проход (оборванные ответы дочиняются)"""
+import re
+import json
+from typing import Any, List, Tuple
+
+_WS_RE = re.compile(r'\s*')
+_STRING_BODY_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?')
+_BARE_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_$-]*')
+_BAD_ESCAPE_RE = re.compile(r'\\(?!["\\/bfnrtu])|\\u(?![0-9a-fA-F]{4})')
+_PARTIAL_ESCAPE_RE = re.compile(r'\\(?:u[0-9a-fA-F]{0,3})?$')
+
+_LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+
+def _decode_string(raw: str, repairs: List[str]) -> str:
+    """Содержимое строки между кавычками -> str (escape-последовательности раскрываются)"""
+    if '\\' not in raw:
+        return raw
+    try:
+        return json.loads(f'"{raw}"', strict=False)
+    except ValueError:
+        repairs.append('dropped invalid escape')
+        return json.loads(f'"{_BAD_ESCAPE_RE.sub("", raw)}"', strict=False)
+
+def _read_string(text: str, pos: int, repairs: List[str]) -> Tuple[str, int, bool]:
+    """Строка с кавычки в позиции pos: (значение, позиция после строки, закрыта ли строка)"""
+    end = _STRING_BODY_RE.match(text, pos + 1).end()
+    if end < len(text):
+        return _decode_string(text[pos + 1:end], repairs), end + 1, True
+    raw = _PARTIAL_ESCAPE_RE.sub('', text[pos + 1:end])
+    return _decode_string(raw, repairs), end, False
+
+def parse(text: str) -> Tuple[Any, List[str]]:
+    """
+    Разбирает объект или массив JSON из ответа модели.
+    Возвращает (данные, починки); бросает ValueError, если JSON в тексте нет
+    """
+    stripped = text.strip()
+    try:
+        return json.loads(stripped), []
+    except ValueError:
+        pass
+
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if not starts:
+        raise ValueError('no JSON object in text')
+    pos = min(starts)
+
+    repairs = []
+    if text[:pos].strip():
+        repairs.append('skipped text before JSON')
+
+    root = {} if text[pos] == '{' else []
+    # Кадр стека: [контейнер, ключ, ждущий значения (только для объекта), была ли запятая последней]
+    stack = [[root, None, False]]
+    pos += 1
+    n = len(text)
+
+    while stack:
+        pos = _WS_RE.match(text, pos).end()
+        if pos >= n:
+            break
+        ch = text[pos]
+        frame = stack[-1]
+        container = frame[0]
+        is_object = isinstance(container, dict)
+
+        if ch == '}' or ch == ']':
+            if ch != ('}' if is_object else ']'):
+                # Скобка закрывает внешний контейнер - закрываем все вложенные до него
+                closes = dict if ch == '}' else list
+                depth = next((i for i in range(len(stack) - 1, -1, -1) if isinstance(stack[i][0], closes)), None)
+                repairs.append(f'mismatched {ch!r}')
+                if depth is None:
+                    pos += 1
+                    continue
+                del stack[depth + 1:]
+                frame = stack[-1]
+            if frame[1] is not None:
+                repairs.append(f'dropped key without value {frame[1]!r}')
+            if frame[2]:
+                repairs.append('removed trailing comma')
+            stack.pop()
+            pos += 1
+            continue
+
+        if ch == ',':
+            if frame[1] is not None:
+                repairs.append(f'dropped key without value {frame[1]!r}')
+                frame[1] = None
+            frame[2] = True
+            pos += 1
+            continue
+
+        if is_object and frame[1] is None:
+            # Ждем ключ
+            if ch == '"':
+                key, pos, closed = _read_string(text, pos, repairs)
+                if not closed:
+                    repairs.append('dropped truncated key')
+                    break
+            else:
+                match = _BARE_RE.match(text, pos)
+                if not match:
+                    repairs.append(f'skipped unexpected {ch!r}')
+                    pos += 1
+                    continue
+                key, pos = match.group(), match.end()
+                repairs.append(f'quoted bare key {key!r}')
+
+            if container and not frame[2]:
+                repairs.append('inserted missing comma')
+            pos = _WS_RE.match(text, pos).end()
+            if pos < n and text[pos] == ':':
+                pos += 1
+            elif pos < n:
+                repairs.append(f'inserted missing colon after {key!r}')
+            frame[1] = key
+            frame[2] = False
+            continue
+
+        # Ждем значение
+        if not is_object and container and not frame[2]:
+            repairs.append('inserted missing comma')
+
+        complete = True
+        if ch == '{' or ch == '[':
+            value = {} if ch == '{' else []
+            pos += 1
+        elif ch == '"':
+            value, pos, complete = _read_string(text, pos, repairs)
+            if not complete:
+                repairs.append('closed truncated string')
+        else:
+            match = _NUMBER_RE.match(text, pos)
+            if match:
+                number = match.group()
+                value = int(number) if number.lstrip('-').isdigit() else float(number)
+                pos = match.end()
+            else:
+                match = _BARE_RE.match(text, pos)
+                if not match:
+                    repairs.append(f'skipped unexpected {ch!r}')
+                    pos += 1
+                    continue
+                word, pos = match.group(), match.end()
+                if word in _LITERALS:
+                    value = _LITERALS[word]
+                    if word not in ('true', 'false', 'null'):
+                        repairs.append(f'converted literal {word}')
+                elif pos >= n:
+                    repairs.append(f'dropped truncated literal {word!r}')
+                    break
+                else:
+                    value = word
+                    repairs.append(f'quoted bare value {word!r}')
+
+        if is_object:
+            container[frame[1]] = value
+            frame[1] = None
+        else:
+            container.append(value)
+        frame[2] = False
+
+        if not complete:
+            break
+        if isinstance(value, (dict, list)):
+            stack.append([value, None, False])
+
+    if stack:
+        if stack[-1][1] is not None:
+            repairs.append(f'dropped key without value {stack[-1][1]!r}')
+        repairs.append(f'closed {len(stack)} unterminated container(s)')
+    elif text[pos:].strip():
+        repairs.append('ignored text after JSON')
+    return root, repairs
+
+def loads(text: str) -> Any:
+    """Только данные (см. parse). Бросает ValueError, если JSON в тексте нет"""
+    return parse(text)[0]
@@ -0,0 +1,937 @@
+"""Общий клиент Gemini и OpenAI через прокси: сессии, кэш контекста, маршруты задач, хеджирование и телеметрия"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, List, Tuple, Callable, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import json_repair
+
+GEMINI_API_ROOT = os.environ.get('GEMINI_API_ROOT', 'https://generativelanguage.googleapis.com/v1beta')
+GEMINI_BASE_URL = f'{GEMINI_API_ROOT}/models'
+
+# Пул соединений на один прокси
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 8
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+# Тайминги вызовов: последний вызов (в рамках потока) + агрегаты по задачам
+_local = threading.local()
+_call_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+# Маршруты задач (llm_task_routes): перечитываются раз в ROUTES_TTL, как промпты из gemini_prompts
+ROUTES_TTL = 300
+_routes: Dict[str, Dict[str, Any]] = {}
+_routes_loaded_at = 0.0
+_routes_loader: Optional[Callable[[], List[Dict[str, Any]]]] = None
+_routes_lock = threading.Lock()
+_timeout_limiter: Optional[Callable[[float], float]] = None
+_call_observer: Optional[Callable[[str, str, bool, float, str], None]] = None
+
+# Хеджирование запросов
+HEDGE_ENABLED = os.environ.get('LLM_HEDGE_ENABLED', '1') == '1'
+HEDGE_MAX_RATE = 0.1          # Не больше 10% вызовов получают второй запрос
+HEDGE_RATE_WINDOW = 100       # Окно вызовов для подсчета доли хеджей
+HEDGE_PERCENTILE = 0.9        # Порог хеджа - p90 латентности задачи
+HEDGE_MIN_SAMPLES = 20        # Пока замеров меньше - используем HEDGE_DEFAULT_DELAY
+HEDGE_DEFAULT_DELAY = 4.0     # секунды
+HEDGE_MIN_DELAY = 1.0         # секунды
+
+_hedge_executor = None
+_hedge_lock = threading.Lock()
+_task_latencies: Dict[str, deque] = {}
+_hedge_window: deque = deque(maxlen=HEDGE_RATE_WINDOW)
+_hedge_stats = {'calls': 0, 'hedged': 0, 'hedge_wins': 0, 'primary_wins': 0, 'skipped_by_cap': 0, 'failovers': 0}
+
+# Кэш контекста Gemini (cachedContents) для стабильной части системного промпта
+CONTEXT_CACHE_ENABLED = os.environ.get('GEMINI_CONTEXT_CACHE', '1') == '1'
+CONTEXT_CACHE_TTL = 3600            # секунды жизни кэша на стороне Gemini
+CONTEXT_CACHE_REFRESH_MARGIN = 120  # пересоздаем кэш заранее, чтобы не отправить запрос на истекший
+CONTEXT_CACHE_MIN_CHARS = 4400      # ~1100 токенов: меньше 1024 токенов Gemini кэшировать не дает
+CONTEXT_CACHE_RETRY_AFTER = 300     # после ошибки создания кэша не пробуем снова N секунд
+
+_context_caches: Dict[Tuple[str, str], Tuple[str, float]] = {}   # (model, текст промпта) -> (имя кэша, истекает)
+_context_cache_sources: Dict[str, str] = {}                       # имя кэша -> текст промпта (для fallback)
+_context_cache_failed: Dict[Tuple[str, str], float] = {}
+_context_cache_lock = threading.Lock()
+_context_cache_stats = {'hits': 0, 'shared_hits': 0, 'created': 0, 'create_failed': 0, 'stale_fallbacks': 0}
+_context_cache_load: Optional[Callable[[str], Optional[Tuple[str, float]]]] = None
+_context_cache_save: Optional[Callable[[str, str, str, float], None]] = None
+
+# Structured output: python-типы для типов responseSchema (подмножество OpenAPI, как его принимает Gemini)
+_SCHEMA_TYPES = {'OBJECT': dict, 'ARRAY': list, 'STRING': str, 'BOOLEAN': bool, 'INTEGER': int, 'NUMBER': (int, float)}
+_json_stats_lock = threading.Lock()
+_json_stats = {'parsed': 0, 'repaired': 0, 'failed': 0}
+
+# Телеметрия вызовов: события копятся в буфере и пишутся в llm_calls пачкой
+TELEMETRY_ENABLED = os.environ.get('LLM_TELEMETRY', '1') == '1'
+TELEMETRY_MAX_BUFFER = 2000   # Если БД недоступна - копим не больше, старые события отбрасываются
+# Соль хэша telegram_id - только из окружения: с известной солью хэш перебирается по всем id.
+# Без LLM_TELEMETRY_SALT вызовы пишутся с user_hash = NULL
+TELEMETRY_SALT = os.environ.get('LLM_TELEMETRY_SALT') or None
+if TELEMETRY_ENABLED and not TELEMETRY_SALT:
+    print("[WARNING] LLM_TELEMETRY_SALT is not set - llm_calls.user_hash will be NULL")
+_telemetry: deque = deque(maxlen=TELEMETRY_MAX_BUFFER)
+_telemetry_lock = threading.Lock()
+
+# Single-flight: ключ -> вызов, который сейчас выполняется
+SINGLE_FLIGHT_WAIT = 60       # секунды, сколько ждущий вызов ждет результат ведущего
+_flights: Dict[str, 'Flight'] = {}
+_flights_lock = threading.Lock()
+_flight_stats = {'calls': 0, 'leaders': 0, 'coalesced': 0, 'wait_timeouts': 0, 'caller_local_retries': 0}
+
+class LLMError(Exception):
+    """Ошибка вызова LLM: HTTP статус с телом ответа или пустой ответ модели"""
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def proxy_host(proxy_url: str) -> str:
+    """Хост прокси без логина/пароля - для логов"""
+    if not proxy_url:
+        return 'direct'
+    return proxy_url.split('@')[-1]
+
+def get_session(proxy_url: str) -> requests.Session:
+    """Возвращает keep-alive сессию для прокси (создается один раз на инстанс)"""
+    key = proxy_url or ''
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[key] = session
+            print(f"[LLM] New keep-alive session for proxy {proxy_host(proxy_url)}")
+    return session
+
+def _proxies_for(proxy_url: str) -> Dict[str, str]:
+    """Прокси передаем в каждый запрос явно, иначе переменные окружения перебивают session.proxies"""
+    if not proxy_url:
+        return {}
+    return {
+        'http': f'http://{proxy_url}',
+        'https': f'http://{proxy_url}'
+    }
+
+def _record_timing(task: str, proxy_url: str, started: float, ok: bool, first_chunk_ms: float = None, model: str = None, outcome: str = None) -> Dict[str, Any]:
+    """
+    Сохраняет тайминг вызова (для стриминга - еще и время до первого куска текста)
+    и ставит его в буфер телеметрии. outcome - ok, timeout, http_<код>, cancelled или error
+    """
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    timing = {
+        'task': task,
+        'model': model,
+        'proxy': proxy_host(proxy_url),
+        'elapsed_ms': round(elapsed_ms, 1),
+        'ok': ok
+    }
+    if first_chunk_ms is not None:
+        timing['first_chunk_ms'] = round(first_chunk_ms, 1)
+    _local.last_call = timing
+
+    if TELEMETRY_ENABLED:
+        # Токены ответа дописывает _record_usage в этот же словарь - до сброса буфера
+        event = dict(timing, called_at=time.time() - elapsed_ms / 1000, outcome=outcome or ('ok' if ok else 'error'),
+                     user_hash=getattr(_local, 'user_hash', None))
+        timing['telemetry'] = event
+        with _telemetry_lock:
+            _telemetry.append(event)
+
+    if ok:
+        with _hedge_lock:
+            _task_latencies.setdefault(task, deque(maxlen=200)).append(elapsed_ms)
+
+    with _stats_lock:
+        stats = _call_stats.setdefault(task, {'calls': 0, 'failures': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'prompt_tokens': 0, 'cached_tokens': 0})
+        stats['calls'] += 1
+        if not ok:
+            stats['failures'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        if model:
+            stats['model'] = model
+
+    if _call_observer:
+        try:
+            _call_observer(task, proxy_url, ok, elapsed_ms, outcome)
+        except Exception as e:
+            print(f"[WARNING] LLM call observer failed: {e}")
+
+    print(f"[LLM] {task} via {timing['proxy']}: {elapsed_ms:.0f}ms ok={ok}")
+    return timing
+
+def _outcome_of(error: Exception) -> str:
+    """Исход упавшего вызова для телеметрии"""
+    if isinstance(error, (requests.Timeout, TimeoutError)):
+        return 'timeout'
+    # LLMError, requests.HTTPError (status в response) и urllib HTTPError (code)
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None) or getattr(error, 'code', None)
+    return f'http_{status}' if isinstance(status, int) else 'error'
+
+def record_external_call(task: str, model: str, proxy_url: str, started: float, ok: bool, error: Exception = None):
+    """
+    Замер вызова мимо llm_client (Whisper, TTS) - в те же счетчики и телеметрию.
+    started - time.perf_counter() перед вызовом
+    """
+    _record_timing(task, proxy_url, started, ok, model=model, outcome=_outcome_of(error) if error is not None else None)
+
+def set_telemetry_user(telegram_id: Any):
+    """Пользователь текущего запроса для телеметрии: в llm_calls попадает только хэш telegram_id (и только с солью)"""
+    if telegram_id and TELEMETRY_SALT:
+        _local.user_hash = hashlib.sha256(f'{TELEMETRY_SALT}:{telegram_id}'.encode('utf-8')).hexdigest()[:16]
+    else:
+        _local.user_hash = None
+
+def bind_telemetry_user(fn: Callable) -> Callable:
+    """Оборачивает fn для рабочего потока: вызовы внутри пишутся в телеметрию от пользователя текущего потока"""
+    user_hash = getattr(_local, 'user_hash', None)
+
+    def bound(*args, **kwargs):
+        _local.user_hash = user_hash
+        return fn(*args, **kwargs)
+    return bound
+
+def has_pending_telemetry() -> bool:
+    return bool(_telemetry)
+
+def _sql_value(value: Any) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return str(int(round(value)))
+    return "'" + str(value).replace("'", "''") + "'"
+
+def flush_telemetry(cur, schema: str, service: str) -> int:
+    """Пишет накопленные события телеметрии в llm_calls одним INSERT. Возвращает число событий"""
+    with _telemetry_lock:
+        events = list(_telemetry)
+        _telemetry.clear()
+
+    if not events:
+        return 0
+
+    rows = []
+    for event in events:
+        values = [event.get('task'), event.get('model'), event.get('proxy'), event.get('elapsed_ms'), event.get('first_chunk_ms'),
+                  event.get('prompt_tokens'), event.get('cached_tokens'), event.get('response_tokens'), event.get('outcome'), event.get('user_hash')]
+        rows.append(f"(to_timestamp({event['called_at']:.3f}), {_sql_value(service)}, {', '.join(map(_sql_value, values))})")
+
+    try:
+        cur.execute(
+            f"INSERT INTO {schema}.llm_calls "
+            f"(called_at, service, task, model, proxy, latency_ms, first_chunk_ms, prompt_tokens, cached_tokens, response_tokens, outcome, user_hash) "
+            f"VALUES {', '.join(rows)}"
+        )
+    except Exception:
+        # Не теряем события: возвращаем их в буфер до следующего сброса
+        with _telemetry_lock:
+            _telemetry.extendleft(reversed(events))
+        raise
+
+    return len(events)
+
+def get_last_call_timing() -> Dict[str, Any]:
+    """Тайминг последнего вызова в текущем потоке"""
+    return getattr(_local, 'last_call', None)
+
+def pop_last_call_timing() -> Dict[str, Any]:
+    """Забирает тайминг последнего вызова (повторно тот же замер не вернется)"""
+    timing = getattr(_local, 'last_call', None)
+    _local.last_call = None
+    return timing
+
+def get_call_stats() -> Dict[str, Dict[str, float]]:
+    """Агрегированные тайминги по задачам с момента старта инстанса (p50/p95 - по последним 200 успешным вызовам)"""
+    with _stats_lock:
+        result = {}
+        for task, stats in _call_stats.items():
+            result[task] = dict(stats)
+            result[task]['avg_ms'] = round(stats['total_ms'] / stats['calls'], 1) if stats['calls'] else 0.0
+    with _hedge_lock:
+        for task, latencies in _task_latencies.items():
+            if task in result and latencies:
+                ordered = sorted(latencies)
+                result[task]['p50_ms'] = round(ordered[len(ordered) // 2], 1)
+                result[task]['p95_ms'] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1)
+    return result
+
+def set_route_loader(loader: Callable[[], List[Dict[str, Any]]]):
+    """
+    Источник маршрутов задач: функция без аргументов, возвращает строки llm_task_routes
+    (task, model, max_output_tokens, timeout_seconds). Каждая функция передает свою - с доступом к БД
+    """
+    global _routes_loader, _routes_loaded_at
+    with _routes_lock:
+        _routes_loader = loader
+        _routes_loaded_at = 0.0
+
+def _load_routes() -> Dict[str, Dict[str, Any]]:
+    global _routes, _routes_loaded_at
+    now = time.time()
+    with _routes_lock:
+        if _routes_loader is None or now - _routes_loaded_at < ROUTES_TTL:
+            return _routes
+        # Ошибку загрузки тоже не повторяем до конца TTL - остаются прежние маршруты
+        _routes_loaded_at = now
+        loader = _routes_loader
+
+    try:
+        routes = {row['task']: row for row in loader()}
+    except Exception as e:
+        print(f"[WARNING] Failed to load LLM task routes: {e}")
+        return _routes
+
+    with _routes_lock:
+        _routes = routes
+    return routes
+
+def get_route(task: str, model: str, timeout: float) -> Dict[str, Any]:
+    """Маршрут задачи: модель, таймаут и лимит токенов ответа из llm_task_routes, где строки нет - значения из кода"""
+    route = _load_routes().get(task) or {}
+    return {
+        'model': route.get('model') or model,
+        'timeout': float(route['timeout_seconds']) if route.get('timeout_seconds') else timeout,
+        'max_output_tokens': route.get('max_output_tokens')
+    }
+
+def set_timeout_limiter(limiter: Optional[Callable[[float], float]]):
+    """
+    Задает ограничитель таймаутов: limiter(таймаут маршрута) -> таймаут вызова.
+    Может бросить исключение, если на вызов времени не осталось - вызов тогда не начинается
+    """
+    global _timeout_limiter
+    _timeout_limiter = limiter
+
+def set_call_observer(observer: Optional[Callable[[str, str, bool, float, str], None]]):
+    """
+    Задает наблюдателя исходов вызовов: observer(task, proxy_url, ok, elapsed_ms, outcome).
+    Так функция без своего учета прокси (webapp-api) отдает исходы в proxy_health
+    """
+    global _call_observer
+    _call_observer = observer
+
+def _apply_route(task: str, model: str, payload: Dict[str, Any], timeout: float) -> Tuple[str, Dict[str, Any], float]:
+    route = get_route(task, model, timeout)
+    if route['max_output_tokens']:
+        config = dict(payload.get('generationConfig') or {})
+        config['maxOutputTokens'] = route['max_output_tokens']
+        payload = {**payload, 'generationConfig': config}
+    timeout = route['timeout']
+    if _timeout_limiter:
+        timeout = _timeout_limiter(timeout)
+    return route['model'], payload, timeout
+
+def _record_usage(task: str, result: Dict[str, Any]):
+    """Токены промпта из usageMetadata ответа: всего и сколько из них взято из кэша контекста"""
+    usage = result.get('usageMetadata') or {}
+    prompt_tokens = usage.get('promptTokenCount', 0)
+    cached_tokens = usage.get('cachedContentTokenCount', 0)
+    if not prompt_tokens:
+        return
+
+    last_call = getattr(_local, 'last_call', None)
+    if last_call is not None:
+        last_call['prompt_tokens'] = prompt_tokens
+        last_call['cached_tokens'] = cached_tokens
+        event = last_call.get('telemetry')
+        if event is not None:
+            event['prompt_tokens'] = prompt_tokens
+            event['cached_tokens'] = cached_tokens
+            event['response_tokens'] = usage.get('candidatesTokenCount', 0)
+
+    with _stats_lock:
+        stats = _call_stats.get(task)
+        if stats is not None:
+            stats['prompt_tokens'] += prompt_tokens
+            stats['cached_tokens'] += cached_tokens
+
+def request(method: str, url: str, proxy_url: str, timeout: float, task: str = 'generic', model: str = None, **kwargs) -> requests.Response:
+    """HTTP запрос через keep-alive сессию прокси. Бросает LLMError на не-2xx ответ"""
+    session = get_session(proxy_url)
+    started = time.perf_counter()
+
+    try:
+        response = session.request(method, url, proxies=_proxies_for(proxy_url), timeout=timeout, **kwargs)
+    except Exception as e:
+        _record_timing(task, proxy_url, started, ok=False, model=model, outcome=_outcome_of(e))
+        raise
+
+    _record_timing(task, proxy_url, started, ok=response.ok, model=model, outcome=None if response.ok else f'http_{response.status_code}')
+
+    if not response.ok:
+        raise LLMError(f"HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+
+    return response
+
+def generate_content(model: str, payload: Dict[str, Any], proxy_url: str, timeout: float, task: str = 'generic') -> Dict[str, Any]:
+    """Вызывает Gemini generateContent и возвращает сырой JSON ответа (модель, лимит и таймаут - по маршруту задачи)"""
+    model, payload, timeout = _apply_route(task, model, payload, timeout)
+    return _generate_content_unrouted(model, payload, proxy_url, timeout, task)
+
+def _generate_content_unrouted(model: str, payload: Dict[str, Any], proxy_url: str, timeout: float, task: str) -> Dict[str, Any]:
+    """generateContent с уже примененным маршрутом: модель, payload и таймаут используются как есть"""
+    api_key = os.environ['GEMINI_API_KEY']
+    url = f'{GEMINI_BASE_URL}/{model}:generateContent?key={api_key}'
+    try:
+        response = request('POST', url, proxy_url, timeout, task=task, model=model, json=payload)
+    except LLMError as e:
+        fallback = _payload_without_context_cache(payload, e.status_code)
+        if fallback is None:
+            raise
+        response = request('POST', url, proxy_url, timeout, task=task, model=model, json=fallback)
+
+    result = response.json()
+    _record_usage(task, result)
+    return result
+
+def stream_text(model: str, payload: Dict[str, Any], proxy_url: str, timeout: float, task: str = 'generic') -> Iterator[str]:
+    """
+    Стриминг Gemini (streamGenerateContent, SSE): отдает куски текста по мере генерации.
+    timeout - на соединение и на паузу между кусками, а не на весь ответ.
+    """
+    model, payload, timeout = _apply_route(task, model, payload, timeout)
+    api_key = os.environ['GEMINI_API_KEY']
+    url = f'{GEMINI_BASE_URL}/{model}:streamGenerateContent?alt=sse&key={api_key}'
+    session = get_session(proxy_url)
+    started = time.perf_counter()
+    first_chunk_ms = None
+    ok = False
+    outcome = None
+    response = None
+    usage = None
+
+    try:
+        response = session.post(url, json=payload, proxies=_proxies_for(proxy_url), timeout=timeout, stream=True)
+        fallback = None if response.ok else _payload_without_context_cache(payload, response.status_code)
+        if fallback is not None:
+            response.close()
+            response = session.post(url, json=fallback, proxies=_proxies_for(proxy_url), timeout=timeout, stream=True)
+        if not response.ok:
+            raise LLMError(f"HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            event = json.loads(line[5:].strip())
+            if event.get('usageMetadata'):
+                usage = event
+            candidates = event.get('candidates') or [{}]
+            parts = (candidates[0].get('content') or {}).get('parts') or []
+            text = ''.join(part.get('text', '') for part in parts)
+            if not text:
+                continue
+            if first_chunk_ms is None:
+                first_chunk_ms = (time.perf_counter() - started) * 1000
+                print(f"[LLM] {task} first chunk via {proxy_host(proxy_url)}: {first_chunk_ms:.0f}ms")
+            yield text
+        ok = True
+    except GeneratorExit:
+        # Вызывающий перестал читать поток (например, кончился бюджет времени)
+        outcome = 'cancelled'
+        raise
+    except Exception as e:
+        outcome = _outcome_of(e)
+        raise
+    finally:
+        if response is not None:
+            response.close()
+        _record_timing(task, proxy_url, started, ok, first_chunk_ms, model=model, outcome=outcome)
+        if usage:
+            _record_usage(task, usage)
+
+def probe(proxy_url: str, timeout: float = 3) -> bool:
+    """Дешевая проверка прокси: метаданные модели (GET, без генерации и токенов)"""
+    api_key = os.environ['GEMINI_API_KEY']
+    try:
+        request('GET', f'{GEMINI_BASE_URL}/gemini-2.5-flash?key={api_key}', proxy_url, timeout, task='probe')
+        return True
+    except Exception:
+        return False
+
+def extract_text(result: Dict[str, Any]) -> str:
+    """Достает текст первого кандидата из ответа Gemini"""
+    try:
+        return result['candidates'][0]['content']['parts'][0]['text']
+    except (KeyError, IndexError, TypeError):
+        raise LLMError(f"Empty Gemini response: {str(result)[:200]}")
+
+def generate_text(model: str, payload: Dict[str, Any], proxy_url: str, timeout: float, task: str = 'generic') -> str:
+    """Вызывает Gemini generateContent и возвращает текст ответа"""
+    return extract_text(generate_content(model, payload, proxy_url, timeout, task=task))
+
+def clean_transcription(text: str) -> str:
+    """
+    Приводит транскрипцию из ответа Gemini к виду /.../ - '' если ответ не похож на транскрипцию.
+    Общая для бота (слово по запросу) и планировщика (словарь word_phonetics): из многострочного
+    ответа берется первая строка, чтобы словарь и бот давали одно и то же
+    """
+    text = text.strip().strip('`"\'').strip()
+    text = text.split('\n')[0].strip()
+    if not text or len(text) > 100:
+        return ''
+    if not text.startswith('/'):
+        text = '/' + text
+    if not text.endswith('/'):
+        text = text + '/'
+    return text
+
+def validate_schema(data: Any, schema: Dict[str, Any], path: str = '$') -> List[str]:
+    """Проверяет данные по responseSchema: типы, обязательные поля, nullable, enum. Возвращает список ошибок"""
+    if data is None:
+        return [] if schema.get('nullable') else [f'{path}: null']
+
+    schema_type = schema.get('type', '').upper()
+    expected = _SCHEMA_TYPES.get(schema_type)
+    if expected is not None:
+        if not isinstance(data, expected) or (isinstance(data, bool) and schema_type in ('INTEGER', 'NUMBER')):
+            return [f'{path}: expected {schema_type}, got {type(data).__name__}']
+
+    errors = []
+    if 'enum' in schema and data not in schema['enum']:
+        errors.append(f'{path}: {data!r} not in enum')
+    if isinstance(data, dict):
+        for key in schema.get('required', []):
+            if key not in data:
+                errors.append(f'{path}.{key}: missing')
+        for key, field_schema in schema.get('properties', {}).items():
+            if key in data:
+                errors.extend(validate_schema(data[key], field_schema, f'{path}.{key}'))
+    elif isinstance(data, list) and 'items' in schema:
+        for i, item in enumerate(data):
+            errors.extend(validate_schema(item, schema['items'], f'{path}[{i}]'))
+    return errors
+
+def repair_json(text: str) -> Any:
+    """
+    Разбирает поломанный JSON ответа модели (json_repair: обертка ```json, текст вокруг,
+    лишние запятые, оборванный хвост). Бросает ValueError, если JSON в ответе нет
+    """
+    data, repairs = json_repair.parse(text)
+    if repairs:
+        print(f"[LLM] JSON repaired: {', '.join(repairs[:5])}")
+    return data
+
+def _count_json(outcome: str):
+    with _json_stats_lock:
+        _json_stats[outcome] += 1
+
+def generate_json(model: str, payload: Dict[str, Any], schema: Dict[str, Any], proxy_url: str, timeout: float, task: str = 'generic') -> Any:
+    """
+    Вызывает Gemini в режиме structured output (responseMimeType + responseSchema) и возвращает
+    разобранный JSON, проверенный по схеме. Если ответ все же не разобрался или не прошел проверку,
+    пробует repair_json; не помогло - LLMError (повтор всего вызова ради формата не делаем)
+    """
+    config = dict(payload.get('generationConfig') or {})
+    config['responseMimeType'] = 'application/json'
+    config['responseSchema'] = schema
+    text = generate_text(model, {**payload, 'generationConfig': config}, proxy_url, timeout, task=task)
+
+    try:
+        data = json.loads(text)
+        errors = validate_schema(data, schema)
+    except ValueError as e:
+        errors = [f'invalid JSON: {e}']
+    if not errors:
+        _count_json('parsed')
+        return data
+
+    print(f"[WARNING] {task}: structured response needs repair ({errors[0]})")
+    try:
+        data = repair_json(text)
+        errors = validate_schema(data, schema)
+    except ValueError as e:
+        errors = [f'invalid JSON: {e}']
+    if errors:
+        _count_json('failed')
+        raise LLMError(f"Invalid structured response for {task}: {'; '.join(errors[:3])}")
+
+    _count_json('repaired')
+    return data
+
+def get_json_stats() -> Dict[str, int]:
+    """Сколько JSON-ответов разобрано сразу, сколько после починки и сколько не удалось"""
+    with _json_stats_lock:
+        return dict(_json_stats)
+
+def with_system_prompt(payload: Dict[str, Any], model: str, static_prompt: str, dynamic_prompt: str = '', proxy_url: str = None, label: str = 'prompt') -> Dict[str, Any]:
+    """
+    Добавляет системный промпт в запрос вместо фейкового диалога "промпт / Understood!".
+
+    static_prompt - стабильная часть (одинакова для многих запросов), dynamic_prompt - часть
+    конкретного запроса. Если передан proxy_url, стабильная часть уходит в кэш контекста Gemini:
+    запрос ссылается на cachedContent, а dynamic_prompt идет первым сообщением пользователя
+    (systemInstruction вместе с кэшем Gemini не принимает). Иначе обе части - в systemInstruction.
+    """
+    result = dict(payload)
+    cache_name = get_context_cache(model, static_prompt, proxy_url, label) if proxy_url is not None else None
+
+    if cache_name:
+        result['cachedContent'] = cache_name
+        if dynamic_prompt:
+            result['contents'] = [{'role': 'user', 'parts': [{'text': dynamic_prompt}]}] + list(payload.get('contents', []))
+    else:
+        result['systemInstruction'] = {'parts': [{'text': static_prompt + dynamic_prompt}]}
+    return result
+
+def set_context_cache_store(load: Callable[[str], Optional[Tuple[str, float]]], save: Callable[[str, str, str, float], None]):
+    """
+    Общее для инстансов хранилище имен кэшей контекста: load(prompt_hash) -> (имя кэша, истекает
+    как time.time()) или None, save(prompt_hash, model, имя кэша, истекает). Без него кэш -
+    только в памяти инстанса
+    """
+    global _context_cache_load, _context_cache_save
+    _context_cache_load = load
+    _context_cache_save = save
+
+def context_cache_hash(model: str, system_text: str) -> str:
+    """Ключ кэша контекста в общем хранилище: sha256 от модели и текста промпта"""
+    return hashlib.sha256(f'{model}\n{system_text}'.encode('utf-8')).hexdigest()
+
+def _load_shared_context_cache(prompt_hash: str, now: float) -> Optional[Tuple[str, float]]:
+    if _context_cache_load is None:
+        return None
+    try:
+        entry = _context_cache_load(prompt_hash)
+    except Exception as e:
+        print(f"[WARNING] Shared context cache lookup failed: {e}")
+        return None
+    if entry and entry[1] - CONTEXT_CACHE_REFRESH_MARGIN > now:
+        return entry
+    return None
+
+def _save_shared_context_cache(prompt_hash: str, model: str, name: str, expires_at: float):
+    if _context_cache_save is None:
+        return
+    try:
+        _context_cache_save(prompt_hash, model, name, expires_at)
+    except Exception as e:
+        print(f"[WARNING] Shared context cache save failed: {e}")
+
+def get_context_cache(model: str, system_text: str, proxy_url: str, label: str = 'prompt', timeout: float = 5) -> Optional[str]:
+    """
+    Имя кэша контекста Gemini (cachedContents/...) с system_text в systemInstruction.
+    Ключ - модель и сам текст промпта: новая версия промпта в БД или другой уровень дают
+    другой текст и, значит, новый кэш. Истекающий кэш пересоздается заранее.
+    Порядок: память инстанса, общее хранилище (кэш, созданный другим инстансом), создание.
+    None - кэш выключен, промпт слишком короткий или создать кэш не удалось.
+    """
+    if not CONTEXT_CACHE_ENABLED or len(system_text) < CONTEXT_CACHE_MIN_CHARS:
+        return None
+
+    key = (model, system_text)
+    now = time.time()
+    entry = _context_caches.get(key)
+    if entry and entry[1] - CONTEXT_CACHE_REFRESH_MARGIN > now:
+        _context_cache_stats['hits'] += 1
+        return entry[0]
+    if _context_cache_failed.get(key, 0) > now:
+        return None
+
+    with _context_cache_lock:
+        entry = _context_caches.get(key)
+        if entry and entry[1] - CONTEXT_CACHE_REFRESH_MARGIN > now:
+            _context_cache_stats['hits'] += 1
+            return entry[0]
+
+        prompt_hash = context_cache_hash(model, system_text)
+        shared = _load_shared_context_cache(prompt_hash, now)
+        if shared:
+            _context_caches[key] = shared
+            _context_cache_sources[shared[0]] = system_text
+            _context_cache_stats['shared_hits'] += 1
+            return shared[0]
+
+        try:
+            name = _create_context_cache(model, system_text, proxy_url, label, timeout)
+        except Exception as e:
+            print(f"[WARNING] Context cache {label} not created: {e}")
+            _context_cache_failed[key] = now + CONTEXT_CACHE_RETRY_AFTER
+            _context_cache_stats['create_failed'] += 1
+            return None
+
+        # Истекшие записи больше не нужны - Gemini удалит их сам
+        for old_key, (old_name, expires_at) in list(_context_caches.items()):
+            if expires_at <= now:
+                del _context_caches[old_key]
+                _context_cache_sources.pop(old_name, None)
+
+        _context_caches[key] = (name, now + CONTEXT_CACHE_TTL)
+        _context_cache_sources[name] = system_text
+        _context_cache_stats['created'] += 1
+        _save_shared_context_cache(prompt_hash, model, name, now + CONTEXT_CACHE_TTL)
+        print(f"[LLM] Context cache {label} created: {name}")
+        return name
+
+def _create_context_cache(model: str, system_text: str, proxy_url: str, label: str, timeout: float) -> str:
+    """Создает cachedContent в Gemini и возвращает его имя"""
+    api_key = os.environ['GEMINI_API_KEY']
+    digest = hashlib.sha1(system_text.encode('utf-8')).hexdigest()[:12]
+    body = {
+        'model': f'models/{model}',
+        'displayName': f'{label}-{digest}',
+        'systemInstruction': {'parts': [{'text': system_text}]},
+        'ttl': f'{CONTEXT_CACHE_TTL}s'
+    }
+    response = request('POST', f'{GEMINI_API_ROOT}/cachedContents?key={api_key}', proxy_url, timeout, task='context_cache', json=body)
+    return response.json()['name']
+
+def _payload_without_context_cache(payload: Dict[str, Any], status_code: int) -> Optional[Dict[str, Any]]:
+    """
+    Если запрос с cachedContent отклонен (кэш истек или удален раньше срока) - забывает кэш
+    и возвращает тот же запрос с промптом в systemInstruction. Иначе None.
+    """
+    name = payload.get('cachedContent')
+    if not name or status_code not in (400, 403, 404):
+        return None
+
+    stale_keys = []
+    with _context_cache_lock:
+        system_text = _context_cache_sources.get(name)
+        for key, (cached_name, _) in list(_context_caches.items()):
+            if cached_name == name:
+                del _context_caches[key]
+                stale_keys.append(key)
+        if system_text is not None:
+            _context_cache_stats['stale_fallbacks'] += 1
+    # Другие инстансы не должны брать этот кэш из общего хранилища - помечаем его истекшим
+    for model, text in stale_keys:
+        _save_shared_context_cache(context_cache_hash(model, text), model, name, 0)
+    if system_text is None:
+        return None
+
+    print(f"[WARNING] Context cache {name} rejected (HTTP {status_code}), retrying without cache")
+    fallback = {k: v for k, v in payload.items() if k != 'cachedContent'}
+    fallback['systemInstruction'] = {'parts': [{'text': system_text}]}
+    return fallback
+
+def get_context_cache_stats() -> Dict[str, Any]:
+    """Метрики кэша контекста: попадания, созданные кэши, ошибки и откаты на запрос без кэша"""
+    with _context_cache_lock:
+        stats = dict(_context_cache_stats)
+        stats['active'] = len(_context_caches)
+        return stats
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='llm-hedge')
+    return _hedge_executor
+
+def get_hedge_delay(task: str, timeout: float) -> float:
+    """Адаптивный порог хеджа: p90 недавних успешных вызовов задачи"""
+    with _hedge_lock:
+        samples = sorted(_task_latencies.get(task, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        delay = HEDGE_DEFAULT_DELAY
+    else:
+        delay = samples[min(int(len(samples) * HEDGE_PERCENTILE), len(samples) - 1)] / 1000
+    return min(max(delay, HEDGE_MIN_DELAY), timeout / 2)
+
+def _hedge_allowed() -> bool:
+    """Ограничение доли хеджей в окне последних вызовов"""
+    hedged = sum(_hedge_window)
+    return hedged < HEDGE_MAX_RATE * max(len(_hedge_window), 10)
+
+def get_hedge_stats() -> Dict[str, Any]:
+    """Метрики хеджирования: сколько вызовов получили второй запрос и кто победил"""
+    with _hedge_lock:
+        stats = dict(_hedge_stats)
+        stats['hedge_rate'] = round(stats['hedged'] / stats['calls'], 3) if stats['calls'] else 0.0
+        stats['hedge_win_rate'] = round(stats['hedge_wins'] / stats['hedged'], 3) if stats['hedged'] else 0.0
+        return stats
+
+def _attempt(model: str, payload: Dict[str, Any], proxy_url: str, timeout: float, task: str, user_hash: str = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Один вызов в рабочем потоке: текст + тайминг этого вызова. Маршрут уже применен
+    в generate_text_hedged - здесь его не применяем снова (иначе таймаут маршрута и
+    ограничитель перебили бы оставшийся бюджет хеджа, а в рабочем потоке нет дедлайна апдейта)
+    """
+    _local.user_hash = user_hash
+    try:
+        text = extract_text(_generate_content_unrouted(model, payload, proxy_url, timeout, task))
+    except Exception as e:
+        e.llm_timing = get_last_call_timing()
+        raise
+    return text, get_last_call_timing()
+
+def generate_text_hedged(model: str, payload: Dict[str, Any], primary: Tuple[Any, str], backup: Tuple[Any, str], timeout: float, task: str = 'generic', on_other_result: Callable = None) -> Tuple[str, Any]:
+    """
+    Вызов Gemini с хеджированием. primary/backup - пары (tag, proxy_url), tag (например id прокси)
+    возвращается вместе с текстом победителя. Общее время ограничено timeout (после маршрута
+    задачи и ограничителя): backup получает остаток, по истечении бросается TimeoutError.
+
+    Если primary упал (отказ в соединении, 407, 5xx) и время еще есть, backup запускается
+    сразу, без ожидания порога и без учета в доле хеджей - это не второй запрос, а замена.
+
+    Исход второго запроса (проигравшего или упавшего) передается в
+    on_other_result(tag, ok, elapsed_ms, error_message), когда он завершится.
+    Если упали все запросы - пробрасывается ошибка primary.
+    """
+    model, payload, timeout = _apply_route(task, model, payload, timeout)
+    primary_tag, primary_url = primary
+    if not HEDGE_ENABLED or not backup or not backup[1] or backup[1] == primary_url:
+        return extract_text(_generate_content_unrouted(model, payload, primary_url, timeout, task)), primary_tag
+
+    started = time.perf_counter()
+    executor = _get_hedge_executor()
+    user_hash = getattr(_local, 'user_hash', None)
+    primary_future = executor.submit(_attempt, model, payload, primary_url, timeout, task, user_hash)
+    futures = {primary_future: primary}
+
+    delay = get_hedge_delay(task, timeout)
+    done, _ = wait([primary_future], timeout=delay)
+
+    with _hedge_lock:
+        _hedge_stats['calls'] += 1
+        hedge = not done and _hedge_allowed()
+        _hedge_window.append(hedge)
+        if hedge:
+            _hedge_stats['hedged'] += 1
+        elif not done:
+            _hedge_stats['skipped_by_cap'] += 1
+
+    if hedge:
+        remaining = max(timeout - (time.perf_counter() - started), HEDGE_MIN_DELAY)
+        print(f"[LLM] {task}: no answer from {proxy_host(primary_url)} after {delay:.1f}s, hedging via {proxy_host(backup[1])}")
+        futures[executor.submit(_attempt, model, payload, backup[1], remaining, task, user_hash)] = backup
+
+    winner = None
+    pending = set(futures)
+    while pending and winner is None:
+        left = timeout - (time.perf_counter() - started)
+        if left <= 0:
+            break
+        done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if winner is None:
+                    winner = future
+            elif future is primary_future and len(futures) == 1:
+                # Primary упал, backup еще не запущен - переключаемся на него на остаток времени
+                left = timeout - (time.perf_counter() - started)
+                if left > 0:
+                    print(f"[LLM] {task}: {proxy_host(primary_url)} failed ({future.exception()}), failing over to {proxy_host(backup[1])}")
+                    with _hedge_lock:
+                        _hedge_stats['failovers'] += 1
+                    failover = executor.submit(_attempt, model, payload, backup[1], left, task, user_hash)
+                    futures[failover] = backup
+                    pending.add(failover)
+
+    if winner is None and pending:
+        # Никто не ответил за timeout: запросы доработают в фоне. Ошибка - про primary,
+        # исход backup уйдет в on_other_result, когда он завершится
+        for future, (tag, _) in futures.items():
+            if future is not primary_future:
+                future.add_done_callback(lambda f, tag=tag: _report_other(f, tag, on_other_result))
+        raise TimeoutError(f'{task}: no answer from any proxy in {timeout:.1f}s')
+
+    if winner is None:
+        # Упали все запросы: ошибку backup отдаем наружу, ошибку primary пробрасываем
+        for future in futures:
+            if future is not primary_future:
+                _report_other(future, futures[future][0], on_other_result)
+        raise primary_future.exception()
+
+    # Все, кроме победителя (в т.ч. проигравший, который доработает в фоне), отдаем в on_other_result
+    for future, (tag, _) in futures.items():
+        if future is not winner:
+            future.add_done_callback(lambda f, tag=tag: _report_other(f, tag, on_other_result))
+
+    text, timing = winner.result()
+    _local.last_call = timing
+
+    if hedge:
+        with _hedge_lock:
+            _hedge_stats['primary_wins' if winner is primary_future else 'hedge_wins'] += 1
+
+    return text, futures[winner][0]
+
+def _report_other(future, tag: Any, on_other_result: Callable):
+    """Передает исход не победившего запроса в on_other_result"""
+    if not on_other_result:
+        return
+    error = future.exception()
+    timing = (getattr(error, 'llm_timing', None) if error else future.result()[1]) or {}
+    on_other_result(tag, error is None, timing.get('elapsed_ms'), str(error) if error else None)
+
+class Flight:
+    """Вызов single_flight в процессе выполнения: ждущие получают его результат или ошибку"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+def single_flight(key: str, fn: Callable[[], Any], wait_timeout: float = SINGLE_FLIGHT_WAIT) -> Any:
+    """
+    Выполняет fn() один раз на ключ среди одновременных вызовов: первый (ведущий) идет
+    наружу, остальные ждут и получают тот же результат или ту же ошибку. Ошибка с атрибутом
+    caller_local (deadline.DeadlineExceeded - бюджет времени ведущего) ждущим не передается:
+    они повторяют вызов сами, один из них становится новым ведущим.
+    Ключ нормализует вызывающий (например 'ipa:' + слово в нижнем регистре).
+    fn должен сам положить результат в постоянный кэш - после завершения ключ освобождается
+    """
+    with _flights_lock:
+        _flight_stats['calls'] += 1
+
+    while True:
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = Flight()
+                _flight_stats['leaders'] += 1
+            else:
+                _flight_stats['coalesced'] += 1
+
+        if leader:
+            break
+        if not flight.done.wait(wait_timeout):
+            with _flights_lock:
+                _flight_stats['wait_timeouts'] += 1
+            raise TimeoutError(f'single flight {key!r}: no result after {wait_timeout}s')
+        if flight.error is None:
+            return flight.result
+        if not getattr(flight.error, 'caller_local', False):
+            raise flight.error
+        # Ошибка касается только ведущего (например, кончился бюджет его апдейта) - пробуем сами
+        with _flights_lock:
+            _flight_stats['caller_local_retries'] += 1
+
+    try:
+        flight.result = fn()
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+def get_single_flight_stats() -> Dict[str, Any]:
+    """Метрики single-flight: сколько вызовов ушло наружу и сколько дождались чужого результата"""
+    with _flights_lock:
+        stats = dict(_flight_stats)
+        stats['in_flight'] = len(_flights)
+    stats['coalesced_share'] = round(stats['coalesced'] / stats['calls'], 3) if stats['calls'] else 0.0
+    return stats
@@ -0,0 +1,137 @@
+"""Определение эмоционального контекста сообщения по ключевым словам (целые слова и основы с *)"""
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+RUSSIAN_KEYWORDS_ENABLED = os.environ.get('EMOTION_RUSSIAN_KEYWORDS', '0') == '1'
+
+_WORD_RE = re.compile(r'\w+')
+
+MAX_TOKEN_CACHE = 20000       # Слов с уже посчитанным рангом на набор (потом кэш сбрасывается)
+
+# Порядок важен: тяжелые эмоции перебивают позитив, позитив - учебные вопросы
+MOOD_PRIORITY = ['empathetic', 'enthusiastic', 'educational']
+DEFAULT_MOOD = 'casual'
+
+# Английские формы: основа со * там, где она не ловит чужие слова (struggl*, hurt*);
+# где ловит (miss* - mission, sad* - saddle, cri* - crisis, pain* - paint, hat* - hat) -
+# формы перечислены явно
+DEFAULT_KEYWORDS = {
+    # Тяжелые эмоции (грусть, страх, боль)
+    'empathetic': ['death', 'dead', 'die', 'died', 'dies', 'dying', 'kill', 'killed', 'killing', 'suicid*',
+                   'fear', 'fears', 'feared', 'fearful', 'scared', 'scary', 'afraid', 'terrified', 'terrifying', 'panic*',
+                   'lonely', 'loneliness', 'alone', 'depress*', 'sad', 'sadder', 'saddest', 'sadly', 'sadness',
+                   'cry', 'cries', 'cried', 'crying', 'tears',
+                   'difficult*', 'hard time', 'hard times', 'struggl*', 'pain', 'pains', 'painful', 'hurt*', 'suffer*',
+                   'lost', 'miss', 'missed', 'misses', 'missing', 'gone', 'never',
+                   'hate', 'hated', 'hates', 'hating', 'hatred', 'angry', 'anger', 'upset*'],
+    # Позитивные эмоции
+    'enthusiastic': ['happy', 'happier', 'happiest', 'happiness', 'joy', 'joyful', 'excit*',
+                     'love', 'loved', 'loves', 'loving', 'lovely', 'amazing', 'amazed', 'wonderful',
+                     'great', 'awesome', 'perfect', 'fantastic', 'excellent'],
+    # Нейтральные/обучающие
+    'educational': ['how', 'what', 'why', 'when', 'where', 'explain*', 'mean', 'means',
+                    'help', 'helps', 'learn*', 'study', 'studies', 'studied', 'studying', 'practic*', 'practis*'],
+}
+
+DEFAULT_RUSSIAN_KEYWORDS = {
+    'empathetic': ['груст*', 'печал*', 'тоск*', 'одинок*', 'страш*', 'боюсь', 'боится', 'страх*',
+                   'плак*', 'плач*', 'больно', 'боль', 'умер*', 'смерт*', 'депресс*', 'тяжело',
+                   'устал*', 'скуча*', 'ненавиж*', 'злюсь', 'обид*', 'расстро*', 'паник*'],
+    'enthusiastic': ['рад', 'рада', 'радост*', 'счаст*', 'ура', 'класс*', 'круто', 'отлично',
+                     'супер', 'обожаю', 'люблю', 'восторг*', 'замечательн*', 'прекрасн*'],
+    # Без вопросительных слов (как, что, где, когда...): "Как дела?", "Что нового?" - это болтовня, а не учебный вопрос
+    'educational': ['объясни*', 'означает', 'помоги*', 'помочь', 'учить', 'выучить', 'изуч*', 'практик*', 'правил*'],
+}
+
+class KeywordMatcher:
+    """
+    Скомпилированные наборы слов: целые слова, фразы (по первому слову) и основы (по первым двум буквам).
+    Ранг отдельного слова сообщения (целое слово или основа) считается один раз и запоминается
+    в token_ranks: слова в диалогах повторяются, и следующее сообщение проверяется поиском по словарю
+    """
+
+    def __init__(self, keywords: Dict[str, Iterable[str]]):
+        self.words: Dict[str, int] = {}
+        self.phrases: Dict[str, List[Tuple[Tuple[str, ...], int]]] = {}
+        self.stems: Dict[str, List[Tuple[str, int]]] = {}
+        self.token_ranks: Dict[str, int] = {}
+        # Настроение задается индексом в MOOD_PRIORITY: меньше - важнее
+        for rank in reversed(range(len(MOOD_PRIORITY))):
+            for keyword in keywords.get(MOOD_PRIORITY[rank], []):
+                keyword = keyword.strip().lower()
+                if keyword.endswith('*'):
+                    stem = keyword.rstrip('*')
+                    if len(stem) >= 2:
+                        self.stems.setdefault(stem[:2], []).append((stem, rank))
+                elif ' ' in keyword:
+                    parts = tuple(keyword.split())
+                    self.phrases.setdefault(parts[0], []).append((parts[1:], rank))
+                elif keyword:
+                    self.words[keyword] = rank
+
+    def token_rank(self, token: str) -> int:
+        """Ранг одного слова: целое ключевое слово или основа, len(MOOD_PRIORITY) - не подходит ничего"""
+        rank = self.words.get(token, len(MOOD_PRIORITY))
+        for stem, stem_rank in self.stems.get(token[:2], ()):
+            if stem_rank < rank and token.startswith(stem):
+                rank = stem_rank
+        return rank
+
+    def best_rank(self, message: str) -> int:
+        """
+        Индекс самого важного найденного настроения или len(MOOD_PRIORITY), если слов нет.
+        Разбиение на слова и поиск по словарю рангов идут в C (re.findall, set, map),
+        в питоне - только ранги новых слов и проверка фраз
+        """
+        tokens = _WORD_RE.findall(message.lower())
+        unique = set(tokens)
+        token_ranks = self.token_ranks
+        missing = unique.difference(token_ranks)
+        if missing:
+            if len(token_ranks) + len(missing) > MAX_TOKEN_CACHE:
+                token_ranks.clear()
+                missing = unique
+            for token in missing:
+                token_ranks[token] = self.token_rank(token)
+        best = min(map(token_ranks.__getitem__, unique), default=len(MOOD_PRIORITY))
+
+        if best:
+            for first in unique.intersection(self.phrases):
+                for i, token in enumerate(tokens):
+                    if token != first:
+                        continue
+                    for rest, rank in self.phrases[first]:
+                        if rank < best and tuple(tokens[i + 1:i + 1 + len(rest)]) == rest:
+                            best = rank
+        return best
+
+def compile_matcher(keywords: Dict[str, Iterable[str]]) -> KeywordMatcher:
+    """Компилирует наборы слов по настроениям (один раз на набор, дальше - только detect)"""
+    return KeywordMatcher(keywords)
+
+def merge_keywords(rows: List[Dict[str, str]] = None, include_russian: bool = RUSSIAN_KEYWORDS_ENABLED) -> Dict[str, List[str]]:
+    """
+    Наборы слов по настроениям: встроенные + русские (если включены); строки из БД
+    (mood, keyword, language) заменяют встроенный набор своего настроения и языка
+    """
+    builtin = {'en': DEFAULT_KEYWORDS}
+    if include_russian:
+        builtin['ru'] = DEFAULT_RUSSIAN_KEYWORDS
+
+    from_db: Dict[tuple, List[str]] = {}
+    for row in rows or []:
+        from_db.setdefault((row['language'], row['mood']), []).append(row['keyword'])
+
+    result = {mood: [] for mood in MOOD_PRIORITY}
+    for language, sets in builtin.items():
+        for mood in MOOD_PRIORITY:
+            result[mood].extend(from_db.get((language, mood), sets.get(mood, [])))
+    return result
+
+_default_matcher = compile_matcher(merge_keywords())
+
+def detect(message: str, matcher: Optional[KeywordMatcher] = None) -> str:
+    """Настроение сообщения: empathetic, enthusiastic, educational или casual (один проход по тексту)"""
+    rank = (matcher or _default_matcher).best_rank(message)
+    return MOOD_PRIORITY[rank] if rank < len(MOOD_PRIORITY) else DEFAULT_MOOD
@@ -0,0 +1,53 @@
+"""Потоковое multipart/form-data тело запроса: файл читается из потока кусками прямо в сокет"""
+import uuid
+from typing import BinaryIO, Dict, Optional
+
+class MultipartStream:
+    """Тело multipart/form-data: текстовые поля, затем один файл из потока"""
+
+    def __init__(self, fields: Dict[str, str], file_field: str, filename: str,
+                 stream: BinaryIO, size: Optional[int], content_type: str = 'application/octet-stream'):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        head = b''.join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+            for name, value in fields.items()
+        )
+        head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+                 f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n').encode('utf-8')
+        if size is None:
+            # Длина потока неизвестна - читаем файл сразу (одна копия, как раньше bytes)
+            head += stream.read()
+            size = 0
+        self._parts = [head, stream, f'\r\n--{self.boundary}--\r\n'.encode('utf-8')]
+        self._file_left = size
+        self._length = len(self._parts[0]) + size + len(self._parts[2])
+        self._part = 0
+        self._offset = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length
+        chunks = []
+        while size > 0 and self._part < 3:
+            part = self._parts[self._part]
+            if self._part == 1:
+                chunk = part.read(min(size, self._file_left)) if self._file_left else b''
+                if not chunk:
+                    if self._file_left:
+                        raise IOError(f'Upload stream ended {self._file_left} bytes early')
+                    self._part += 1
+                    continue
+                self._file_left -= len(chunk)
+            else:
+                chunk = part[self._offset:self._offset + size]
+                self._offset += len(chunk)
+                if self._offset >= len(part):
+                    self._part += 1
+                    self._offset = 0
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
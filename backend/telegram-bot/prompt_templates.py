@@ -0,0 +1,62 @@
+"""
+Скомпилированные шаблоны системных промптов.
+
+Большой системный промпт диалога почти целиком зависит от нескольких ключей
+(версия промптов из БД, эмоциональный режим, уровень, режим обучения) и лишь
+в паре мест - от конкретного запроса (цель, слова, темы). Скелет промпта
+собирается один раз на ключ и хранится разбитым на куски: статический текст
+и именованные слоты. На каждый запрос остается один ''.join(). Скелет диалога
+слотов не содержит вовсе (части запроса идут отдельными блоками) - так он
+одинаков для всех студентов и целиком попадает в кэш контекста Gemini.
+
+Слоты в исходнике скелета помечаются через slot('name') - символ \\x00
+не встречается ни в тексте промптов, ни в промптах из админки.
+
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Callable, Tuple, Hashable
+
+SLOT_MARK = '\x00'
+MAX_COMPILED = 256
+
+_compiled: 'OrderedDict[Hashable, Tuple[str, ...]]' = OrderedDict()
+_compiled_lock = threading.Lock()
+
+def slot(name: str) -> str:
+    """Метка слота для исходника шаблона"""
+    return f'{SLOT_MARK}{name}{SLOT_MARK}'
+
+def compile_template(source: str) -> Tuple[str, ...]:
+    """Разбивает шаблон на куски: четные - статический текст, нечетные - имена слотов"""
+    return tuple(source.split(SLOT_MARK))
+
+def render(compiled: Tuple[str, ...], values: Dict[str, str] = None) -> str:
+    """Подставляет значения слотов в скомпилированный шаблон"""
+    if len(compiled) == 1:
+        return compiled[0]
+    parts = list(compiled)
+    for i in range(1, len(parts), 2):
+        parts[i] = values.get(parts[i], '') if values else ''
+    return ''.join(parts)
+
+def get_compiled(key: Hashable, build_source: Callable[[], str]) -> Tuple[str, ...]:
+    """Скомпилированный шаблон по ключу: build_source вызывается только при промахе (LRU)"""
+    with _compiled_lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            return compiled
+
+    compiled = compile_template(build_source())
+
+    with _compiled_lock:
+        _compiled[key] = compiled
+        if len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return compiled
+
+def clear():
+    """Сбрасывает все скомпилированные шаблоны"""
+    with _compiled_lock:
+        _compiled.clear()
@@ -0,0 +1,191 @@
+"""Локальная предпроверка предложений в режиме "Составь предложение" до вызова Gemini"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set
+
+MIN_WORDS = 3                 # Минимум слов в предложении
+MAX_CYRILLIC_SHARE = 0.3      # Больше такой доли кириллицы - ответ не на английском
+MIN_UNIQUE_SHARE = 0.5        # Меньше такой доли разных слов - повтор одного слова
+MAX_PHRASE_GAP = 2            # Сколько слов может стоять между частями фразы (give it up)
+MIN_STEM_PREFIX = 4           # Общее начало слова с целевым - форма могла не попасть в word_forms
+MAX_REMEMBERED = 2000         # Сколько вердиктов Gemini хранить
+
+_WORD_RE = re.compile(r"[a-z]+(?:'[a-z]+)?")
+_LATIN_RE = re.compile(r'[A-Za-z]')
+_CYRILLIC_RE = re.compile(r'[А-Яа-яЁё]')
+
+# Неправильные глаголы: базовая форма -> формы (частые в упражнениях уровня A1-B2)
+IRREGULAR_FORMS = {
+    'be': ['am', 'is', 'are', 'was', 'were', 'been', 'being'],
+    'have': ['has', 'had', 'having'],
+    'do': ['does', 'did', 'done', 'doing'],
+    'go': ['goes', 'went', 'gone', 'going'],
+    'buy': ['bought'], 'bring': ['brought'], 'think': ['thought'], 'teach': ['taught'],
+    'catch': ['caught'], 'fight': ['fought'], 'seek': ['sought'],
+    'make': ['made'], 'say': ['said'], 'pay': ['paid'], 'lay': ['laid'],
+    'get': ['got', 'gotten'], 'give': ['gave', 'given'], 'take': ['took', 'taken'],
+    'see': ['saw', 'seen'], 'come': ['came'], 'become': ['became'], 'run': ['ran'],
+    'eat': ['ate', 'eaten'], 'drink': ['drank', 'drunk'], 'sing': ['sang', 'sung'],
+    'swim': ['swam', 'swum'], 'begin': ['began', 'begun'], 'ring': ['rang', 'rung'],
+    'write': ['wrote', 'written'], 'ride': ['rode', 'ridden'], 'drive': ['drove', 'driven'],
+    'speak': ['spoke', 'spoken'], 'break': ['broke', 'broken'], 'choose': ['chose', 'chosen'],
+    'wake': ['woke', 'woken'], 'forget': ['forgot', 'forgotten'], 'freeze': ['froze', 'frozen'],
+    'know': ['knew', 'known'], 'grow': ['grew', 'grown'], 'throw': ['threw', 'thrown'],
+    'fly': ['flew', 'flown', 'flies'], 'draw': ['drew', 'drawn'], 'show': ['showed', 'shown'],
+    'wear': ['wore', 'worn'], 'tear': ['tore', 'torn'], 'bear': ['bore', 'born', 'borne'],
+    'fall': ['fell', 'fallen'], 'hide': ['hid', 'hidden'], 'bite': ['bit', 'bitten'],
+    'find': ['found'], 'feel': ['felt'], 'keep': ['kept'], 'sleep': ['slept'], 'leave': ['left'],
+    'meet': ['met'], 'lose': ['lost'], 'send': ['sent'], 'spend': ['spent'], 'build': ['built'],
+    'lend': ['lent'], 'mean': ['meant'], 'hear': ['heard'], 'sell': ['sold'], 'tell': ['told'],
+    'stand': ['stood'], 'understand': ['understood'], 'sit': ['sat'], 'win': ['won'],
+    'hold': ['held'], 'lead': ['led'], 'feed': ['fed'], 'read': [], 'put': [], 'cut': [],
+    'let': [], 'set': [], 'hit': [], 'hurt': [], 'cost': [], 'shut': [], 'quit': [],
+    'learn': ['learnt'], 'dream': ['dreamt'], 'burn': ['burnt'], 'spell': ['spelt'],
+    'light': ['lit'], 'shoot': ['shot'], 'dig': ['dug'], 'stick': ['stuck'], 'hang': ['hung'],
+    'shine': ['shone'], 'forgive': ['forgave', 'forgiven'], 'rise': ['rose', 'risen'],
+    'steal': ['stole', 'stolen'], 'shake': ['shook', 'shaken'], 'mistake': ['mistook', 'mistaken'],
+    'lie': ['lay', 'lain', 'lying'], 'die': ['dying'], 'tie': ['tying'],
+    # Существительные
+    'child': ['children'], 'man': ['men'], 'woman': ['women'], 'person': ['people'],
+    'foot': ['feet'], 'tooth': ['teeth'], 'mouse': ['mice'], 'goose': ['geese'],
+    'knife': ['knives'], 'wife': ['wives'], 'life': ['lives'], 'leaf': ['leaves'],
+    'wolf': ['wolves'], 'half': ['halves'], 'shelf': ['shelves'],
+    # Прилагательные
+    'good': ['better', 'best'], 'bad': ['worse', 'worst'], 'far': ['further', 'farther', 'furthest', 'farthest'],
+}
+
+_remembered: 'OrderedDict[tuple, Dict[str, Any]]' = OrderedDict()
+_lock = threading.Lock()
+_stats = {'local': 0, 'remembered': 0, 'llm': 0}
+
+def tokenize(text: str) -> List[str]:
+    """Слова текста в нижнем регистре (апостроф внутри слова сохраняется: don't)"""
+    return _WORD_RE.findall(text.lower().replace('’', "'"))
+
+def word_forms(word: str) -> Set[str]:
+    """Формы слова: окончания -s/-es/-ed/-ing/-er/-est/-ly, удвоение согласной, y -> ies/ied и неправильные формы"""
+    forms = {word}
+    forms.update(IRREGULAR_FORMS.get(word, []))
+
+    forms.update({word + 's', word + 'es', word + 'ed', word + 'ing', word + 'er', word + 'est', word + 'ly', word + "'s"})
+    if word.endswith('e'):
+        stem = word[:-1]
+        forms.update({word + 'd', word + 'r', word + 'st', stem + 'ing'})
+    if word.endswith('y') and len(word) > 2 and word[-2] not in 'aeiou':
+        stem = word[:-1]
+        forms.update({stem + 'ies', stem + 'ied', stem + 'ier', stem + 'iest', stem + 'ily'})
+    if word.endswith('ie'):
+        forms.add(word[:-2] + 'ying')
+    if len(word) >= 3 and word[-1] not in 'aeiouwxy' and word[-2] in 'aeiou' and word[-3] not in 'aeiou':
+        doubled = word + word[-1]
+        forms.update({doubled + 'ed', doubled + 'ing', doubled + 'er', doubled + 'est'})
+    if word.endswith('f'):
+        forms.add(word[:-1] + 'ves')
+    if word.endswith('fe'):
+        forms.add(word[:-2] + 'ves')
+    return forms
+
+def contains_target(tokens: List[str], target: str) -> bool:
+    """
+    Есть ли в предложении целевое слово или фраза в любой форме.
+    Для фразы части ищутся по порядку, между ними допускается до MAX_PHRASE_GAP слов
+    """
+    target_tokens = tokenize(target)
+    if not target_tokens:
+        return True
+
+    forms = [word_forms(part) for part in target_tokens]
+    for start, token in enumerate(tokens):
+        if token not in forms[0]:
+            continue
+        position = start
+        matched = True
+        for part_forms in forms[1:]:
+            window = tokens[position + 1:position + 2 + MAX_PHRASE_GAP]
+            next_position = next((position + 1 + i for i, t in enumerate(window) if t in part_forms), None)
+            if next_position is None:
+                matched = False
+                break
+            position = next_position
+        if matched:
+            return True
+    return False
+
+def shares_stem(tokens: List[str], target: str) -> bool:
+    """
+    Есть ли слово с общим началом хотя бы MIN_STEM_PREFIX букв с частью целевого слова
+    или с ним целиком без дефисов и пробелов (analyses - analysis, icecream - ice-cream).
+    Такое предложение не отклоняется локально: решает Gemini
+    """
+    target_tokens = tokenize(target)
+    stems = set(target_tokens) | {''.join(target_tokens)}
+    for stem in stems:
+        if len(stem) < MIN_STEM_PREFIX:
+            continue
+        prefix = stem[:MIN_STEM_PREFIX]
+        if any(token.startswith(prefix) for token in tokens):
+            return True
+    return False
+
+def _reject(feedback: str, has_word: bool, reason: str) -> Dict[str, Any]:
+    with _lock:
+        _stats['local'] += 1
+    return {
+        'is_correct': False,
+        'has_word': has_word,
+        'grammar_ok': False,
+        'feedback': feedback,
+        'corrected': '',
+        'pregrade_reason': reason
+    }
+
+def _memo_key(sentence: str, target: str, language_level: str) -> tuple:
+    return (target.strip().lower(), ' '.join(tokenize(sentence)), language_level)
+
+def pregrade(sentence: str, target: str, language_level: str = 'A1') -> Optional[Dict[str, Any]]:
+    """
+    Вердикт без Gemini в формате проверки Gemini (is_correct, has_word, grammar_ok, feedback, corrected)
+    или None - предложение правдоподобное, его нужно проверить через Gemini
+    """
+    text = sentence.strip()
+    latin = len(_LATIN_RE.findall(text))
+    cyrillic = len(_CYRILLIC_RE.findall(text))
+    if latin == 0 or cyrillic > MAX_CYRILLIC_SHARE * (latin + cyrillic):
+        return _reject('Предложение нужно написать на английском языке.', False, 'script')
+
+    tokens = tokenize(text)
+    min_words = max(MIN_WORDS, len(tokenize(target)) + 1)
+    if len(tokens) < min_words:
+        return _reject(f'Слишком коротко - составь полное предложение (хотя бы {min_words} слова).', contains_target(tokens, target), 'too_short')
+
+    if len(set(tokens)) < MIN_UNIQUE_SHARE * len(tokens):
+        return _reject('Похоже на повтор одних и тех же слов - составь настоящее предложение.', contains_target(tokens, target), 'repetition')
+
+    if not contains_target(tokens, target) and not shares_stem(tokens, target):
+        return _reject(f'В предложении нет слова "{target}" - используй его в любой форме.', False, 'no_target')
+
+    with _lock:
+        verdict = _remembered.get(_memo_key(text, target, language_level))
+        if verdict is not None:
+            _stats['remembered'] += 1
+            return dict(verdict)
+        _stats['llm'] += 1
+    return None
+
+def remember(sentence: str, target: str, language_level: str, verdict: Dict[str, Any]):
+    """Запоминает вердикт Gemini для предложения (повторная отправка проверяется мгновенно)"""
+    key = _memo_key(sentence, target, language_level)
+    with _lock:
+        _remembered[key] = dict(verdict)
+        _remembered.move_to_end(key)
+        if len(_remembered) > MAX_REMEMBERED:
+            _remembered.popitem(last=False)
+
+def get_stats() -> Dict[str, Any]:
+    """Сколько проверок закрыто локально, из запомненных вердиктов и сколько ушло в Gemini"""
+    with _lock:
+        stats = dict(_stats)
+    total = stats['local'] + stats['remembered'] + stats['llm']
+    stats['offloaded_share'] = round((stats['local'] + stats['remembered']) / total, 3) if total else 0.0
+    return stats
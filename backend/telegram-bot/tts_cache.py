@@ -0,0 +1,152 @@
+"""Кэш озвучки в S3 по содержимому (голос, модель, формат, текст), общий для бота и webapp-api"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+import llm_client
+
+MAX_KNOWN_KEYS = 5000         # Сколько ключей с URL держать в памяти инстанса
+TEXT_PREVIEW_CHARS = 200      # Сколько текста сохранять в индексе (для админки и отладки)
+
+EXTENSIONS = {'opus': 'opus', 'oggopus': 'ogg', 'mp3': 'mp3'}
+CONTENT_TYPES = {'opus': 'audio/ogg', 'oggopus': 'audio/ogg', 'mp3': 'audio/mpeg'}
+
+S3_ENDPOINT = 'https://bucket.poehali.dev'
+S3_BUCKET = 'files'
+S3_MAX_POOL_CONNECTIONS = 10  # Параллельные загрузки (куски озвучки, несколько запросов инстанса)
+S3_CONNECT_TIMEOUT = 3        # секунды
+S3_READ_TIMEOUT = 15          # секунды
+
+_connect: Optional[Callable[[], Any]] = None
+_schema = ''
+_known: 'OrderedDict[str, str]' = OrderedDict()
+_known_lock = threading.Lock()
+_s3_client = None
+_s3_lock = threading.Lock()
+_stats = {'memory_hits': 0, 'index_hits': 0, 'synthesized': 0}
+
+def configure(connect: Callable[[], Any], schema: str):
+    """Подключение к БД (get_db_connection функции) и схема, где лежит tts_audio_cache"""
+    global _connect, _schema
+    _connect = connect
+    _schema = schema
+
+def normalize_text(text: str) -> str:
+    """Текст для ключа: пробелы и переносы схлопнуты (регистр и пунктуация влияют на интонацию - не трогаем)"""
+    return ' '.join(text.split())
+
+def audio_key(text: str, voice: str, model: str, audio_format: str) -> str:
+    """Ключ озвучки: sha256 от голоса, модели, формата и нормализованного текста"""
+    source = '\n'.join((voice, model, audio_format, normalize_text(text)))
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def _remember(key: str, url: str):
+    with _known_lock:
+        _known[key] = url
+        _known.move_to_end(key)
+        if len(_known) > MAX_KNOWN_KEYS:
+            _known.popitem(last=False)
+
+def _load_url(key: str) -> Optional[str]:
+    """URL из индекса tts_audio_cache (None - такой озвучки еще нет)"""
+    try:
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(f"SELECT url FROM {_schema}.tts_audio_cache WHERE audio_key = '{key}'")
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"[WARNING] TTS cache lookup failed: {e}")
+        return None
+
+def _save_url(key: str, url: str, text: str, voice: str, model: str, audio_format: str, size: int):
+    try:
+        preview = normalize_text(text)[:TEXT_PREVIEW_CHARS].replace("'", "''")
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            f"INSERT INTO {_schema}.tts_audio_cache (audio_key, url, voice, model, audio_format, text_preview, size_bytes) "
+            f"VALUES ('{key}', '{url}', '{voice}', '{model}', '{audio_format}', '{preview}', {size}) "
+            f"ON CONFLICT (audio_key) DO NOTHING"
+        )
+        cur.close()
+        conn.close()
+    except Exception as e:
+        print(f"[WARNING] TTS cache save failed: {e}")
+
+def get_s3_client():
+    """Клиент S3 на весь процесс: создается при первом вызове (boto3 импортируется тогда же)"""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_lock:
+            if _s3_client is None:
+                import boto3
+                from botocore.config import Config
+                _s3_client = boto3.client('s3',
+                    endpoint_url=S3_ENDPOINT,
+                    aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+                    aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        connect_timeout=S3_CONNECT_TIMEOUT,
+                        read_timeout=S3_READ_TIMEOUT,
+                        retries={'max_attempts': 2}
+                    )
+                )
+    return _s3_client
+
+def cdn_url(file_key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
+
+def _upload(file_key: str, data: bytes, audio_format: str) -> str:
+    """Кладет аудио в S3 и возвращает CDN URL"""
+    get_s3_client().put_object(
+        Bucket=S3_BUCKET,
+        Key=file_key,
+        Body=data,
+        ContentType=CONTENT_TYPES.get(audio_format, 'application/octet-stream')
+    )
+    return cdn_url(file_key)
+
+def get_audio(text: str, voice: str, model: str, audio_format: str, synthesize: Callable[[str], bytes]) -> Tuple[str, bool]:
+    """
+    URL озвучки текста: (url, True) - из кэша, (url, False) - только что синтезирована.
+    synthesize(text) -> bytes вызывается, только если такой озвучки еще нет ни у одной функции
+    """
+    key = audio_key(text, voice, model, audio_format)
+    with _known_lock:
+        url = _known.get(key)
+        if url is not None:
+            _known.move_to_end(key)
+            _stats['memory_hits'] += 1
+            return url, True
+
+    def create() -> Tuple[str, bool]:
+        url = _load_url(key) if _connect else None
+        if url:
+            with _known_lock:
+                _stats['index_hits'] += 1
+            _remember(key, url)
+            return url, True
+
+        data = synthesize(text)
+        url = _upload(f"tts/{key}.{EXTENSIONS.get(audio_format, audio_format)}", data, audio_format)
+        if _connect:
+            _save_url(key, url, text, voice, model, audio_format, len(data))
+        with _known_lock:
+            _stats['synthesized'] += 1
+        _remember(key, url)
+        return url, False
+
+    return llm_client.single_flight(f'tts:{key}', create)
+
+def get_stats() -> dict:
+    """Попадания в память и в индекс и сколько озвучек синтезировано инстансом"""
+    with _known_lock:
+        stats = dict(_stats)
+        stats['known_keys'] = len(_known)
+    return stats
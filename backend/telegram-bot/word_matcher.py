@@ -0,0 +1,110 @@
+"""Поиск слов сессии (включая фразы и формы слов) в тексте диалога"""
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+from typing import Any, Dict, List, Set, Tuple
+
+from sentence_pregrader import MAX_PHRASE_GAP, tokenize, word_forms
+
+MAX_MATCHERS = 64             # Сколько скомпилированных наборов слов хранить
+
+_WORD_KEY = itemgetter('id', 'english')
+
+_matchers: 'OrderedDict[Tuple, WordMatcher]' = OrderedDict()
+_matchers_lock = threading.Lock()
+_last_used: Tuple[Any, Any] = (None, None)   # (список слов сессии, его дерево) - оба вызова за ход
+
+class WordMatcher:
+    """
+    Префиксное дерево по леммам слов сессии (узел - dict лемма -> узел, id слов - под ключом None)
+    и таблица форма -> леммы для слов текста
+    """
+
+    def __init__(self, session_words: List[Dict[str, Any]]):
+        self.root: Dict[Any, Any] = {}
+        self.lemmas: Dict[str, Set[str]] = {}
+        anchor_forms: Set[str] = set()
+        for word in session_words:
+            parts = tokenize(word['english'])
+            if not parts:
+                continue
+            node = self.root
+            for part in parts:
+                if part not in node:
+                    for form in word_forms(part):
+                        self.lemmas.setdefault(form, set()).add(part)
+                node = node.setdefault(part, {})
+            node.setdefault(None, []).append(word['id'])
+            # Якорь - самая длинная часть ("cake" в "a piece of cake"): без нее слово не найдется,
+            # а служебные части фраз (a, of, your, with) есть почти в каждой реплике
+            anchor_forms.update(word_forms(max(parts, key=len)))
+        # Формы якорей - быстрая проверка "слов сессии нет", форма первой части -> узлы, откуда начинать спуск
+        self.anchor_forms = frozenset(anchor_forms)
+        self.starts: Dict[str, Tuple[Dict[Any, Any], ...]] = {}
+        for form, lemmas in self.lemmas.items():
+            nodes = tuple(self.root[lemma] for lemma in lemmas if lemma in self.root)
+            if nodes:
+                self.starts[form] = nodes
+
+    def find(self, text: str) -> List[int]:
+        """id слов сессии, встретившихся в тексте (в порядке первого появления)"""
+        tokens = tokenize(text)
+        if self.anchor_forms.isdisjoint(tokens):
+            return []
+
+        found = []
+        starts = self.starts
+        for start, token in enumerate(tokens):
+            nodes = starts.get(token)
+            if nodes is None:
+                continue
+            for node in nodes:
+                # Однословные слова (большинство) - без спуска по дереву
+                word_ids = node.get(None)
+                if word_ids is not None:
+                    for word_id in word_ids:
+                        if word_id not in found:
+                            found.append(word_id)
+                    if len(node) == 1:
+                        continue
+                self._descend(tokens, start, node, found)
+        return found
+
+    def _descend(self, tokens: List[str], position: int, node: Dict[Any, Any], found: List[int]):
+        """Следующая часть фразы - сразу или через несколько слов ("figure it out")"""
+        for next_position in range(position + 1, min(len(tokens), position + 2 + MAX_PHRASE_GAP)):
+            for lemma in self.lemmas.get(tokens[next_position], ()):
+                child = node.get(lemma)
+                if child is None:
+                    continue
+                for word_id in child.get(None, ()):
+                    if word_id not in found:
+                        found.append(word_id)
+                if len(child) > (None in child):
+                    self._descend(tokens, next_position, child, found)
+
+def get_matcher(session_words: List[Dict[str, Any]]) -> WordMatcher:
+    """
+    Скомпилированный набор слов сессии (LRU по id и тексту слов). Тот же список слов,
+    что и в прошлом вызове (сообщение студента, затем ответ Ани), возвращается без поиска по LRU
+    """
+    global _last_used
+    last_words, last_matcher = _last_used
+    if last_words is session_words:
+        return last_matcher
+
+    key = tuple(map(_WORD_KEY, session_words))
+    with _matchers_lock:
+        matcher = _matchers.get(key)
+        if matcher is not None:
+            _matchers.move_to_end(key)
+            _last_used = (session_words, matcher)
+            return matcher
+
+    matcher = WordMatcher(session_words)
+    with _matchers_lock:
+        _matchers[key] = matcher
+        if len(_matchers) > MAX_MATCHERS:
+            _matchers.popitem(last=False)
+    _last_used = (session_words, matcher)
+    return matcher
@@ -0,0 +1,25 @@
+"""Бенчмарк json_repair: python tests/bench_json_repair.py (корпус обрезанных ответов, рост с размером)"""
+import time
+
+import conftest  # noqa: F401 - пути к модулям функций
+import json_repair
+from test_json_repair import CORPUS, plan_response
+
+truncations = 0
+started = time.perf_counter()
+for sample in CORPUS:
+    for cut in range(sample.find('{') + 1, len(sample)):
+        json_repair.parse(sample[:cut])
+        truncations += 1
+elapsed = time.perf_counter() - started
+print(f"truncated corpus: {truncations} responses, {elapsed / truncations * 1e6:.1f} us/response avg")
+
+# Время растет линейно с размером ответа
+for weeks in (4, 40, 400):
+    truncated = plan_response(weeks)[:-37]
+    runs = max(1, 400 // weeks)
+    started = time.perf_counter()
+    for _ in range(runs):
+        data, repairs = json_repair.parse(truncated)
+    per_kb = (time.perf_counter() - started) / runs / (len(truncated) / 1024) * 1e6
+    print(f"plan {weeks:4d} weeks ({len(truncated) // 1024:5d} KB truncated): {per_kb:7.1f} us/KB, {len(data['plan'])} weeks, repairs={repairs}")
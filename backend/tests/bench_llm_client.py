@@ -0,0 +1,34 @@
+"""
+Бенчмарк системного промпта на заменителе Gemini: python tests/bench_llm_client.py
+Заменитель считает токены как len(text) // 4 и "префиллит" 0.01 мс на некэшированный токен
+"""
+import os
+import time
+
+import conftest  # noqa: F401 - пути к модулям функций
+import llm_client
+from gemini_stand_in import StandIn, point_client
+from test_llm_client import BASE_PAYLOAD, STATIC_PROMPT
+
+os.environ.setdefault('GEMINI_API_KEY', 'stand-in')
+stand_in = StandIn()
+point_client(llm_client, stand_in)
+
+fake_turns_payload = {'contents': [
+    {'role': 'user', 'parts': [{'text': STATIC_PROMPT}]},
+    {'role': 'model', 'parts': [{'text': 'Understood! I will follow these instructions.'}]}
+] + BASE_PAYLOAD['contents']}
+
+variants = [
+    ('fake user/model turns (old)', lambda: fake_turns_payload),
+    ('systemInstruction', lambda: llm_client.with_system_prompt(BASE_PAYLOAD, 'stand-in', STATIC_PROMPT)),
+    ('systemInstruction + cache', lambda: llm_client.with_system_prompt(BASE_PAYLOAD, 'stand-in', STATIC_PROMPT, 'Use the word: cat', proxy_url='', label='check')),
+]
+for label, build in variants:
+    started = time.perf_counter()
+    for _ in range(20):
+        llm_client.generate_text('stand-in', build(), '', timeout=5, task=label)
+    stats = llm_client.get_call_stats()[label]
+    fresh = (stats['prompt_tokens'] - stats['cached_tokens']) // stats['calls']
+    print(f"{label:<30} {fresh:6d} uncached prompt tokens/msg   {(time.perf_counter() - started) / 20 * 1000:6.1f} ms/msg")
+stand_in.shutdown()
@@ -0,0 +1,58 @@
+"""
+Бенчмарк mood_detector против старого поиска подстрокой: python tests/bench_mood_detector.py
+
+Итог без прикрас: при текущих ~100 словах сопоставитель НЕ быстрее старого поиска.
+На коротких сообщениях он медленнее (~1.5x), на длинном - в замерах от 0.5x до 1.4x
+времени старого поиска (например 189 против 137 мкс): разбиение на слова и ранги новых
+слов в питоне стоят столько же, сколько ~100 поисков подстроки в C. Выигрыш - в точности
+(целые слова) и в больших наборах из БД
+"""
+import timeit
+
+import conftest  # noqa: F401 - пути к модулям функций
+import mood_detector
+from mood_detector import DEFAULT_MOOD, MOOD_PRIORITY, compile_matcher, detect, merge_keywords
+
+# Старый поиск подстрокой по тем же наборам, что у сопоставителя (основы - без *)
+current = {mood: [word.rstrip('*') for word in words] for mood, words in merge_keywords(include_russian=False).items()}
+
+
+def substring_detect(message: str, keywords=current) -> str:
+    message_lower = message.lower()
+    for mood in MOOD_PRIORITY:
+        if any(word in message_lower for word in keywords[mood]):
+            return mood
+    return DEFAULT_MOOD
+
+
+def cold_detect(message: str) -> str:
+    # Все слова сообщения новые (пустой кэш рангов) - так приходит почти каждое длинное сообщение
+    mood_detector._default_matcher.token_ranks.clear()
+    return detect(message)
+
+
+def per_message_us(fn, batch) -> float:
+    # Лучшее из нескольких повторов (шум машины)
+    return min(timeit.repeat(lambda: [fn(message) for message in batch], number=1, repeat=7)) / len(batch) * 1e6
+
+
+short_messages = ['I want to improve my speaking skills', 'I miss my family so much', 'I loved the movie',
+                  'How do you say "hello" in French?', 'Hi Anya, nice weather'] * 200
+# Длинное сообщение без ключевых слов - худший случай для обоих: просматривается весь текст
+long_message = 'I went to the market and bought some apples, then we walked along the river talking about films. ' * 30
+
+results = {}
+for label, batch in (('short messages', short_messages), ('long message (~3 KB)', [long_message] * 200)):
+    for name, fn in (('substring scan (old)', substring_detect), ('compiled matcher', detect), ('matcher, cold cache', cold_detect)):
+        results[label, name] = per_message_us(fn, batch)
+        print(f"{label:<22} {name:<22} {results[label, name]:7.1f} us/message")
+
+ratio = results['long message (~3 KB)', 'matcher, cold cache'] / results['long message (~3 KB)', 'substring scan (old)']
+print(f"long message, cold cache: compiled matcher takes {ratio:.2f}x the time of the substring scan at {sum(map(len, current.values()))} keywords")
+
+# Наборы из БД могут быть большими: подстроки дорожают с каждым словом, словари - нет
+big_keywords = {mood: words + [f'keyword{i}' for i in range(500)] for mood, words in current.items()}
+big_matcher = compile_matcher(big_keywords)
+for name, fn in (('substring scan (old)', lambda m: substring_detect(m, big_keywords)),
+                 ('compiled matcher', lambda m: detect(m, big_matcher))):
+    print(f"{'1600 keywords, 3 KB':<22} {name:<22} {per_message_us(fn, [long_message] * 50):7.1f} us/message")
@@ -0,0 +1,58 @@
+"""
+Бенчмарк сборки запроса диалога (время и выделенная память): python tests/bench_prompt_templates.py
+Нужны зависимости бота, БД не нужна
+"""
+import os
+import time
+import tracemalloc
+
+import conftest  # noqa: F401 - пути к модулям функций
+
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/bench')
+os.environ.setdefault('GEMINI_API_KEY', 'bench')
+import index
+import prompt_templates
+
+# Промпты и слова настроений из БД подменяем встроенными fallback наборами
+for code in ('empathetic_mode', 'error_correction_rules'):
+    index._cache[f'prompt_{code}'] = ''
+    index._cache_ttl[f'prompt_{code}'] = time.time() + 10 ** 9
+index._cache['emotion_matcher'] = index.mood_detector.compile_matcher(index.mood_detector.merge_keywords())
+index._cache_ttl['emotion_matcher'] = time.time() + 10 ** 9
+
+words = [{'id': i, 'english': f'word{i}', 'russian': f'слово{i}'} for i in range(10)]
+topics = [{'emoji': '🎬', 'topic': 'Movies'}, {'emoji': '✈️', 'topic': 'Travel'}]
+history = [{'role': 'user' if i % 2 else 'assistant', 'content': f'message {i}'} for i in range(20)]
+args = ('I go to shop yesterday', history, words, 'B1', topics, [], None, 'standard')
+
+
+def measure(label: str, cold: bool, runs: int = 2000, **kwargs):
+    index.build_gemini_payload(*args, **kwargs)
+    started = time.perf_counter()
+    for _ in range(runs):
+        if cold:
+            prompt_templates.clear()
+        index.build_gemini_payload(*args, **kwargs)
+    per_call_us = (time.perf_counter() - started) / runs * 1e6
+
+    tracemalloc.start()
+    if cold:
+        prompt_templates.clear()
+    base, _ = tracemalloc.get_traced_memory()
+    index.build_gemini_payload(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<40} {per_call_us:8.1f} us/call   {peak - base:8d} bytes peak")
+    return per_call_us, peak - base
+
+
+index.print = lambda *a, **k: None  # отладочные print в build_gemini_payload мешают замерам
+# Кэш контекста Gemini "уже создан": запрос ссылается на него, а не несет скелет
+index.llm_client.get_context_cache = lambda *a, **k: 'cachedContents/bench'
+
+# По времени выигрыш небольшой (скелет - несколько мкс из всей сборки запроса). Главное - скелет
+# без слотов всегда уходит в кэш контекста и не копируется в запрос
+rebuilt = measure('skeleton rebuilt every call', cold=True)
+measure('compiled skeleton, no context cache', cold=False)
+cached = measure('compiled skeleton + context cache', cold=False, proxy_url='bench-proxy')
+assert cached[1] < rebuilt[1] / 2, (cached, rebuilt)
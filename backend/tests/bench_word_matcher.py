@@ -0,0 +1,34 @@
+"""Бенчмарк word_matcher против старого поиска по множеству слов: python tests/bench_word_matcher.py"""
+import re
+import timeit
+from typing import Any, Dict, List
+
+import conftest  # noqa: F401 - пути к модулям функций
+from test_word_matcher import SESSION
+from word_matcher import WordMatcher, get_matcher
+
+
+def legacy_detect(text: str, session_words: List[Dict[str, Any]]) -> List[int]:
+    words_in_text = set(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+    return [word['id'] for word in session_words if word['english'].lower() in words_in_text]
+
+
+texts_with_words = ['I travelled to Spain last year', "I can't figure it out", 'How do you deal with stress?',
+                    'The children went to school', 'We missed the deadline again', 'The exam was a piece of cake']
+# Обычная реплика диалога слов сессии не содержит - для нее работает одна проверка якорей (isdisjoint)
+dialog_turns = ["That's great! What did you do on the weekend?", 'I watched a film with my friends',
+                'Tell me more about your hobbies, please!', 'My favourite season is autumn because it is cozy']
+
+for label, texts in (('texts with session words', texts_with_words), ('ordinary dialog turns', dialog_turns)):
+    timings = {}
+    for name, fn, number in (('legacy set lookup', lambda t: legacy_detect(t, SESSION), 2000),
+                             ('compile every call', lambda t: WordMatcher(SESSION).find(t), 50),
+                             ('cached matcher', lambda t: get_matcher(SESSION).find(t), 2000)):
+        # Лучшее из нескольких повторов (шум машины)
+        best = min(timeit.repeat(lambda: [fn(text) for text in texts], number=number, repeat=7))
+        timings[name] = best / number / len(texts) * 1e6
+        print(f"{label:<26} {name:<20} {timings[name]:6.1f} us/call")
+    # Реплика без слов сессии - не дороже старого поиска. С найденными словами поиск делает
+    # больше старого (фразы, формы слов) - допускаем до 20% сверху
+    allowed = 1.0 if label == 'ordinary dialog turns' else 1.2
+    assert timings['cached matcher'] <= timings['legacy set lookup'] * allowed, timings
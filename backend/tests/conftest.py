@@ -0,0 +1,6 @@
+"""Общие модули функций лежат в папках функций - тесты импортируют копии из telegram-bot"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'telegram-bot'))
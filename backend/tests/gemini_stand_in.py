@@ -0,0 +1,89 @@
+"""Локальный заменитель Gemini для тестов и бенчмарков llm_client (сеть и ключ не нужны)"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+
+def tokens(text: str) -> int:
+    """Токены заменителя - len(text) // 4"""
+    return len(text) // 4
+
+
+class StandIn:
+    """
+    Сервер generateContent и cachedContents. Префилл - PREFILL_SECONDS на некэшированный токен,
+    delay - задержка перед каждым ответом (медленный прокси)
+    """
+
+    PREFILL_SECONDS = 0.00001
+
+    def __init__(self, delay: float = 0.0):
+        self.caches: Dict[str, str] = {}
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: Dict[str, Any]):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._reply(200, {'name': 'models/stand-in'})
+
+            def do_POST(self):
+                time.sleep(delay)
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path.startswith('/cachedContents'):
+                    name = f'cachedContents/stub{len(stand_in.caches)}'
+                    stand_in.caches[name] = body['systemInstruction']['parts'][0]['text']
+                    return self._reply(200, {'name': name, 'model': body['model']})
+
+                if 'cachedContent' in body and 'systemInstruction' in body:
+                    return self._reply(400, {'error': 'systemInstruction is not allowed with cachedContent'})
+                cached_text = ''
+                if 'cachedContent' in body:
+                    if body['cachedContent'] not in stand_in.caches:
+                        return self._reply(404, {'error': 'cachedContent not found'})
+                    cached_text = stand_in.caches[body['cachedContent']]
+                system_text = ''.join(part['text'] for part in body.get('systemInstruction', {}).get('parts', []))
+                contents_text = ''.join(part['text'] for turn in body['contents'] for part in turn['parts'])
+
+                fresh_tokens = tokens(system_text) + tokens(contents_text)
+                time.sleep(fresh_tokens * stand_in.PREFILL_SECONDS)
+                self._reply(200, {
+                    'candidates': [{'content': {'parts': [{'text': 'ok'}]}}],
+                    'usageMetadata': {
+                        'promptTokenCount': fresh_tokens + tokens(cached_text),
+                        'cachedContentTokenCount': tokens(cached_text)
+                    }
+                })
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def address(self) -> str:
+        """host:port - как proxy_url для llm_client"""
+        return f'127.0.0.1:{self.server.server_address[1]}'
+
+    @property
+    def api_root(self) -> str:
+        return f'http://{self.address}'
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def point_client(llm_client, stand_in: StandIn):
+    """Направляет вызовы llm_client на заменитель (без прокси: proxy_url='')"""
+    llm_client.GEMINI_API_ROOT = stand_in.api_root
+    llm_client.GEMINI_BASE_URL = f'{stand_in.api_root}/models'
@@ -0,0 +1,54 @@
+"""json_repair: валидные ответы не меняются, обрезанные в любой точке - разбираются"""
+import json
+
+import pytest
+
+import json_repair
+
+
+def plan_response(weeks: int) -> str:
+    plan = [{
+        'week': week,
+        'vocabulary': [{'english': f'deadline {week}-{i}', 'russian': f'крайний срок {{{i}}}'} for i in range(5)],
+        'phrases': [{'english': 'figure out', 'russian': 'разобраться, "понять"'}],
+        'expressions': [{'english': 'a piece of cake', 'russian': 'проще простого\nочень легко'}]
+    } for week in range(1, weeks + 1)]
+    return json.dumps({'plan': plan}, ensure_ascii=False, indent=2)
+
+
+# Ответы в форматах промптов бота (план, проверка предложения, слова, цели)
+CORPUS = [
+    '```json\n' + plan_response(2) + '\n```',
+    json.dumps({'is_correct': False, 'has_word': True, 'grammar_ok': False,
+                'feedback': "Ошибка: 'I has' неправильно. С 'I' используется 'have' {не has}",
+                'corrected': 'I have a voice'}, ensure_ascii=False),
+    'Here is the result:\n' + json.dumps({'words': [{'english': w, 'russian': 'перевод [' + w + ']'}
+                                                    for w in ('delay', 'boarding', 'customs', 'exchange rate')]}, ensure_ascii=False),
+    json.dumps({'goals': ['Сдать IELTS на 7.0', 'Переехать в Канаду\\Торонто', 'Говорить "свободно"']}, ensure_ascii=False),
+]
+
+
+@pytest.mark.parametrize('sample', CORPUS)
+def test_valid_response_is_unchanged(sample):
+    body = sample[sample.find('{'):sample.rfind('}') + 1]
+    data, _ = json_repair.parse(sample)
+    assert data == json.loads(body)
+
+
+@pytest.mark.parametrize('sample', CORPUS)
+def test_every_truncation_parses(sample):
+    # Ответ обрывается по maxOutputTokens в любой точке
+    for cut in range(sample.find('{') + 1, len(sample)):
+        data, _ = json_repair.parse(sample[:cut])
+        assert isinstance(data, (dict, list))
+
+
+def test_brackets_and_newlines_inside_strings_are_kept():
+    data, repairs = json_repair.parse('{"feedback": "Скобки } и ] внутри строки\nне считаются", "corrected": "I have a vo')
+    assert data == {'feedback': 'Скобки } и ] внутри строки\nне считаются', 'corrected': 'I have a vo'}
+    assert repairs
+
+
+def test_truncated_plan_keeps_complete_weeks():
+    data, _ = json_repair.parse(plan_response(4)[:-37])
+    assert [week['week'] for week in data['plan']] == [1, 2, 3, 4]
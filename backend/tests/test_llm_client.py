@@ -0,0 +1,157 @@
+"""llm_client на локальном заменителе Gemini: кэш контекста, single-flight, хеджирование"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+import pytest
+
+import llm_client
+from gemini_stand_in import StandIn, point_client
+
+STATIC_PROMPT = 'You are Anya, a friendly English tutor. ' * 400
+BASE_PAYLOAD = {'contents': [{'role': 'user', 'parts': [{'text': f'message {i}'}]} for i in range(15)]
+                + [{'role': 'user', 'parts': [{'text': 'Hello!'}]}]}
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    monkeypatch.setenv('GEMINI_API_KEY', 'stand-in')
+    stand_in = StandIn()
+    point_client(llm_client, stand_in)
+    llm_client._context_caches.clear()
+    llm_client._context_cache_sources.clear()
+    llm_client._context_cache_failed.clear()
+    yield stand_in
+    llm_client.set_context_cache_store(None, None)
+    llm_client.set_route_loader(None)
+    llm_client.set_timeout_limiter(None)
+    stand_in.shutdown()
+
+
+def test_context_cache_removes_prompt_from_request(gemini):
+    for label, build in (('inline', lambda: llm_client.with_system_prompt(BASE_PAYLOAD, 'stand-in', STATIC_PROMPT)),
+                         ('cached', lambda: llm_client.with_system_prompt(BASE_PAYLOAD, 'stand-in', STATIC_PROMPT, 'Use the word: cat', proxy_url='', label='check'))):
+        for _ in range(3):
+            assert llm_client.generate_text('stand-in', build(), '', timeout=5, task=f'test_{label}') == 'ok'
+    stats = llm_client.get_call_stats()
+    assert stats['test_cached']['cached_tokens'] > 0
+    uncached = {label: (stats[f'test_{label}']['prompt_tokens'] - stats[f'test_{label}']['cached_tokens']) // stats[f'test_{label}']['calls']
+                for label in ('inline', 'cached')}
+    assert uncached['cached'] < uncached['inline'] / 10, uncached
+
+
+def test_second_instance_reuses_shared_context_cache(gemini):
+    shared_store: Dict[str, Tuple[str, str, float]] = {}
+    llm_client.set_context_cache_store(lambda h: shared_store[h][1:] if h in shared_store else None,
+                                       lambda h, m, name, expires_at: shared_store.__setitem__(h, (m, name, expires_at)))
+    shared_hits = llm_client.get_context_cache_stats()['shared_hits']
+    llm_client.with_system_prompt(BASE_PAYLOAD, 'stand-in', STATIC_PROMPT, proxy_url='', label='shared')
+    created = len(gemini.caches)
+
+    llm_client._context_caches.clear()   # "другой инстанс": своей памяти нет
+    second = llm_client.with_system_prompt(BASE_PAYLOAD, 'stand-in', STATIC_PROMPT, proxy_url='', label='shared')
+    assert len(gemini.caches) == created
+    assert second['cachedContent'] in gemini.caches
+    assert llm_client.get_context_cache_stats()['shared_hits'] == shared_hits + 1
+
+    # Кэш удален на стороне Gemini раньше срока - запрос уходит без кэша, общая запись помечается истекшей
+    prompt_hash = llm_client.context_cache_hash('stand-in', STATIC_PROMPT)
+    gemini.caches.clear()
+    assert llm_client.generate_text('stand-in', second, '', timeout=5, task='stale') == 'ok'
+    assert shared_store[prompt_hash][2] == 0
+    fresh = llm_client.with_system_prompt(BASE_PAYLOAD, 'stand-in', STATIC_PROMPT, proxy_url='', label='shared')
+    assert fresh['cachedContent'] in gemini.caches
+    assert shared_store[prompt_hash][1] == fresh['cachedContent']
+
+
+def test_single_flight_coalesces_burst():
+    upstream_calls: Dict[str, int] = {}
+
+    def slow_upstream(word: str) -> str:
+        upstream_calls[word] = upstream_calls.get(word, 0) + 1
+        time.sleep(0.2)
+        return f'/{word}/'
+
+    burst = ['deadline', 'Deadline ', 'figure out', 'deadline', 'FIGURE OUT'] * 10
+    with ThreadPoolExecutor(max_workers=len(burst)) as pool:
+        results = list(pool.map(lambda w: llm_client.single_flight(f'ipa:{w.strip().lower()}', lambda: slow_upstream(w.strip().lower())), burst))
+    assert upstream_calls == {'deadline': 1, 'figure out': 1}
+    assert results[1] == '/deadline/' and results[4] == '/figure out/'
+
+
+def test_single_flight_waiter_retries_after_caller_local_error():
+    class LeaderOutOfTime(TimeoutError):
+        caller_local = True
+
+    def leader_out_of_time():
+        time.sleep(0.1)
+        raise LeaderOutOfTime('leader budget exhausted')
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader_future = pool.submit(llm_client.single_flight, 'ipa:budget', leader_out_of_time)
+        time.sleep(0.02)
+        waiter_future = pool.submit(llm_client.single_flight, 'ipa:budget', lambda: '/ˈbʌdʒɪt/')
+        assert waiter_future.result() == '/ˈbʌdʒɪt/'
+        assert isinstance(leader_future.exception(), LeaderOutOfTime)
+
+
+@pytest.fixture
+def slow_proxies():
+    proxies = [StandIn(delay=3) for _ in range(2)]
+    yield [proxy.address for proxy in proxies]
+    for proxy in proxies:
+        proxy.shutdown()
+
+
+def test_hedge_backup_wins_when_primary_is_slow(gemini, slow_proxies):
+    # Маршрут задачи (12 с) применяется один раз, ограничитель режет его до 1.5 с
+    llm_client.set_route_loader(lambda: [{'task': 'hedged', 'model': None, 'max_output_tokens': None, 'timeout_seconds': 12}])
+    llm_client.set_timeout_limiter(lambda timeout: min(timeout, 1.5))
+    started = time.perf_counter()
+    assert llm_client.generate_text_hedged('stand-in', BASE_PAYLOAD, ('slow', slow_proxies[0]), ('fast', gemini.address), timeout=30, task='hedged') == ('ok', 'fast')
+    assert time.perf_counter() - started < 1.5
+
+
+def test_hedge_times_out_within_limited_route_timeout(gemini, slow_proxies):
+    llm_client.set_route_loader(lambda: [{'task': 'hedged', 'model': None, 'max_output_tokens': None, 'timeout_seconds': 12}])
+    llm_client.set_timeout_limiter(lambda timeout: min(timeout, 1.5))
+    started = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        llm_client.generate_text_hedged('stand-in', BASE_PAYLOAD, ('slow', slow_proxies[0]), ('slow 2', slow_proxies[1]), timeout=30, task='hedged')
+    assert time.perf_counter() - started < 2
+
+
+def test_hedge_fails_over_when_primary_errors(gemini):
+    others = []
+    failovers = llm_client.get_hedge_stats()['failovers']
+    # Порт без сервера - отказ в соединении, как у мертвого прокси
+    dead = StandIn()
+    dead_address = dead.address
+    dead.shutdown()
+    text, tag = llm_client.generate_text_hedged('stand-in', BASE_PAYLOAD, ('dead', dead_address), ('alive', gemini.address), timeout=5, task='failover',
+                                                on_other_result=lambda *result: others.append(result))
+    assert (text, tag) == ('ok', 'alive')
+    assert llm_client.get_hedge_stats()['failovers'] == failovers + 1
+    time.sleep(0.05)
+    assert others and others[0][0] == 'dead' and others[0][1] is False
+
+
+def test_telemetry_user_hash_needs_salt(monkeypatch):
+    monkeypatch.setattr(llm_client, 'TELEMETRY_SALT', None)
+    llm_client.set_telemetry_user(42)
+    assert llm_client._local.user_hash is None
+    monkeypatch.setattr(llm_client, 'TELEMETRY_SALT', 'secret')
+    llm_client.set_telemetry_user(42)
+    assert llm_client._local.user_hash and '42' not in llm_client._local.user_hash
+    llm_client.set_telemetry_user(None)
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('ˈfæməli', '/ˈfæməli/'),
+    ('`/ɡɪv ʌp/`', '/ɡɪv ʌp/'),
+    ('/kæt/\nThe word "cat" is pronounced...', '/kæt/'),
+    ('', ''),
+    ('x' * 101, ''),
+])
+def test_clean_transcription(raw, expected):
+    assert llm_client.clean_transcription(raw) == expected
@@ -0,0 +1,67 @@
+"""mood_detector: настроение сообщения по целым словам"""
+import pytest
+
+import mood_detector
+
+
+@pytest.mark.parametrize('message, expected', [
+    # Ложные срабатывания подстрок в старой версии
+    ('I want to improve my speaking skills', 'casual'),
+    ('My uncle is an ambassador', 'casual'),
+    ('Our mission is to build a rocket', 'casual'),
+    ('Can you show me a picture?', 'casual'),
+    ('I watched a show about whales', 'casual'),
+    ('The meaning of life is 42', 'casual'),
+    ('Somewhere over the rainbow', 'casual'),
+    ('I like my grandmother', 'casual'),
+    ('I bought a new hat and some paint', 'casual'),
+    ('The saddle was too small', 'casual'),
+    ('It was a critical moment', 'casual'),
+    # Настоящие совпадения и формы слов
+    ('I lost my job yesterday', 'empathetic'),
+    ('I miss my family so much', 'empathetic'),
+    ('I am missing my mom', 'empathetic'),
+    ('My dog hurts', 'empathetic'),
+    ('I really hated that day', 'empathetic'),
+    ('I feel sadness', 'empathetic'),
+    ('I am struggling with phrasal verbs', 'empathetic'),
+    ('She cried all night', 'empathetic'),
+    ("I'm having a hard  time with grammar", 'empathetic'),
+    ('I love it but I feel sad', 'empathetic'),
+    ('I loved the movie', 'enthusiastic'),
+    ('It was so exciting', 'enthusiastic'),
+    ('I am so happy today!', 'enthusiastic'),
+    ('That was AMAZING', 'enthusiastic'),
+    ('I am learning English', 'educational'),
+    ('How do you say "hello" in French?', 'educational'),
+    ('What does "bite the bullet" mean?', 'educational'),
+    ('Hi Anya, nice weather', 'casual'),
+])
+def test_detect(message, expected):
+    assert mood_detector.detect(message) == expected
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('Мне сегодня очень грустно', 'empathetic'),
+    ('Я так рада, сдала экзамен!', 'enthusiastic'),
+    ('Объясни, пожалуйста, артикли', 'educational'),
+    ('Что означает этот идиом?', 'educational'),
+    ('Как дела?', 'casual'),
+    ('Привет! Что нового?', 'casual'),
+    ('Где ты была вчера и когда вернешься?', 'casual'),
+    ('Показать картинку', 'casual'),
+])
+def test_detect_russian_when_enabled(message, expected):
+    matcher = mood_detector.compile_matcher(mood_detector.merge_keywords(include_russian=True))
+    assert mood_detector.detect(message, matcher) == expected
+
+
+def test_russian_keywords_off_by_default():
+    matcher = mood_detector.compile_matcher(mood_detector.merge_keywords(include_russian=False))
+    assert mood_detector.detect('Мне сегодня очень грустно', matcher) == 'casual'
+
+
+def test_db_rows_replace_builtin_mood_set():
+    custom = mood_detector.compile_matcher(mood_detector.merge_keywords([{'mood': 'enthusiastic', 'language': 'en', 'keyword': 'yay'}]))
+    assert mood_detector.detect('yay!', custom) == 'enthusiastic'
+    assert mood_detector.detect('I am happy', custom) == 'casual'
@@ -0,0 +1,38 @@
+"""multipart_stream: потоковое тело совпадает с тем, что собирает requests из files="""
+import io
+
+import pytest
+import requests
+
+from multipart_stream import MultipartStream
+
+AUDIO = bytes(range(256)) * 1000
+FIELDS = {'model': 'whisper-1', 'language': 'en'}
+
+
+@pytest.mark.parametrize('size', [len(AUDIO), None])
+def test_body_matches_requests_files(size):
+    body = MultipartStream(FIELDS, 'file', 'voice.ogg', io.BytesIO(AUDIO), size, 'audio/ogg')
+    expected = requests.Request('POST', 'http://example.invalid/', data=FIELDS,
+                                files={'file': ('voice.ogg', AUDIO, 'audio/ogg')}).prepare()
+    expected_body = expected.body.replace(expected.headers['Content-Type'].split('=')[1].encode(), body.boundary.encode())
+
+    streamed = requests.Request('POST', 'http://example.invalid/', data=body,
+                                headers={'Content-Type': body.content_type}).prepare()
+    assert streamed.headers['Content-Length'] == str(len(expected_body))
+    assert 'Transfer-Encoding' not in streamed.headers
+
+    chunks = []
+    while True:
+        chunk = body.read(8192)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    assert b''.join(chunks) == expected_body
+
+
+def test_truncated_stream_is_detected():
+    short = MultipartStream(FIELDS, 'file', 'voice.ogg', io.BytesIO(AUDIO[:100]), len(AUDIO), 'audio/ogg')
+    with pytest.raises(IOError):
+        while short.read(8192):
+            pass
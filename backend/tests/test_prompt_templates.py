@@ -0,0 +1,41 @@
+"""prompt_templates и скелеты системного промпта диалога"""
+import os
+
+import pytest
+
+import prompt_templates
+
+
+def test_render_fills_slots():
+    compiled = prompt_templates.compile_template(f"Hi {prompt_templates.slot('name')}, learn {prompt_templates.slot('word')}!")
+    assert prompt_templates.render(compiled, {'name': 'Anna', 'word': 'deadline'}) == 'Hi Anna, learn deadline!'
+    assert prompt_templates.render(compiled) == 'Hi , learn !'
+
+
+def test_get_compiled_builds_once_per_key():
+    prompt_templates.clear()
+    calls = []
+
+    def build():
+        calls.append(1)
+        return 'static text'
+
+    assert prompt_templates.get_compiled(('test', 1), build) == ('static text',)
+    assert prompt_templates.get_compiled(('test', 1), build) == ('static text',)
+    assert len(calls) == 1
+
+
+@pytest.fixture(scope='module')
+def index():
+    os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/tests')
+    os.environ.setdefault('GEMINI_API_KEY', 'tests')
+    import index
+    return index
+
+
+@pytest.mark.parametrize('learning_mode', ['standard', 'specific_topic', 'urgent_task'])
+@pytest.mark.parametrize('emotional_mode', ['casual', 'empathetic', 'enthusiastic', 'educational'])
+def test_dialog_skeleton_has_no_slots(index, learning_mode, emotional_mode):
+    # Скелет одинаков для всех студентов - только тогда он целиком уходит в кэш контекста Gemini
+    source = index._dialog_skeleton_source('', '', emotional_mode, 'B1', learning_mode)
+    assert prompt_templates.SLOT_MARK not in source
@@ -0,0 +1,91 @@
+"""Предпроверка "Составь предложение": ответы студентов, которые отсекаются локально и которые уходят в Gemini"""
+import pytest
+
+import sentence_pregrader
+
+
+@pytest.fixture(autouse=True)
+def clean_memory():
+    sentence_pregrader._remembered.clear()
+    yield
+    sentence_pregrader._remembered.clear()
+
+
+# (предложение студента, целевое слово) - должны уйти в Gemini (pregrade -> None)
+SENT_TO_GEMINI = [
+    ('I have a cat at home', 'cat'),
+    ('My cats sleep all day', 'cat'),
+    ('Yesterday I studied for three hours', 'study'),
+    ('We went to the park on Sunday', 'go'),
+    ('She is giving up smoking', 'give up'),
+    ('Please turn the music down', 'turn down'),
+    ('I bought two knives for the kitchen', 'knife'),
+    ('My children like to play football', 'child'),
+    ('This is the best day of my life', 'good'),
+    ('He is running very fast', 'run'),
+    ('The teacher read our analyses of the text', 'analysis'),
+    ('There are three criteria for the project', 'criterion'),
+    ('I panicked before the exam', 'panic'),
+    ('We picnicked near the river last summer', 'picnic'),
+    ('I eat icecream every weekend', 'ice-cream'),
+    ('My favourite ice cream is vanilla', 'ice-cream'),
+    ('Our teacher explained the phenomena clearly', 'phenomenon'),
+    ('I am so happily married', 'happy'),
+    ("Don't forget your umbrella", 'umbrella'),
+]
+
+# (предложение, целевое слово, причина отказа)
+REJECTED = [
+    ('Я люблю кошек', 'cat', 'script'),
+    ('ok', 'cat', 'too_short'),
+    ('cat', 'cat', 'too_short'),
+    ('give up', 'give up', 'too_short'),
+    ('cat cat cat cat cat cat', 'cat', 'repetition'),
+    ('I like my dog very much', 'cat', 'no_target'),
+    ('She reads a book every evening', 'newspaper', 'no_target'),
+    ('We visited grandma on Sunday', 'go', 'no_target'),
+    ('I gave him my phone', 'give up', 'no_target'),
+]
+
+
+@pytest.mark.parametrize('sentence, target', SENT_TO_GEMINI)
+def test_plausible_sentences_go_to_gemini(sentence, target):
+    assert sentence_pregrader.pregrade(sentence, target, 'B1') is None
+
+
+@pytest.mark.parametrize('sentence, target, reason', REJECTED)
+def test_obvious_failures_rejected_locally(sentence, target, reason):
+    verdict = sentence_pregrader.pregrade(sentence, target, 'A2')
+    assert verdict is not None
+    assert verdict['is_correct'] is False
+    assert verdict['pregrade_reason'] == reason
+    assert verdict['feedback']
+
+
+def test_no_target_feedback_names_the_word():
+    verdict = sentence_pregrader.pregrade('I like my dog very much', 'cat', 'A1')
+    assert verdict['has_word'] is False
+    assert '"cat"' in verdict['feedback']
+
+
+def test_remembered_verdict_is_reused():
+    sentence, target = 'I have a cat at home', 'cat'
+    assert sentence_pregrader.pregrade(sentence, target, 'A1') is None
+    sentence_pregrader.remember(sentence, target, 'A1', {'is_correct': True, 'feedback': 'Great!'})
+    assert sentence_pregrader.pregrade('i have a CAT at home!', target, 'A1')['is_correct'] is True
+    assert sentence_pregrader.pregrade(sentence, target, 'B2') is None
+
+
+@pytest.mark.parametrize('word, form', [
+    ('study', 'studied'), ('stop', 'stopped'), ('make', 'making'),
+    ('leaf', 'leaves'), ('lie', 'lying'), ('big', 'bigger'),
+])
+def test_word_forms(word, form):
+    assert form in sentence_pregrader.word_forms(word)
+
+
+def test_phrase_parts_may_be_split():
+    tokens = sentence_pregrader.tokenize('Please give it up now')
+    assert sentence_pregrader.contains_target(tokens, 'give up')
+    tokens = sentence_pregrader.tokenize('Give me the book and look up')
+    assert not sentence_pregrader.contains_target(tokens, 'give up')
@@ -0,0 +1,21 @@
+"""Общие модули копируются в папку каждой функции (деплой из папки) - копии не должны расходиться"""
+import filecmp
+import os
+
+import pytest
+
+from conftest import BACKEND_DIR
+
+SHARED = [
+    ('llm_client.py', ['telegram-bot', 'webapp-api', 'practice-scheduler']),
+    ('json_repair.py', ['telegram-bot', 'webapp-api', 'practice-scheduler']),
+    ('tts_cache.py', ['telegram-bot', 'webapp-api']),
+    ('proxy_health.py', ['telegram-bot', 'webapp-api']),
+]
+
+
+@pytest.mark.parametrize('name, functions', SHARED)
+def test_copies_are_identical(name, functions):
+    first = os.path.join(BACKEND_DIR, functions[0], name)
+    for function in functions[1:]:
+        assert filecmp.cmp(first, os.path.join(BACKEND_DIR, function, name), shallow=False), f'{function}/{name} differs from {functions[0]}'
@@ -0,0 +1,33 @@
+"""word_matcher: слова сессии в репликах студента - целые слова, формы и фразы"""
+import pytest
+
+import word_matcher
+
+SESSION = [{'id': i, 'english': english} for i, english in enumerate([
+    'travel', 'figure out', 'deal with', 'study', 'make up your mind', 'child', 'go',
+    'deadline', 'get along', 'a piece of cake'
+])]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('I travelled to Spain last year', [0]),
+    ("I can't figure it out", [1]),
+    ('She is figuring out the answer', [1]),
+    ('How do you deal with stress?', [2]),
+    ('I studied all night, studies are hard', [3]),
+    ('I finally made up my mind', []),          # my вместо your - фраза не та
+    ('Make up your mind!', [4]),
+    ('The children went to school', [5, 6]),
+    ('We missed the deadline again', [7]),
+    ('We get along well', [8]),
+    ('The exam was a piece of cake', [9]),
+    ('I figured that we should deal', []),      # части фраз без второй части не считаются
+    ('Traveling is fun', [0]),
+    ('Hi Anya, nice weather today', []),
+])
+def test_find(text, expected):
+    assert word_matcher.get_matcher(SESSION).find(text) == expected
+
+
+def test_matcher_is_cached_per_session():
+    assert word_matcher.get_matcher(list(SESSION)) is word_matcher.get_matcher(SESSION)
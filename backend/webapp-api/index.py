@@ -2,10 +2,55 @@ import json
 import os
 import psycopg2
 import requests
-import boto3
+import time
 from typing import Dict, Any, List
 
+import llm_client
+import proxy_health
+import tts_cache
+
 SCHEMA = 't_p86463701_eloquent_school_site'
+SPEECHKIT_VOICE = 'alena'       # Голос озвучки - входит в ключ общего кэша озвучек (tts_cache)
+LLM_METRICS_MAX_HOURS = 24 * 30   # Окно get_llm_metrics - не больше 30 дней (секции llm_calls старше удаляются)
+PROXY_LIST_TTL = 60               # Список активных прокси перечитывается раз в минуту
+
+# Кеш активных прокси инстанса: [(id, url)] и url -> id для учета исходов вызовов
+_proxy_list: Dict[str, Any] = {'proxies': [], 'ids': {}, 'loaded_at': 0.0}
+
+# Схемы ответов Gemini (structured output, см. llm_client.generate_json)
+GOAL_ANALYSIS_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'goal': {'type': 'STRING'},
+        'timeline': {'type': 'STRING', 'nullable': True}
+    },
+    'required': ['goal', 'timeline']
+}
+
+LEVEL_CHECK_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'actual_level': {'type': 'STRING', 'enum': ['A1', 'A2', 'B1', 'B2', 'C1']},
+        'is_correct': {'type': 'BOOLEAN'},
+        'reasoning': {'type': 'STRING'}
+    },
+    'required': ['actual_level', 'is_correct', 'reasoning']
+}
+
+WORDS_RESPONSE = {
+    'type': 'OBJECT',
+    'properties': {
+        'words': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {'english': {'type': 'STRING'}, 'russian': {'type': 'STRING'}},
+                'required': ['english', 'russian']
+            }
+        }
+    },
+    'required': ['words']
+}
 
 def get_db_connection():
     """Создает подключение к БД"""
@@ -13,32 +58,97 @@ def get_db_connection():
     conn.autocommit = True
     return conn
 
+def load_llm_routes() -> List[Dict[str, Any]]:
+    """Маршруты задач LLM из админки (модель, лимит токенов, таймаут) - llm_client перечитывает их раз в 5 минут"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT task, model, max_output_tokens, timeout_seconds FROM {SCHEMA}.llm_task_routes "
+        f"WHERE is_active = TRUE"
+    )
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return [{'task': r[0], 'model': r[1], 'max_output_tokens': r[2], 'timeout_seconds': r[3]} for r in rows]
+
+llm_client.set_route_loader(load_llm_routes)
+tts_cache.configure(get_db_connection, SCHEMA)
+
+def load_active_proxies() -> List[tuple]:
+    """Активные прокси (id, url); заодно сбрасывает статистику прокси и сводит их оценки с другими инстансами"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        proxy_health.flush_stats(cur, SCHEMA)
+    except Exception as e:
+        print(f"[WARNING] Failed to flush proxy stats: {e}")
+    
+    cur.execute(
+        f"SELECT id, host, port, username, password "
+        f"FROM {SCHEMA}.proxies WHERE is_active = TRUE"
+    )
+    
+    proxies = []
+    for row in cur.fetchall():
+        proxy_id, host, port, username, password = row
+        if username and password:
+            proxy_url = f"{username}:{password}@{host}:{port}"
+        else:
+            proxy_url = f"{host}:{port}"
+        proxies.append((proxy_id, proxy_url))
+    
+    try:
+        proxy_health.sync_with_db(cur, SCHEMA)
+    except Exception as e:
+        print(f"[WARNING] Failed to sync proxy health: {e}")
+    
+    cur.close()
+    conn.close()
+    return proxies
+
 def get_active_proxy_from_db() -> str:
-    """Получает случайный активный прокси из БД"""
+    """Выбирает самый "здоровый" из активных прокси (proxy_health.choose, как в боте) - список кешируется на минуту"""
+    now = time.time()
+    if now - _proxy_list['loaded_at'] >= PROXY_LIST_TTL:
+        # Ошибку тоже не повторяем до конца TTL - остается прежний список
+        _proxy_list['loaded_at'] = now
+        try:
+            proxies = load_active_proxies()
+            _proxy_list['proxies'] = proxies
+            _proxy_list['ids'] = {proxy_url: proxy_id for proxy_id, proxy_url in proxies}
+        except Exception as e:
+            print(f"[ERROR] Failed to get proxy from DB: {e}")
+    
+    _, proxy_url = proxy_health.choose(_proxy_list['proxies'])
+    
+    # Fallback на env если нет прокси в БД
+    return proxy_url or os.environ.get('PROXY_URL', '')
+
+def record_proxy_call(task: str, proxy_url: str, ok: bool, elapsed_ms: float, outcome: str):
+    """Исход вызова llm_client - в оценку здоровья прокси (probe breaker учитывает сам)"""
+    proxy_id = _proxy_list['ids'].get(proxy_url)
+    if not proxy_id or task == 'probe':
+        return
+    proxy_health.record(proxy_id, ok, elapsed_ms, None if ok else outcome)
+
+def flush_proxy_stats():
+    """Сбрасывает накопленную статистику прокси в БД одним запросом"""
+    if not proxy_health.has_pending_stats():
+        return
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        
-        cur.execute(
-            f"SELECT host, port, username, password FROM {SCHEMA}.proxies WHERE is_active = TRUE ORDER BY RANDOM() LIMIT 1"
-        )
-        row = cur.fetchone()
-        
+        flushed = proxy_health.flush_stats(cur, SCHEMA)
         cur.close()
         conn.close()
-        
-        if row:
-            host, port, username, password = row
-            if username and password:
-                return f"{username}:{password}@{host}:{port}"
-            else:
-                return f"{host}:{port}"
-        
-        # Fallback на env если нет прокси в БД
-        return os.environ.get('PROXY_URL', '')
+        if flushed:
+            print(f"[DEBUG] Flushed stats for {flushed} proxies")
     except Exception as e:
-        print(f"[ERROR] Failed to get proxy from DB: {e}")
-        return os.environ.get('PROXY_URL', '')
+        print(f"[WARNING] Failed to flush proxy stats: {e}")
+
+llm_client.set_call_observer(record_proxy_call)
+proxy_health.set_probe(llm_client.probe)
 
 def get_proxies():
     """Возвращает прокси из БД или env"""
@@ -72,8 +182,6 @@ def analyze_goal_for_plan(goal: str) -> Dict[str, Any]:
 
 Отвечай ТОЛЬКО валидным JSON, без объяснений."""
     
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-    
     payload = {
         "contents": [{
             "parts": [{"text": prompt}]
@@ -85,41 +193,7 @@ def analyze_goal_for_plan(goal: str) -> Dict[str, Any]:
     }
     
     try:
-        proxies = get_proxies()
-        response = requests.post(url, json=payload, proxies=proxies, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if 'candidates' in data and len(data['candidates']) > 0:
-            text = data['candidates'][0]['content']['parts'][0]['text']
-            text = text.replace('```json', '').replace('```', '').strip()
-            
-            try:
-                result = json.loads(text)
-                return result
-            except json.JSONDecodeError as e:
-                # Пытаемся починить JSON
-                last_comma = text.rfind(',')
-                last_brace = text.rfind('}')
-                
-                if last_comma > last_brace:
-                    text = text[:last_comma]
-                
-                if text.count('{') > text.count('}'):
-                    text += '}' * (text.count('{') - text.count('}'))
-                
-                if text.count('[') > text.count(']'):
-                    text += ']' * (text.count('[') - text.count(']'))
-                
-                try:
-                    result = json.loads(text)
-                    return result
-                except:
-                    return {'error': f'Invalid JSON: {str(e)}'}
-        
-        return {'error': 'No response from Gemini'}
-    
+        return llm_client.generate_json('gemini-2.5-flash', payload, GOAL_ANALYSIS_RESPONSE, get_active_proxy_from_db(), timeout=30, task='goal_analysis')
     except Exception as e:
         return {'error': str(e)}
 
@@ -155,8 +229,6 @@ def check_student_level(claimed_level: str, answer: str) -> Dict[str, Any]:
 
 Отвечай ТОЛЬКО валидным JSON, без объяснений."""
     
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-    
     payload = {
         "contents": [{
             "parts": [{"text": prompt}]
@@ -168,62 +240,9 @@ def check_student_level(claimed_level: str, answer: str) -> Dict[str, Any]:
     }
     
     try:
-        proxies = get_proxies()
-        response = requests.post(url, json=payload, proxies=proxies, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if 'candidates' in data and len(data['candidates']) > 0:
-            text = data['candidates'][0]['content']['parts'][0]['text']
-            text = text.replace('```json', '').replace('```', '').strip()
-            
-            try:
-                result = json.loads(text)
-                return result
-            except json.JSONDecodeError as e:
-                print(f"🔴 JSON parse error in check_level: {e}")
-                print(f"🔴 Problematic JSON:\n{text}")
-                
-                try:
-                    import re
-                    fixed_text = text.strip()
-                    
-                    # Случай 1: Незакрытая строка после двоеточия
-                    last_colon_idx = fixed_text.rfind(':')
-                    if last_colon_idx != -1:
-                        after_colon = fixed_text[last_colon_idx+1:].strip()
-                        if after_colon.startswith('"'):
-                            quotes_count = after_colon.count('"')
-                            if quotes_count % 2 == 1:
-                                fixed_text += '"'
-                                print(f"🔧 Fixed unterminated string after colon")
-                    
-                    # Случай 2: Удаляем незавершенный последний элемент
-                    last_comma_idx = fixed_text.rfind(',')
-                    last_brace_idx = fixed_text.rfind('}')
-                    
-                    if last_comma_idx > last_brace_idx and last_comma_idx != -1:
-                        fixed_text = fixed_text[:last_comma_idx]
-                        print(f"🔧 Removed incomplete trailing item")
-                    
-                    # Случай 3: Закрываем незакрытые скобки
-                    open_braces = fixed_text.count('{')
-                    close_braces = fixed_text.count('}')
-                    if open_braces > close_braces:
-                        fixed_text += '}' * (open_braces - close_braces)
-                        print(f"🔧 Added {open_braces - close_braces} closing braces")
-                    
-                    result = json.loads(fixed_text)
-                    print(f"✅ Fixed JSON successfully!")
-                    return result
-                except Exception as fix_error:
-                    print(f"🔴 Failed to fix JSON: {fix_error}")
-                    return {'error': f'Invalid JSON: {str(e)}', 'actual_level': claimed_level, 'is_correct': True}
-        
-        return {'error': 'No response from Gemini', 'actual_level': claimed_level, 'is_correct': True}
-    
+        return llm_client.generate_json('gemini-2.5-flash', payload, LEVEL_CHECK_RESPONSE, get_active_proxy_from_db(), timeout=30, task='level_check')
     except Exception as e:
+        print(f"[ERROR] check_level failed: {e}")
         return {'error': str(e), 'actual_level': claimed_level, 'is_correct': True}
 
 def analyze_urgent_goal(goal: str) -> Dict[str, Any]:
@@ -264,8 +283,6 @@ def analyze_urgent_goal(goal: str) -> Dict[str, Any]:
 
 Отвечай ТОЛЬКО валидным JSON, без объяснений."""
     
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-    
     payload = {
         "contents": [{
             "parts": [{"text": prompt}]
@@ -277,11 +294,7 @@ def analyze_urgent_goal(goal: str) -> Dict[str, Any]:
     }
     
     try:
-        proxies = get_proxies()
-        response = requests.post(url, json=payload, proxies=proxies, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
+        data = llm_client.generate_content('gemini-2.5-flash', payload, get_active_proxy_from_db(), timeout=30, task='urgent_goal')
         
         if 'candidates' in data and len(data['candidates']) > 0:
             text = data['candidates'][0]['content']['parts'][0]['text']
@@ -346,8 +359,6 @@ def generate_learning_goal_suggestions(user_input: str) -> Dict[str, Any]:
 
 Отвечай ТОЛЬКО валидным JSON, без объяснений."""
     
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-    
     payload = {
         "contents": [{
             "parts": [{"text": prompt}]
@@ -359,11 +370,7 @@ def generate_learning_goal_suggestions(user_input: str) -> Dict[str, Any]:
     }
     
     try:
-        proxies = get_proxies()
-        response = requests.post(url, json=payload, proxies=proxies, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
+        data = llm_client.generate_content('gemini-2.5-flash', payload, get_active_proxy_from_db(), timeout=30, task='goal_suggestions')
         
         if 'candidates' in data and len(data['candidates']) > 0:
             text = data['candidates'][0]['content']['parts'][0]['text']
@@ -454,36 +461,21 @@ def generate_unique_words(student_id: int, learning_goal: str, language_level: s
 - Только практичные слова для реальных разговоров!
 - НИКАКИХ дубликатов из списка уже известных слов!"""
     
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-    
     payload = {
         "contents": [{
             "parts": [{"text": prompt}]
         }],
         "generationConfig": {
             "temperature": 0.9,
-            "maxOutputTokens": 2000,
-            "responseMimeType": "application/json"
+            "maxOutputTokens": 2000
         }
     }
     
     try:
-        proxies = get_proxies()
-        response = requests.post(url, json=payload, proxies=proxies, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
+        proxy_url = get_active_proxy_from_db()
+        result = llm_client.generate_json('gemini-2.5-flash', payload, WORDS_RESPONSE, proxy_url, timeout=30, task='unique_words')
         
-        if 'candidates' in data and len(data['candidates']) > 0:
-            text = data['candidates'][0]['content']['parts'][0]['text']
-            text = text.replace('```json', '').replace('```', '').strip()
-            
-            # Удаляем trailing commas
-            import re
-            text = re.sub(r',\s*}', '}', text)
-            text = re.sub(r',\s*]', ']', text)
-            
-            result = json.loads(text)
+        if result:
             generated_words = result.get('words', [])
             
             # ФИЛЬТРУЕМ дубликаты ПОСЛЕ генерации
@@ -514,17 +506,16 @@ Return ONLY valid JSON:
                 
                 replacement_payload = {
                     "contents": [{"parts": [{"text": replacement_prompt}]}],
-                    "generationConfig": {"temperature": 0.95, "maxOutputTokens": 1500, "responseMimeType": "application/json"}
+                    "generationConfig": {"temperature": 0.95, "maxOutputTokens": 1500}
                 }
                 
-                replacement_response = requests.post(url, json=replacement_payload, proxies=proxies, timeout=25)
-                replacement_data = replacement_response.json()
+                try:
+                    replacement_result = llm_client.generate_json('gemini-2.5-flash', replacement_payload, WORDS_RESPONSE, proxy_url, timeout=25, task='unique_words_replacements')
+                except llm_client.LLMError as e:
+                    print(f"[WARNING] Failed to get replacement words: {e}")
+                    replacement_result = {}
                 
-                if 'candidates' in replacement_data:
-                    replacement_text = replacement_data['candidates'][0]['content']['parts'][0]['text']
-                    replacement_text = replacement_text.replace('```json', '').replace('```', '').strip()
-                    replacement_result = json.loads(replacement_text)
-                    
+                if replacement_result:
                     for repl_word in replacement_result.get('words', []):
                         if repl_word['english'].strip().lower() not in existing_words:
                             unique_words.append(repl_word)
@@ -636,8 +627,6 @@ def generate_personalized_words(student_id: int, learning_goal: str, language_le
 - БЕЗ markdown форматирования
 - Только практичные слова для реальных разговоров!"""
     
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-    
     payload = {
         "contents": [{
             "parts": [{"text": prompt}]
@@ -650,11 +639,7 @@ def generate_personalized_words(student_id: int, learning_goal: str, language_le
     }
     
     try:
-        proxies = get_proxies()
-        response = requests.post(url, json=payload, proxies=proxies, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
+        data = llm_client.generate_content('gemini-2.5-flash', payload, get_active_proxy_from_db(), timeout=30, task='personalized_words')
         
         if 'candidates' in data and len(data['candidates']) > 0:
             text = data['candidates'][0]['content']['parts'][0]['text']
@@ -1828,63 +1813,48 @@ def delete_proxy(proxy_id: int) -> bool:
     return True
 
 def generate_speech(text: str, lang: str = 'en-US') -> Dict[str, Any]:
-    """Генерирует озвучку через Yandex SpeechKit с кэшированием в S3"""
+    """
+    Генерирует озвучку через Yandex SpeechKit. Аудио кэшируется по содержимому (tts_cache, общий с ботом):
+    одинаковый текст синтезируется один раз, одновременные запросы одного текста ждут один синтез
+    """
     if not text:
         return {'error': 'Text is required'}
     
-    # Проверяем кэш в S3
-    file_key = f"audio/{lang}/{hash(text)}.ogg"
+    try:
+        url, cached = tts_cache.get_audio(text, f'{SPEECHKIT_VOICE}/{lang}', 'speechkit', 'oggopus', lambda t: synthesize_speech(t, lang))
+        return {'url': url, 'cached': cached}
+    except Exception as e:
+        return {'error': str(e)}
+
+def synthesize_speech(text: str, lang: str) -> bytes:
+    """Синтез речи через Yandex SpeechKit (oggopus)"""
+    api_key = os.environ.get('YANDEX_CLOUD_API_KEY')
+    folder_id = os.environ.get('YANDEX_CLOUD_FOLDER_ID')
+    
+    if not api_key or not folder_id:
+        raise Exception('Yandex Cloud credentials not configured')
+    
+    url = 'https://tts.api.cloud.yandex.net/speech/v1/tts:synthesize'
+    headers = {'Authorization': f'Api-Key {api_key}'}
+    
+    data = {
+        'text': text,
+        'lang': lang,
+        'voice': SPEECHKIT_VOICE,
+        'format': 'oggopus',
+        'speed': '1.0',
+        'folderId': folder_id
+    }
     
+    started = time.perf_counter()
     try:
-        s3 = boto3.client('s3',
-            endpoint_url='https://bucket.poehali.dev',
-            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-        )
-        
-        # Проверяем существование файла
-        try:
-            s3.head_object(Bucket='files', Key=file_key)
-            cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
-            return {'url': cdn_url, 'cached': True}
-        except:
-            pass
-        
-        # Генерируем новую озвучку
-        api_key = os.environ.get('YANDEX_CLOUD_API_KEY')
-        folder_id = os.environ.get('YANDEX_CLOUD_FOLDER_ID')
-        
-        if not api_key or not folder_id:
-            return {'error': 'Yandex Cloud credentials not configured'}
-        
-        url = 'https://tts.api.cloud.yandex.net/speech/v1/tts:synthesize'
-        headers = {'Authorization': f'Api-Key {api_key}'}
-        
-        data = {
-            'text': text,
-            'lang': lang,
-            'voice': 'alena',
-            'format': 'oggopus',
-            'speed': '1.0',
-            'folderId': folder_id
-        }
-        
         response = requests.post(url, headers=headers, data=data, timeout=30)
         response.raise_for_status()
-        
-        # Сохраняем в S3
-        s3.put_object(
-            Bucket='files',
-            Key=file_key,
-            Body=response.content,
-            ContentType='audio/ogg'
-        )
-        
-        cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
-        return {'url': cdn_url, 'cached': False}
-        
     except Exception as e:
-        return {'error': str(e)}
+        llm_client.record_external_call('tts', f'speechkit-{SPEECHKIT_VOICE}', '', started, False, e)
+        raise
+    llm_client.record_external_call('tts', f'speechkit-{SPEECHKIT_VOICE}', '', started, True)
+    return response.content
 
 def toggle_subscription(telegram_id: int, active: bool, days: int = 30, subscription_type: str = 'basic') -> Dict[str, Any]:
     """Включает/выключает подписку студента (basic или premium)"""
@@ -1976,6 +1946,63 @@ def reset_proxy_stats(proxy_id: int) -> bool:
     conn.close()
     return True
 
+def get_llm_metrics(hours: int = 24, task: str = None) -> Dict[str, Any]:
+    """
+    Латентность и объем вызовов LLM/речи по задачам за последние hours часов (таблица llm_calls):
+    p50/p95/p99 успешных вызовов, число вызовов, ошибок и таймаутов, токены и число пользователей
+    """
+    hours = max(1, min(int(hours), LLM_METRICS_MAX_HOURS))
+    task_filter = ''
+    if task:
+        task_escaped = task.replace("'", "''")
+        task_filter = f" AND task = '{task_escaped}'"
+    
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT task, array_agg(DISTINCT service), mode() WITHIN GROUP (ORDER BY model), "
+        f"COUNT(*), COUNT(*) FILTER (WHERE outcome <> 'ok'), COUNT(*) FILTER (WHERE outcome = 'timeout'), "
+        f"percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY latency_ms) FILTER (WHERE outcome = 'ok'), "
+        f"percentile_cont(0.5) WITHIN GROUP (ORDER BY first_chunk_ms), "
+        f"COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(cached_tokens), 0), COALESCE(SUM(response_tokens), 0), "
+        f"COUNT(DISTINCT user_hash) "
+        f"FROM {SCHEMA}.llm_calls "
+        f"WHERE called_at >= NOW() - INTERVAL '{hours} hours'{task_filter} "
+        f"GROUP BY task ORDER BY COUNT(*) DESC"
+    )
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    
+    tasks = []
+    for row in rows:
+        p50, p95, p99 = row[6] if row[6] else (None, None, None)
+        tasks.append({
+            'task': row[0],
+            'services': row[1],
+            'model': row[2],
+            'calls': row[3],
+            'calls_per_hour': round(row[3] / hours, 2),
+            'errors': row[4],
+            'timeouts': row[5],
+            'error_rate': round(row[4] / row[3], 3) if row[3] else 0.0,
+            'p50_ms': round(p50) if p50 is not None else None,
+            'p95_ms': round(p95) if p95 is not None else None,
+            'p99_ms': round(p99) if p99 is not None else None,
+            'first_chunk_p50_ms': round(row[7]) if row[7] is not None else None,
+            'prompt_tokens': row[8],
+            'cached_tokens': row[9],
+            'response_tokens': row[10],
+            'users': row[11]
+        })
+    
+    return {
+        'hours': hours,
+        'calls': sum(t['calls'] for t in tasks),
+        'errors': sum(t['errors'] for t in tasks),
+        'tasks': tasks
+    }
+
 def get_all_blog_posts(published_only: bool = False) -> List[Dict[str, Any]]:
     """Получает все статьи блога"""
     conn = get_db_connection()
@@ -2359,9 +2386,6 @@ def call_gemini_demo(user_message: str, history: list) -> str:
     Returns:
         str: ответ Gemini
     """
-    api_key = os.environ['GEMINI_API_KEY']
-    proxies = get_proxies()
-    
     # System prompt для демо-чата
     system_prompt = """You are Anya, a friendly and helpful English tutor for Russian-speaking students.
 
@@ -2391,20 +2415,9 @@ Nice! What did you buy? 🛍️"
 
 Be natural, friendly, and helpful! Keep it short and conversational."""
 
-    # Формируем содержимое для Gemini
+    # Формируем содержимое для Gemini (системный промпт уходит в systemInstruction)
     contents = []
     
-    # Системный промпт
-    contents.append({
-        'role': 'user',
-        'parts': [{'text': system_prompt}]
-    })
-    
-    contents.append({
-        'role': 'model',
-        'parts': [{'text': 'Understood! I will be Anya, a friendly English tutor.'}]
-    })
-    
     # Добавляем историю
     for msg in history[-10:]:  # Последние 10 сообщений
         role = 'user' if msg['role'] == 'user' else 'model'
@@ -2420,24 +2433,46 @@ Be natural, friendly, and helpful! Keep it short and conversational."""
     })
     
     # Запрос к Gemini
-    url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent?key={api_key}'
-    
-    payload = {
+    payload = llm_client.with_system_prompt({
         'contents': contents,
         'generationConfig': {
             'temperature': 0.8,
             'maxOutputTokens': 500,
             'topP': 0.95
         }
-    }
-    
-    response = requests.post(url, json=payload, proxies=proxies, timeout=30)
-    response.raise_for_status()
+    }, 'gemini-2.0-flash-exp', system_prompt)
     
-    result = response.json()
-    return result['candidates'][0]['content']['parts'][0]['text']
+    return llm_client.generate_text('gemini-2.0-flash-exp', payload, get_active_proxy_from_db(), timeout=30, task='demo_chat')
+
+def flush_llm_telemetry():
+    """Пишет накопленную телеметрию вызовов LLM/речи в llm_calls одним запросом"""
+    if not llm_client.has_pending_telemetry():
+        return
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        flushed = llm_client.flush_telemetry(cur, SCHEMA, 'webapp-api')
+        cur.close()
+        conn.close()
+        print(f"[DEBUG] Flushed {flushed} LLM call events")
+    except Exception as e:
+        print(f"[WARNING] Failed to flush LLM telemetry: {e}")
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Точка входа функции: обрабатывает запрос и пачкой пишет телеметрию вызовов LLM"""
+    try:
+        body_data = json.loads(event.get('body') or '{}')
+        llm_client.set_telemetry_user(body_data.get('telegram_id') or body_data.get('student_id'))
+    except Exception:
+        llm_client.set_telemetry_user(None)
+    try:
+        return handle_request(event, context)
+    finally:
+        flush_llm_telemetry()
+        flush_proxy_stats()
+        llm_client.set_telemetry_user(None)
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Главный обработчик WebApp API
     Обрабатывает запросы от Telegram WebApp для студентов
@@ -2936,6 +2971,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
         
+        elif action == 'get_llm_metrics':
+            metrics = get_llm_metrics(body_data.get('hours', 24), body_data.get('task'))
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'metrics': metrics}),
+                'isBase64Encoded': False
+            }
+        
         elif action == 'reset_proxy_stats':
             proxy_id = body_data.get('proxy_id')
             reset_proxy_stats(proxy_id)
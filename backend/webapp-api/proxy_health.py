@@ -0,0 +1,279 @@
+"""
+Выбор прокси по "здоровью" вместо random.choice.
+
+Для каждого прокси в памяти инстанса держим EWMA латентности и доли успешных
+запросов. Прокси выбирается по схеме power-of-two-choices: берем два случайных
+кандидата и отдаем того, у кого ниже ожидаемая стоимость запроса
+(латентность / доля успехов). Медленный, но живой прокси получает меньше трафика,
+а новый прокси без статистики получает шанс проявить себя.
+
+Оценки разных инстансов функции сводятся через таблицу proxy_health:
+при обновлении кеша списка прокси (раз в минуту) инстанс пишет свои EWMA
+и забирает общие.
+
+Счетчики proxies.total_requests / successful_requests / failed_requests тоже
+копятся в памяти и сбрасываются в БД одним UPDATE (в конце обработки апдейта
+и при обновлении кеша прокси), а не после каждого вызова LLM.
+
+Circuit breaker на каждый прокси вместо вечного is_active = FALSE:
+- closed: прокси в ротации, исходы копятся в скользящем окне BREAKER_WINDOW секунд;
+- open: слишком много ошибок в окне - прокси выпадает из выбора на open_seconds;
+- half_open: время вышло - в фоне уходит дешевый probe-запрос (без генерации),
+  успех закрывает breaker, ошибка снова открывает его с удвоенной паузой.
+Отказ и восстановление занимают секунды и не требуют действий админа.
+
+Файл одинаковый в telegram-bot и webapp-api (каждая функция деплоится из своей папки).
+"""
+import time
+import random
+import threading
+from collections import deque
+from typing import Dict, Any, List, Tuple
+
+EWMA_ALPHA = 0.2              # Вес нового замера
+DEFAULT_LATENCY_MS = 2000.0   # Латентность прокси без статистики (оптимистичная оценка)
+MIN_SUCCESS_RATE = 0.05       # Чтобы стоимость не улетала в бесконечность
+EXPLORE_RATE = 0.05           # Доля случайных выборов, чтобы оценки плохих прокси могли восстановиться
+
+BREAKER_WINDOW = 30           # Скользящее окно исходов, секунды
+BREAKER_MIN_FAILURES = 3      # Меньше ошибок в окне - breaker не открывается
+BREAKER_FAILURE_RATIO = 0.5   # Доля ошибок в окне, после которой breaker открывается
+BREAKER_OPEN_SECONDS = 10     # Первая пауза перед probe
+BREAKER_MAX_OPEN_SECONDS = 120
+
+_health: Dict[int, Dict[str, float]] = {}
+_health_lock = threading.Lock()
+
+# Несброшенные в БД дельты счетчиков: proxy_id -> {'total', 'ok', 'failed', 'last_error'}
+_pending_stats: Dict[int, Dict[str, Any]] = {}
+
+# Circuit breakers: proxy_id -> {'state', 'opened_at', 'open_seconds', 'window', 'probing'}
+_breakers: Dict[int, Dict[str, Any]] = {}
+_probe_fn = None
+
+def _new_breaker() -> Dict[str, Any]:
+    return {'state': 'closed', 'opened_at': 0.0, 'open_seconds': BREAKER_OPEN_SECONDS, 'window': deque(), 'probing': False}
+
+def set_probe(probe_fn):
+    """Функция дешевой проверки прокси: probe_fn(proxy_url) -> bool"""
+    global _probe_fn
+    _probe_fn = probe_fn
+
+def _open_breaker(proxy_id: int, breaker: Dict[str, Any], reason: str):
+    breaker['state'] = 'open'
+    breaker['opened_at'] = time.time()
+    breaker['window'].clear()
+    print(f"[WARNING] Proxy {proxy_id} circuit OPEN for {breaker['open_seconds']}s: {reason}")
+
+def _close_breaker(proxy_id: int, breaker: Dict[str, Any]):
+    breaker['state'] = 'closed'
+    breaker['open_seconds'] = BREAKER_OPEN_SECONDS
+    breaker['window'].clear()
+    print(f"[DEBUG] Proxy {proxy_id} circuit CLOSED")
+
+def _update_breaker(proxy_id: int, ok: bool):
+    """Учитывает исход в окне breaker (вызывается под _health_lock)"""
+    breaker = _breakers.setdefault(proxy_id, _new_breaker())
+    now = time.time()
+
+    if breaker['state'] == 'half_open':
+        # Реальный запрос, ушедший до открытия, тоже годится как проба
+        if ok:
+            _close_breaker(proxy_id, breaker)
+        return
+    if breaker['state'] == 'open':
+        return
+
+    window = breaker['window']
+    window.append((now, ok))
+    while window and now - window[0][0] > BREAKER_WINDOW:
+        window.popleft()
+
+    failures = sum(1 for _, outcome in window if not outcome)
+    if not ok and failures >= BREAKER_MIN_FAILURES and failures / len(window) >= BREAKER_FAILURE_RATIO:
+        _open_breaker(proxy_id, breaker, f"{failures}/{len(window)} failures in {BREAKER_WINDOW}s")
+
+def _run_probe(proxy_id: int, proxy_url: str):
+    try:
+        ok = bool(_probe_fn(proxy_url))
+    except Exception as e:
+        print(f"[WARNING] Probe for proxy {proxy_id} failed: {e}")
+        ok = False
+
+    with _health_lock:
+        breaker = _breakers.setdefault(proxy_id, _new_breaker())
+        breaker['probing'] = False
+        if ok:
+            _close_breaker(proxy_id, breaker)
+        else:
+            breaker['open_seconds'] = min(breaker['open_seconds'] * 2, BREAKER_MAX_OPEN_SECONDS)
+            _open_breaker(proxy_id, breaker, 'probe failed')
+
+def is_available(proxy_id: int, proxy_url: str = None) -> bool:
+    """Можно ли слать трафик через прокси. Для истекшего open запускает probe в фоне"""
+    with _health_lock:
+        breaker = _breakers.get(proxy_id)
+        if not breaker or breaker['state'] == 'closed':
+            return True
+
+        if breaker['state'] == 'open' and time.time() - breaker['opened_at'] >= breaker['open_seconds']:
+            breaker['state'] = 'half_open'
+
+        if breaker['state'] == 'half_open' and not breaker['probing'] and _probe_fn and proxy_url:
+            breaker['probing'] = True
+            threading.Thread(target=_run_probe, args=(proxy_id, proxy_url), daemon=True).start()
+
+        return False
+
+def get_breaker_states() -> Dict[int, str]:
+    """Состояния breakers (для логов и админки)"""
+    with _health_lock:
+        return {proxy_id: breaker['state'] for proxy_id, breaker in _breakers.items()}
+
+def _new_stats() -> Dict[str, float]:
+    return {'latency_ms': DEFAULT_LATENCY_MS, 'success': 1.0, 'samples': 0, 'pending': 0}
+
+def record(proxy_id: int, ok: bool, elapsed_ms: float = None, error_message: str = None):
+    """Учитывает результат запроса через прокси (elapsed_ms=None - латентность неизвестна)"""
+    if not proxy_id:
+        return
+
+    with _health_lock:
+        delta = _pending_stats.setdefault(proxy_id, {'total': 0, 'ok': 0, 'failed': 0, 'last_error': None})
+        delta['total'] += 1
+        if ok:
+            delta['ok'] += 1
+        else:
+            delta['failed'] += 1
+            delta['last_error'] = (error_message or '')[:500]
+
+        _update_breaker(proxy_id, ok)
+
+        stats = _health.setdefault(proxy_id, _new_stats())
+        if elapsed_ms is not None:
+            if stats['samples'] == 0:
+                stats['latency_ms'] = float(elapsed_ms)
+            else:
+                stats['latency_ms'] += EWMA_ALPHA * (elapsed_ms - stats['latency_ms'])
+        stats['success'] += EWMA_ALPHA * ((1.0 if ok else 0.0) - stats['success'])
+        stats['samples'] += 1
+        stats['pending'] += 1
+
+def cost(proxy_id: int) -> float:
+    """Ожидаемая стоимость запроса через прокси: чем меньше, тем лучше"""
+    stats = _health.get(proxy_id)
+    if not stats:
+        return DEFAULT_LATENCY_MS
+    return stats['latency_ms'] / max(stats['success'], MIN_SUCCESS_RATE)
+
+def choose(proxies: List[Tuple[int, str]], exclude: set = None) -> Tuple[int, str]:
+    """Power-of-two-choices: из двух случайных прокси выбирает более здоровый"""
+    candidates = [p for p in proxies if is_available(p[0], p[1]) and (not exclude or p[0] not in exclude)]
+    if not candidates:
+        # Все breakers открыты - лучше попробовать, чем не ответить вовсе
+        candidates = [p for p in proxies if not exclude or p[0] not in exclude] or proxies
+    if not candidates:
+        return None, None
+    if len(candidates) == 1 or random.random() < EXPLORE_RATE:
+        return random.choice(candidates)
+
+    first, second = random.sample(candidates, 2)
+    return first if cost(first[0]) <= cost(second[0]) else second
+
+def get_snapshot() -> Dict[int, Dict[str, Any]]:
+    """Текущие оценки прокси (для логов и админки)"""
+    with _health_lock:
+        return {
+            proxy_id: {
+                'latency_ms': round(stats['latency_ms'], 1),
+                'success': round(stats['success'], 3),
+                'samples': stats['samples'],
+                'cost': round(cost(proxy_id), 1)
+            }
+            for proxy_id, stats in _health.items()
+        }
+
+def sync_with_db(cur, schema: str):
+    """
+    Сводит оценки инстанса с общими в таблице proxy_health.
+    Свои свежие замеры вливаются в общую EWMA одним INSERT ... ON CONFLICT,
+    затем локальные оценки усредняются с общими.
+    """
+    with _health_lock:
+        pending = [(proxy_id, dict(stats)) for proxy_id, stats in _health.items() if stats['pending'] > 0]
+        for proxy_id, _ in pending:
+            _health[proxy_id]['pending'] = 0
+
+    if pending:
+        values = ', '.join(
+            f"({proxy_id}, {stats['latency_ms']:.1f}, {stats['success']:.4f}, {stats['pending']}, CURRENT_TIMESTAMP)"
+            for proxy_id, stats in pending
+        )
+        cur.execute(
+            f"INSERT INTO {schema}.proxy_health (proxy_id, latency_ewma_ms, success_ewma, samples, updated_at) "
+            f"VALUES {values} "
+            f"ON CONFLICT (proxy_id) DO UPDATE SET "
+            f"latency_ewma_ms = {schema}.proxy_health.latency_ewma_ms * (1 - {EWMA_ALPHA}) + EXCLUDED.latency_ewma_ms * {EWMA_ALPHA}, "
+            f"success_ewma = {schema}.proxy_health.success_ewma * (1 - {EWMA_ALPHA}) + EXCLUDED.success_ewma * {EWMA_ALPHA}, "
+            f"samples = {schema}.proxy_health.samples + EXCLUDED.samples, "
+            f"updated_at = CURRENT_TIMESTAMP"
+        )
+
+    cur.execute(
+        f"SELECT proxy_id, latency_ewma_ms, success_ewma FROM {schema}.proxy_health"
+    )
+    with _health_lock:
+        for proxy_id, latency_ms, success in cur.fetchall():
+            stats = _health.setdefault(proxy_id, _new_stats())
+            if stats['samples'] == 0:
+                # Своих замеров нет (холодный инстанс) - берем общую оценку как есть
+                stats['latency_ms'] = float(latency_ms)
+                stats['success'] = float(success)
+            else:
+                stats['latency_ms'] = (stats['latency_ms'] + float(latency_ms)) / 2
+                stats['success'] = (stats['success'] + float(success)) / 2
+
+def has_pending_stats() -> bool:
+    return bool(_pending_stats)
+
+def flush_stats(cur, schema: str) -> int:
+    """Сбрасывает накопленные дельты счетчиков в proxies одним UPDATE. Возвращает число прокси"""
+    with _health_lock:
+        pending = list(_pending_stats.items())
+        _pending_stats.clear()
+
+    if not pending:
+        return 0
+
+    rows = []
+    for proxy_id, delta in pending:
+        if delta['last_error'] is None:
+            last_error = 'NULL::text'
+        else:
+            last_error = "'" + delta['last_error'].replace("'", "''") + "'"
+        rows.append(f"({proxy_id}, {delta['total']}, {delta['ok']}, {delta['failed']}, {last_error})")
+
+    try:
+        cur.execute(
+            f"UPDATE {schema}.proxies AS p SET "
+            f"total_requests = p.total_requests + d.total, "
+            f"successful_requests = p.successful_requests + d.ok, "
+            f"failed_requests = p.failed_requests + d.failed, "
+            f"last_used_at = CASE WHEN d.ok > 0 THEN CURRENT_TIMESTAMP ELSE p.last_used_at END, "
+            f"last_error = COALESCE(d.last_error, p.last_error), "
+            f"last_error_at = CASE WHEN d.failed > 0 THEN CURRENT_TIMESTAMP ELSE p.last_error_at END "
+            f"FROM (VALUES {', '.join(rows)}) AS d(id, total, ok, failed, last_error) "
+            f"WHERE p.id = d.id"
+        )
+    except Exception:
+        # Не теряем статистику: возвращаем дельты в буфер до следующего сброса
+        with _health_lock:
+            for proxy_id, delta in pending:
+                current = _pending_stats.setdefault(proxy_id, {'total': 0, 'ok': 0, 'failed': 0, 'last_error': None})
+                current['total'] += delta['total']
+                current['ok'] += delta['ok']
+                current['failed'] += delta['failed']
+                current['last_error'] = current['last_error'] or delta['last_error']
+        raise
+
+    return len(pending)
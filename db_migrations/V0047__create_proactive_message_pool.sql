@@ -0,0 +1,20 @@
+-- Пул заранее сгенерированных проактивных сообщений от Ани
+-- Шаблоны содержат слоты {name} и {word}, которые планировщик заполняет локально без вызова Gemini
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.proactive_message_pool (
+    id SERIAL PRIMARY KEY,
+    language_level VARCHAR(10) NOT NULL,
+    topic VARCHAR(255) NOT NULL DEFAULT 'general',
+    message_type VARCHAR(50) NOT NULL,
+    template_text TEXT NOT NULL,
+    has_word_slot BOOLEAN DEFAULT FALSE,
+    times_used INTEGER DEFAULT 0,
+    last_used_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_pool_lookup
+ON t_p86463701_eloquent_school_site.proactive_message_pool(language_level, topic, message_type, times_used);
+
+COMMENT ON TABLE t_p86463701_eloquent_school_site.proactive_message_pool IS 'Шаблоны проактивных сообщений по (уровень, тема, тип) - генерируются вне пиковых часов';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.proactive_message_pool.template_text IS 'Текст со слотами {name} (имя студента) и {word} (слово из практики)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.proactive_message_pool.times_used IS 'Сколько раз шаблон уже отправлялся (после лимита шаблон считается израсходованным)';
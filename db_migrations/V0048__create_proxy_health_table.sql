@@ -0,0 +1,13 @@
+-- Общие оценки "здоровья" прокси (EWMA латентности и доли успехов)
+-- Каждый инстанс бота раз в минуту вливает сюда свои замеры и забирает общие
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.proxy_health (
+    proxy_id INTEGER PRIMARY KEY REFERENCES t_p86463701_eloquent_school_site.proxies(id) ON DELETE CASCADE,
+    latency_ewma_ms REAL NOT NULL,
+    success_ewma REAL NOT NULL,
+    samples INTEGER DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE t_p86463701_eloquent_school_site.proxy_health IS 'EWMA латентности и успешности прокси, общая для всех инстансов бота';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.proxy_health.latency_ewma_ms IS 'Сглаженная латентность запроса через прокси, мс';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.proxy_health.success_ewma IS 'Сглаженная доля успешных запросов (0..1)';
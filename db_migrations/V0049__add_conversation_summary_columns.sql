@@ -0,0 +1,12 @@
+-- Сводка старых сообщений диалога: в промпт Gemini уходят только свежие сообщения + эта сводка
+ALTER TABLE t_p86463701_eloquent_school_site.conversations
+  ADD COLUMN IF NOT EXISTS summary TEXT,
+  ADD COLUMN IF NOT EXISTS summary_until_message_id BIGINT,
+  ADD COLUMN IF NOT EXISTS summary_updated_at TIMESTAMP;
+
+-- Выборка свежих сообщений диалога после границы сводки
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_id_id
+ON t_p86463701_eloquent_school_site.messages(conversation_id, id);
+
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.conversations.summary IS 'Скользящая сводка сообщений диалога до summary_until_message_id (обновляется ботом раз в несколько реплик)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.conversations.summary_until_message_id IS 'id последнего сообщения, вошедшего в сводку - в промпт идут только сообщения после него';
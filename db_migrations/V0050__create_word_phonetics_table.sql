@@ -0,0 +1,11 @@
+-- Общий словарь транскрипций (IPA): бот читает его вместо вызова Gemini на каждое упражнение
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.word_phonetics (
+    word TEXT PRIMARY KEY,
+    ipa VARCHAR(255) NOT NULL,
+    source VARCHAR(20) NOT NULL DEFAULT 'lazy',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE t_p86463701_eloquent_school_site.word_phonetics IS 'Транскрипции слов и фраз, общие для всех студентов';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.word_phonetics.word IS 'Слово в нижнем регистре без пробелов по краям (LOWER(TRIM(words.english_text)))';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.word_phonetics.source IS 'lazy - сохранено ботом при первом запросе, backfill - пакетное заполнение practice-scheduler';
@@ -0,0 +1,29 @@
+-- Банк заранее сгенерированных упражнений для режимов "Контекст" и "Ассоциации"
+-- Бот берет вариант отсюда вместо вызова Gemini, practice-scheduler пополняет банк пачками
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.exercise_bank (
+    id SERIAL PRIMARY KEY,
+    word_id INTEGER NOT NULL REFERENCES t_p86463701_eloquent_school_site.words(id),
+    language_level VARCHAR(10) NOT NULL,
+    exercise_type VARCHAR(20) NOT NULL,
+    content TEXT NOT NULL,
+    times_used INTEGER DEFAULT 0,
+    last_used_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_exercise_bank_lookup
+ON t_p86463701_eloquent_school_site.exercise_bank(word_id, language_level, exercise_type, times_used);
+
+-- Очередь на пополнение: бот добавляет (слово, уровень, тип), когда свежих вариантов мало
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.exercise_bank_queue (
+    word_id INTEGER NOT NULL REFERENCES t_p86463701_eloquent_school_site.words(id),
+    language_level VARCHAR(10) NOT NULL,
+    exercise_type VARCHAR(20) NOT NULL,
+    requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (word_id, language_level, exercise_type)
+);
+
+COMMENT ON TABLE t_p86463701_eloquent_school_site.exercise_bank IS 'Варианты упражнений по (слово, уровень, тип) - генерируются фоном в practice-scheduler';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.exercise_bank.exercise_type IS 'context - предложение с пропуском ___, association - JSON {"associations": [3 подсказки]}';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.exercise_bank.times_used IS 'Сколько раз вариант показан (после лимита считается израсходованным)';
+COMMENT ON TABLE t_p86463701_eloquent_school_site.exercise_bank_queue IS 'Запросы бота на пополнение банка упражнений';
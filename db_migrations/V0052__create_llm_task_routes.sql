@@ -0,0 +1,36 @@
+-- Маршруты задач LLM: модель, лимит токенов ответа и таймаут по типу задачи
+-- llm_client перечитывает таблицу раз в 5 минут; задачи без строки используют значения из кода
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.llm_task_routes (
+    task VARCHAR(64) PRIMARY KEY,
+    model VARCHAR(64) NOT NULL,
+    max_output_tokens INTEGER,
+    timeout_seconds NUMERIC(5, 1),
+    is_active BOOLEAN DEFAULT TRUE,
+    description TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Короткие задачи-классификаторы - на быструю модель с небольшим лимитом ответа,
+-- диалог, план и генерация слов - на прежних моделях
+INSERT INTO t_p86463701_eloquent_school_site.llm_task_routes (task, model, max_output_tokens, timeout_seconds, description) VALUES
+    ('sentence_check', 'gemini-2.5-flash-lite', 400, 8, 'Проверка предложения в режиме "Составь предложение"'),
+    ('level_check', 'gemini-2.5-flash-lite', 400, 15, 'Проверка заявленного уровня по переводам'),
+    ('level_test_check', 'gemini-2.5-flash-lite', 200, 10, 'Проверка одного ответа в тесте уровня'),
+    ('level_test_translate', 'gemini-2.5-flash-lite', 100, 8, 'Перевод ожидаемого ответа теста на русский'),
+    ('level_test_analysis', 'gemini-2.5-flash-lite', 300, 15, 'Итоговый уровень по результатам теста'),
+    ('goal_analysis', 'gemini-2.5-flash-lite', 300, 15, 'Формулировка цели и срока (webapp-api)'),
+    ('goal_suggestions', 'gemini-2.5-flash-lite', 800, 15, 'Подсказки целей обучения (webapp-api)'),
+    ('context_exercise', 'gemini-2.5-flash-lite', 200, 8, 'Предложение с пропуском (если банк упражнений пуст)'),
+    ('association_exercise', 'gemini-2.5-flash-lite', 200, 10, 'Подсказки-ассоциации (если банк упражнений пуст)'),
+    ('history_summary', 'gemini-2.5-flash-lite', 400, 15, 'Сводка старых сообщений диалога'),
+    ('dialog', 'gemini-2.5-flash', NULL, 12, 'Ответ Ани в диалоге'),
+    ('dialog_stream', 'gemini-2.5-flash', NULL, 12, 'Ответ Ани в диалоге (стриминг)'),
+    ('learning_plan', 'gemini-2.5-flash', NULL, 25, 'План обучения'),
+    ('unique_words', 'gemini-2.5-flash', NULL, 30, 'Персональные слова (webapp-api)'),
+    ('transcription', 'gemini-2.0-flash-exp', NULL, 10, 'Расшифровка голосовых')
+ON CONFLICT (task) DO NOTHING;
+
+COMMENT ON TABLE t_p86463701_eloquent_school_site.llm_task_routes IS 'Модель, лимит токенов и таймаут для каждого типа задачи LLM (task в llm_client)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.llm_task_routes.task IS 'Тип задачи - параметр task в вызовах llm_client';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.llm_task_routes.max_output_tokens IS 'maxOutputTokens ответа, NULL - как в коде';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.llm_task_routes.timeout_seconds IS 'Таймаут вызова, NULL - как в коде';
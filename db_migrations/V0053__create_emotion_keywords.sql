@@ -0,0 +1,124 @@
+-- Ключевые слова для определения настроения сообщения (mood_detector в telegram-bot)
+-- Строки настроения и языка заменяют встроенный набор бота; пустая таблица - встроенные наборы
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.emotion_keywords (
+    id SERIAL PRIMARY KEY,
+    mood VARCHAR(20) NOT NULL,
+    keyword VARCHAR(100) NOT NULL,
+    language VARCHAR(5) NOT NULL DEFAULT 'en',
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (mood, keyword, language)
+);
+
+INSERT INTO t_p86463701_eloquent_school_site.emotion_keywords (mood, keyword, language) VALUES
+    ('empathetic', 'death', 'en'),
+    ('empathetic', 'dead', 'en'),
+    ('empathetic', 'died', 'en'),
+    ('empathetic', 'dying', 'en'),
+    ('empathetic', 'kill', 'en'),
+    ('empathetic', 'suicide', 'en'),
+    ('empathetic', 'fear', 'en'),
+    ('empathetic', 'scared', 'en'),
+    ('empathetic', 'afraid', 'en'),
+    ('empathetic', 'terrified', 'en'),
+    ('empathetic', 'panic', 'en'),
+    ('empathetic', 'lonely', 'en'),
+    ('empathetic', 'alone', 'en'),
+    ('empathetic', 'depression', 'en'),
+    ('empathetic', 'depressed', 'en'),
+    ('empathetic', 'sad', 'en'),
+    ('empathetic', 'cry', 'en'),
+    ('empathetic', 'crying', 'en'),
+    ('empathetic', 'difficult', 'en'),
+    ('empathetic', 'hard time', 'en'),
+    ('empathetic', 'struggle', 'en'),
+    ('empathetic', 'pain', 'en'),
+    ('empathetic', 'hurt', 'en'),
+    ('empathetic', 'suffering', 'en'),
+    ('empathetic', 'lost', 'en'),
+    ('empathetic', 'miss', 'en'),
+    ('empathetic', 'gone', 'en'),
+    ('empathetic', 'never', 'en'),
+    ('empathetic', 'hate', 'en'),
+    ('empathetic', 'angry', 'en'),
+    ('empathetic', 'upset', 'en'),
+    ('enthusiastic', 'happy', 'en'),
+    ('enthusiastic', 'joy', 'en'),
+    ('enthusiastic', 'excited', 'en'),
+    ('enthusiastic', 'love', 'en'),
+    ('enthusiastic', 'amazing', 'en'),
+    ('enthusiastic', 'wonderful', 'en'),
+    ('enthusiastic', 'great', 'en'),
+    ('enthusiastic', 'awesome', 'en'),
+    ('enthusiastic', 'perfect', 'en'),
+    ('enthusiastic', 'fantastic', 'en'),
+    ('enthusiastic', 'excellent', 'en'),
+    ('educational', 'how', 'en'),
+    ('educational', 'what', 'en'),
+    ('educational', 'why', 'en'),
+    ('educational', 'when', 'en'),
+    ('educational', 'where', 'en'),
+    ('educational', 'explain', 'en'),
+    ('educational', 'mean', 'en'),
+    ('educational', 'help', 'en'),
+    ('educational', 'learn', 'en'),
+    ('educational', 'study', 'en'),
+    ('educational', 'practice', 'en'),
+    ('empathetic', 'груст*', 'ru'),
+    ('empathetic', 'печал*', 'ru'),
+    ('empathetic', 'тоск*', 'ru'),
+    ('empathetic', 'одинок*', 'ru'),
+    ('empathetic', 'страш*', 'ru'),
+    ('empathetic', 'боюсь', 'ru'),
+    ('empathetic', 'боится', 'ru'),
+    ('empathetic', 'страх*', 'ru'),
+    ('empathetic', 'плак*', 'ru'),
+    ('empathetic', 'плач*', 'ru'),
+    ('empathetic', 'больно', 'ru'),
+    ('empathetic', 'боль', 'ru'),
+    ('empathetic', 'умер*', 'ru'),
+    ('empathetic', 'смерт*', 'ru'),
+    ('empathetic', 'депресс*', 'ru'),
+    ('empathetic', 'тяжело', 'ru'),
+    ('empathetic', 'устал*', 'ru'),
+    ('empathetic', 'скуча*', 'ru'),
+    ('empathetic', 'ненавиж*', 'ru'),
+    ('empathetic', 'злюсь', 'ru'),
+    ('empathetic', 'обид*', 'ru'),
+    ('empathetic', 'расстро*', 'ru'),
+    ('empathetic', 'паник*', 'ru'),
+    ('enthusiastic', 'рад', 'ru'),
+    ('enthusiastic', 'рада', 'ru'),
+    ('enthusiastic', 'радост*', 'ru'),
+    ('enthusiastic', 'счаст*', 'ru'),
+    ('enthusiastic', 'ура', 'ru'),
+    ('enthusiastic', 'класс*', 'ru'),
+    ('enthusiastic', 'круто', 'ru'),
+    ('enthusiastic', 'отлично', 'ru'),
+    ('enthusiastic', 'супер', 'ru'),
+    ('enthusiastic', 'обожаю', 'ru'),
+    ('enthusiastic', 'люблю', 'ru'),
+    ('enthusiastic', 'восторг*', 'ru'),
+    ('enthusiastic', 'замечательн*', 'ru'),
+    ('enthusiastic', 'прекрасн*', 'ru'),
+    ('educational', 'как', 'ru'),
+    ('educational', 'что', 'ru'),
+    ('educational', 'почему', 'ru'),
+    ('educational', 'зачем', 'ru'),
+    ('educational', 'когда', 'ru'),
+    ('educational', 'где', 'ru'),
+    ('educational', 'объясни*', 'ru'),
+    ('educational', 'значит', 'ru'),
+    ('educational', 'помоги*', 'ru'),
+    ('educational', 'помочь', 'ru'),
+    ('educational', 'учить', 'ru'),
+    ('educational', 'выучить', 'ru'),
+    ('educational', 'изуч*', 'ru'),
+    ('educational', 'практик*', 'ru'),
+    ('educational', 'правил*', 'ru')
+ON CONFLICT (mood, keyword, language) DO NOTHING;
+
+COMMENT ON TABLE t_p86463701_eloquent_school_site.emotion_keywords IS 'Слова, по которым бот определяет настроение сообщения (режим ответа Ани)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.emotion_keywords.mood IS 'empathetic, enthusiastic или educational (приоритет в этом порядке)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.emotion_keywords.keyword IS 'Целое слово, фраза через пробел или основа со * на конце (груст*)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.emotion_keywords.language IS 'en или ru (русские слова можно выключить EMOTION_RUSSIAN_KEYWORDS=0)';
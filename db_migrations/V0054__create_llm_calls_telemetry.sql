@@ -0,0 +1,32 @@
+-- Телеметрия вызовов LLM и речи (Gemini, Whisper, TTS): одна строка на вызов
+-- Функции копят события в памяти и пишут их пачкой в конце запроса (llm_client.flush_telemetry)
+-- Секции по дням создает и удаляет practice-scheduler (ensure_llm_call_partitions),
+-- до первой секции строки попадают в llm_calls_default
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.llm_calls (
+    called_at TIMESTAMPTZ NOT NULL,
+    service VARCHAR(32) NOT NULL,
+    task VARCHAR(64) NOT NULL,
+    model VARCHAR(64),
+    proxy VARCHAR(255),
+    latency_ms INTEGER NOT NULL,
+    first_chunk_ms INTEGER,
+    prompt_tokens INTEGER,
+    cached_tokens INTEGER,
+    response_tokens INTEGER,
+    outcome VARCHAR(16) NOT NULL,
+    user_hash VARCHAR(16)
+) PARTITION BY RANGE (called_at);
+
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.llm_calls_default
+PARTITION OF t_p86463701_eloquent_school_site.llm_calls DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_llm_calls_task_time
+ON t_p86463701_eloquent_school_site.llm_calls(task, called_at);
+
+COMMENT ON TABLE t_p86463701_eloquent_school_site.llm_calls IS 'Вызовы LLM/речи: латентность, токены и исход по задачам (секции по дням)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.llm_calls.service IS 'Функция: telegram-bot, webapp-api, practice-scheduler';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.llm_calls.task IS 'Тип задачи - параметр task в llm_client (whisper, tts для речи)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.llm_calls.latency_ms IS 'Полное время вызова, для стриминга - до последнего куска';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.llm_calls.first_chunk_ms IS 'Время до первого куска текста (только стриминг)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.llm_calls.outcome IS 'ok, timeout, http_<код>, cancelled или error';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.llm_calls.user_hash IS 'Первые 16 символов sha256 от telegram_id с солью (сам id не хранится)';
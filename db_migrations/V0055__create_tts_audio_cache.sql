@@ -0,0 +1,17 @@
+-- Индекс озвучек по содержимому: ключ sha256(голос, модель, формат, текст) -> файл в S3
+-- Общий для telegram-bot и webapp-api (tts_cache.py): одинаковый текст синтезируется один раз
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.tts_audio_cache (
+    audio_key CHAR(64) PRIMARY KEY,
+    url TEXT NOT NULL,
+    voice VARCHAR(64) NOT NULL,
+    model VARCHAR(64) NOT NULL,
+    audio_format VARCHAR(16) NOT NULL,
+    text_preview VARCHAR(200),
+    size_bytes INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE t_p86463701_eloquent_school_site.tts_audio_cache IS 'Уже синтезированные озвучки (файлы tts/{audio_key}.* в S3) - проверка без head_object';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.tts_audio_cache.audio_key IS 'sha256 от голоса, модели, формата и текста со схлопнутыми пробелами';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.tts_audio_cache.voice IS 'Голос: nova (OpenAI), alena/<язык> (SpeechKit)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.tts_audio_cache.text_preview IS 'Начало текста - для админки и отладки';
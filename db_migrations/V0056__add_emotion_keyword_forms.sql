@@ -0,0 +1,60 @@
+-- Формы английских ключевых слов настроения: после перехода на целые слова (V0053)
+-- "missing", "hurts", "hated", "sadness", "loved" перестали совпадать с "miss", "hurt", "hate", "sad", "love".
+-- Строки настроения заменяют встроенный набор бота, поэтому формы добавляются и сюда (тот же набор, что mood_detector.DEFAULT_KEYWORDS)
+INSERT INTO t_p86463701_eloquent_school_site.emotion_keywords (mood, keyword, language) VALUES
+    ('empathetic', 'die', 'en'),
+    ('empathetic', 'dies', 'en'),
+    ('empathetic', 'killed', 'en'),
+    ('empathetic', 'killing', 'en'),
+    ('empathetic', 'suicid*', 'en'),
+    ('empathetic', 'fears', 'en'),
+    ('empathetic', 'feared', 'en'),
+    ('empathetic', 'fearful', 'en'),
+    ('empathetic', 'scary', 'en'),
+    ('empathetic', 'terrifying', 'en'),
+    ('empathetic', 'panic*', 'en'),
+    ('empathetic', 'loneliness', 'en'),
+    ('empathetic', 'depress*', 'en'),
+    ('empathetic', 'sadder', 'en'),
+    ('empathetic', 'saddest', 'en'),
+    ('empathetic', 'sadly', 'en'),
+    ('empathetic', 'sadness', 'en'),
+    ('empathetic', 'cries', 'en'),
+    ('empathetic', 'cried', 'en'),
+    ('empathetic', 'tears', 'en'),
+    ('empathetic', 'difficult*', 'en'),
+    ('empathetic', 'hard times', 'en'),
+    ('empathetic', 'struggl*', 'en'),
+    ('empathetic', 'pains', 'en'),
+    ('empathetic', 'painful', 'en'),
+    ('empathetic', 'hurt*', 'en'),
+    ('empathetic', 'suffer*', 'en'),
+    ('empathetic', 'missed', 'en'),
+    ('empathetic', 'misses', 'en'),
+    ('empathetic', 'missing', 'en'),
+    ('empathetic', 'hated', 'en'),
+    ('empathetic', 'hates', 'en'),
+    ('empathetic', 'hating', 'en'),
+    ('empathetic', 'hatred', 'en'),
+    ('empathetic', 'anger', 'en'),
+    ('empathetic', 'upset*', 'en'),
+    ('enthusiastic', 'happier', 'en'),
+    ('enthusiastic', 'happiest', 'en'),
+    ('enthusiastic', 'happiness', 'en'),
+    ('enthusiastic', 'joyful', 'en'),
+    ('enthusiastic', 'excit*', 'en'),
+    ('enthusiastic', 'loved', 'en'),
+    ('enthusiastic', 'loves', 'en'),
+    ('enthusiastic', 'loving', 'en'),
+    ('enthusiastic', 'lovely', 'en'),
+    ('enthusiastic', 'amazed', 'en'),
+    ('educational', 'explain*', 'en'),
+    ('educational', 'means', 'en'),
+    ('educational', 'helps', 'en'),
+    ('educational', 'learn*', 'en'),
+    ('educational', 'studies', 'en'),
+    ('educational', 'studied', 'en'),
+    ('educational', 'studying', 'en'),
+    ('educational', 'practic*', 'en'),
+    ('educational', 'practis*', 'en')
+ON CONFLICT (mood, keyword, language) DO NOTHING;
@@ -0,0 +1,14 @@
+-- Общие для инстансов бота кэши контекста Gemini (cachedContents) со скелетом системного промпта
+-- Раньше имя кэша жило в памяти инстанса: каждый теплый инстанс создавал и оплачивал свою копию
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.gemini_context_caches (
+    prompt_hash CHAR(64) PRIMARY KEY,
+    model VARCHAR(64) NOT NULL,
+    cache_name VARCHAR(255) NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE t_p86463701_eloquent_school_site.gemini_context_caches IS 'Кэш контекста Gemini на промпт: инстансы берут готовое имя вместо создания своего (llm_client.set_context_cache_store)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.gemini_context_caches.prompt_hash IS 'sha256 от модели и текста промпта (llm_client.context_cache_hash)';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.gemini_context_caches.cache_name IS 'cachedContents/... в Gemini';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.gemini_context_caches.expires_at IS 'Когда Gemini удалит кэш; в прошлом - кэш отклонен раньше срока, нужно создать новый';
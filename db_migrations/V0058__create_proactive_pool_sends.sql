@@ -0,0 +1,14 @@
+-- Журнал: какие шаблоны пула уже отправлены какому студенту
+-- Без него наименее использованный шаблон мог прийти одному студенту повторно
+CREATE TABLE IF NOT EXISTS t_p86463701_eloquent_school_site.proactive_pool_sends (
+    student_id BIGINT NOT NULL,
+    template_id INTEGER NOT NULL REFERENCES t_p86463701_eloquent_school_site.proactive_message_pool(id),
+    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (student_id, template_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_pool_sends_template
+ON t_p86463701_eloquent_school_site.proactive_pool_sends(template_id);
+
+COMMENT ON TABLE t_p86463701_eloquent_school_site.proactive_pool_sends IS 'Отправленные студенту шаблоны proactive_message_pool - планировщик не берет их повторно';
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.proactive_pool_sends.student_id IS 'telegram_id студента (как student_id в anna_messages)';
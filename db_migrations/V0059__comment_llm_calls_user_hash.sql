@@ -0,0 +1,2 @@
+-- user_hash пишется только при заданной соли LLM_TELEMETRY_SALT (значения по умолчанию больше нет)
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.llm_calls.user_hash IS 'Первые 16 символов sha256 от telegram_id с солью LLM_TELEMETRY_SALT (сам id не хранится); NULL, если соль не задана';
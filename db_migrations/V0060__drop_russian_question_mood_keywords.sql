@@ -0,0 +1,11 @@
+-- Русские вопросительные слова переводили обычную болтовню ("Как дела?", "Что нового?") в учебный режим ответа
+-- Убираем их из набора educational; "значит" (чаще вводное слово) заменяем на "означает"
+DELETE FROM t_p86463701_eloquent_school_site.emotion_keywords
+WHERE language = 'ru' AND mood = 'educational'
+AND keyword IN ('как', 'что', 'почему', 'зачем', 'когда', 'где', 'значит');
+
+INSERT INTO t_p86463701_eloquent_school_site.emotion_keywords (mood, keyword, language) VALUES
+    ('educational', 'означает', 'ru')
+ON CONFLICT (mood, keyword, language) DO NOTHING;
+
+COMMENT ON COLUMN t_p86463701_eloquent_school_site.emotion_keywords.language IS 'en или ru (русские слова учитываются только при EMOTION_RUSSIAN_KEYWORDS=1)';